@@ -0,0 +1,148 @@
+"""Bulk attendance marking.
+
+A roll call is saved with one INSERT ... ON CONFLICT on the (class, student,
+date) unique constraint however many students it covers. sync_roll_calls()
+takes a whole day (or an offline backlog) of roll calls for several classes,
+checks them against the teacher's classes and enrollments in two queries and
+saves every valid record with one upsert.
+
+Reports over a date range are aggregated in the database: per-class counts
+come from one conditional COUNT query and the calendar heatmap from one
+query, whatever the length of the range.
+"""
+from datetime import date, timedelta
+
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .models import Attendance, Class
+
+STATUSES = {value for value, _ in Attendance.STATUS_CHOICES}
+
+# Heatmap days are bitmaps of the statuses marked that day, across classes
+STATUS_BITS = {'present': 1, 'late': 2, 'absent': 4}
+
+
+def upsert(records):
+    """Save Attendance instances, replacing the status of any already marked"""
+    return Attendance.objects.bulk_create(
+        records,
+        update_conflicts=True,
+        unique_fields=['class_obj', 'student', 'date'],
+        update_fields=['status'],
+    )
+
+
+def day_statuses(class_obj, day):
+    """{student_id: status} of everyone marked in class_obj on day"""
+    return dict(Attendance.objects.filter(class_obj=class_obj, date=day).values_list('student_id', 'status'))
+
+
+def parse_date(value, default):
+    if not value:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def sync_roll_calls(teacher, payload):
+    """Save {"date": ..., "classes": [{"class_id", "date"?, "records": [{"student_id", "status"}]}]}.
+
+    Returns (saved count, rejected records with the reason). Records for a
+    class the teacher does not teach, a student not enrolled in it, an unknown
+    status or a future date are rejected, and so is a class entry that is not
+    an object with a list of records; the rest are saved.
+    """
+    today = date.today()
+    default_day = parse_date(payload.get('date'), today)
+    entries = payload.get('classes', [])
+
+    class_ids = {entry['class_id'] for entry in entries if isinstance(entry, dict) and isinstance(entry.get('class_id'), int)}
+    taught = set(Class.objects.filter(id__in=class_ids, teacher=teacher).values_list('id', flat=True))
+    enrolled = set(Class.students.through.objects.filter(class_id__in=taught).values_list('class_id', 'user_id'))
+
+    records, rejected = {}, []
+    for entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get('records', []), list):
+            class_id = entry.get('class_id') if isinstance(entry, dict) else None
+            rejected.append({'class_id': class_id, 'student_id': None, 'error': 'invalid entry'})
+            continue
+        class_id = entry.get('class_id')
+        day = parse_date(entry.get('date'), default_day)
+        for record in entry.get('records', []):
+            student_id = record.get('student_id') if isinstance(record, dict) else None
+            status = record.get('status') if isinstance(record, dict) else None
+            if not isinstance(class_id, int) or class_id not in taught:
+                error = 'not your class'
+            elif day is None or default_day is None:
+                error = 'invalid date'
+            elif day > today:
+                error = 'date in the future'
+            elif not isinstance(student_id, int) or (class_id, student_id) not in enrolled:
+                error = 'student not enrolled'
+            elif not isinstance(status, str) or status not in STATUSES:
+                error = 'invalid status'
+            else:
+                # The last record for a student and day wins, as it would marking by hand
+                records[class_id, student_id, day] = Attendance(class_obj_id=class_id, student_id=student_id, date=day, status=status)
+                continue
+            rejected.append({'class_id': class_id, 'student_id': student_id, 'error': error})
+
+    if records:
+        upsert(list(records.values()))
+    return len(records), rejected
+
+
+def parse_range(params, today):
+    """(start, end) from ?start=&end=, falling back to the month_filter presets; None is an open end.
+
+    Raises ValueError when start or end is given but is not an ISO date.
+    """
+    start = end = None
+    if params.get('month_filter') == 'current':
+        start, end = today.replace(day=1), today
+    elif params.get('month_filter') == 'last':
+        end = today.replace(day=1) - timedelta(days=1)
+        start = end.replace(day=1)
+    start, end = parse_date(params.get('start'), start), parse_date(params.get('end'), end)
+    for name, value in (('start', start), ('end', end)):
+        if value is None and params.get(name):
+            raise ValueError(f'Invalid {name} date, expected YYYY-MM-DD')
+    return start, end
+
+
+def in_range(records, start, end):
+    if start:
+        records = records.filter(date__gte=start)
+    if end:
+        records = records.filter(date__lte=end)
+    return records
+
+
+def class_counts(records):
+    """{class_id: {'total', 'present', 'late', 'absent'}} of records, in one query"""
+    rows = records.order_by().values('class_obj').annotate(
+        total=Count('id'),
+        **{status: Count('id', filter=Q(status=status)) for status in STATUSES},
+    )
+    return {row.pop('class_obj'): row for row in rows}
+
+
+def latest_records(records, limit):
+    """{class_id: [Attendance]} of the latest limit records in each class, in one query"""
+    latest = {}
+    for record in records.annotate(
+        rank=Window(RowNumber(), partition_by=F('class_obj'), order_by=[F('date').desc(), F('id').desc()])
+    ).filter(rank__lte=limit).order_by('class_obj', 'rank'):
+        latest.setdefault(record.class_obj_id, []).append(record)
+    return latest
+
+
+def heatmap(records, start, end):
+    """STATUS_BITS bitmap of each day from start to end, in one query"""
+    days = [0] * ((end - start).days + 1)
+    for day, status in in_range(records, start, end).values_list('date', 'status'):
+        days[(day - start).days] |= STATUS_BITS.get(status, 0)
+    return days
@@ -0,0 +1,124 @@
+"""Score matrices for grade pages.
+
+A Gradebook loads the scores of a class roster (or of one student across
+their classes) as a students x assignments NumPy matrix with a fixed number
+of queries, and computes percentages, class averages, points-weighted totals
+and GPA over the whole matrix at once instead of cell by cell.
+"""
+import csv
+
+import numpy as np
+
+from .models import Assignment, Submission
+
+# A cell starting with one of these runs as a formula in Excel or Sheets
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def csv_text(value):
+    """value for a CSV cell, quoted with ' if a spreadsheet would read it as a formula"""
+    return f"'{value}" if value.startswith(FORMULA_PREFIXES) else value
+
+
+class Gradebook:
+    """Scores of some students on some assignments.
+
+    scores is NaN where there is no graded submission, submitted marks every
+    cell with a submission, graded or not, and feedback maps (row, column) to
+    the teacher's feedback when it was loaded.
+    """
+
+    def __init__(self, students, assignments, cells):
+        self.students = list(students)
+        self.assignments = list(assignments)
+        self.points = np.array([assignment.total_points for assignment in self.assignments], dtype=float)
+        self.scores = np.full((len(self.students), len(self.assignments)), np.nan)
+        self.submitted = np.zeros(self.scores.shape, dtype=bool)
+        self.feedback = {}
+
+        rows = {student.id: i for i, student in enumerate(self.students)}
+        columns = {assignment.id: j for j, assignment in enumerate(self.assignments)}
+        for student_id, assignment_id, score, feedback in cells:
+            i, j = rows[student_id], columns[assignment_id]
+            self.submitted[i, j] = True
+            if score is not None:
+                self.scores[i, j] = score
+            if feedback:
+                self.feedback[i, j] = feedback
+
+        # Classes in order of first assignment, and the class of each column
+        positions = {}
+        for assignment in self.assignments:
+            positions.setdefault(assignment.class_obj_id, len(positions))
+        self.class_ids = list(positions)
+        self.class_index = np.array([positions[assignment.class_obj_id] for assignment in self.assignments], dtype=int)
+
+    @classmethod
+    def for_class(cls, class_obj):
+        """Roster of class_obj against its assignments, in three queries"""
+        students = class_obj.students.order_by('last_name', 'first_name', 'username')
+        assignments = class_obj.assignments.order_by('due_date', 'id')
+        cells = Submission.objects.filter(
+            assignment__class_obj=class_obj, student__in=students.values('id')
+        ).values_list('student_id', 'assignment_id', 'score', 'feedback')
+        return cls(students, assignments, cells)
+
+    @classmethod
+    def for_student(cls, student, classes):
+        """One student against the assignments of classes, in two queries"""
+        assignments = Assignment.objects.filter(class_obj__in=classes).select_related(
+            'class_obj__teacher'
+        ).order_by('class_obj__code', 'due_date', 'id')
+        cells = Submission.objects.filter(
+            student=student, assignment__class_obj__in=classes
+        ).values_list('student_id', 'assignment_id', 'score', 'feedback')
+        return cls([student], assignments, cells)
+
+    @property
+    def graded(self):
+        return ~np.isnan(self.scores)
+
+    def percentages(self):
+        """Each graded score as a percentage of its assignment's points (0 for 0-point assignments)"""
+        points = np.where(self.points > 0, self.points, np.inf)
+        return self.scores * 100 / points
+
+    def _weighted(self, membership):
+        """Points-weighted percentage of each student over the column groups in membership (assignments x groups)"""
+        earned = np.nan_to_num(self.scores) @ membership
+        possible = (self.graded * self.points) @ membership
+        return np.divide(earned * 100, possible, out=np.full(earned.shape, np.nan), where=possible > 0)
+
+    def class_averages(self):
+        """students x classes (in class_ids order) averages over graded work, NaN where nothing is graded"""
+        return self._weighted((self.class_index[:, None] == np.arange(len(self.class_ids))).astype(float))
+
+    def totals(self):
+        """Points-weighted percentage of each student over all graded work"""
+        return self._weighted(np.ones((len(self.assignments), 1)))[:, 0]
+
+    def gpa(self):
+        """Totals on a 4.0 scale"""
+        return self.totals() * 4.0 / 100
+
+    def assignment_averages(self):
+        """Mean percentage of each assignment over the students graded on it"""
+        graded = self.graded.sum(axis=0)
+        return np.divide(
+            np.nansum(self.percentages(), axis=0), graded, out=np.full(len(self.assignments), np.nan), where=graded > 0
+        )
+
+    def write_csv(self, out):
+        """Write one row per student with their scores and total"""
+        writer = csv.writer(out)
+        writer.writerow(
+            ['Student', 'Username']
+            + [csv_text(f'{assignment.title} ({assignment.total_points})') for assignment in self.assignments]
+            + ['Total %']
+        )
+        for student, scores, total in zip(self.students, self.scores, self.totals()):
+            writer.writerow(
+                [csv_text(student.get_full_name()), csv_text(student.username)]
+                + ['' if np.isnan(score) else int(score) for score in scores]
+                + ['' if np.isnan(total) else round(float(total), 1)]
+            )
@@ -49,6 +49,9 @@ class Submission(models.Model):
     
     class Meta:
         unique_together = ['assignment', 'student']
+        indexes = [
+            models.Index(fields=['student', 'score'], name='submission_student_score_idx'),
+        ]
     
     def __str__(self):
         return f"{self.student.username} - {self.assignment.title}"
@@ -67,6 +70,9 @@ class Attendance(models.Model):
     
     class Meta:
         unique_together = ['class_obj', 'student', 'date']
+        indexes = [
+            models.Index(fields=['student', 'date'], name='attendance_student_date_idx'),
+        ]
     
     def __str__(self):
         return f"{self.student.username} - {self.class_obj.code} - {self.date}"
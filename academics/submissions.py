@@ -0,0 +1,28 @@
+"""A student's submission status on lists of assignments.
+
+with_submission_status() annotates any Assignment queryset with the student's
+submission, so pages listing assignments for a student load the status in the
+same query as the assignments instead of one query per assignment.
+"""
+from django.db.models import BooleanField, ExpressionWrapper, F, FilteredRelation, Q
+
+
+def with_submission_status(assignments, student):
+    """Annotate assignments with student's submission.
+
+    Adds submission_id, submission_score, submission_submitted_at and
+    submission_feedback (None without a submission), and the has_submission
+    and is_graded flags.
+    """
+    # One LEFT JOIN on the student's own submission; (assignment, student) is
+    # unique, so it matches at most one row and never repeats an assignment
+    return assignments.annotate(
+        mine=FilteredRelation('submissions', condition=Q(submissions__student=student)),
+    ).annotate(
+        submission_id=F('mine__id'),
+        submission_score=F('mine__score'),
+        submission_submitted_at=F('mine__submitted_at'),
+        submission_feedback=F('mine__feedback'),
+        has_submission=ExpressionWrapper(Q(mine__id__isnull=False), output_field=BooleanField()),
+        is_graded=ExpressionWrapper(Q(mine__score__isnull=False), output_field=BooleanField()),
+    )
@@ -1,3 +1,359 @@
+import json
+from datetime import date, timedelta
+from io import StringIO
+
+import numpy as np
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from .gradebook import Gradebook
+from .models import Assignment, Attendance, Class, Submission
+from .submissions import with_submission_status
+
+
+class AttendanceTests(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='teacher', password='pw', role='teacher')
+        self.client.login(username='teacher', password='pw')
+        self.classes = [
+            Class.objects.create(name=f'Section {i}', code=f'ATT{i}', teacher=self.teacher, semester='1') for i in range(2)
+        ]
+
+    def enroll(self, count, cls=None):
+        start = User.objects.count()
+        students = User.objects.bulk_create([
+            User(username=f'attstudent{start + i}', password='!', role='student') for i in range(count)
+        ])
+        (cls or self.classes[0]).students.add(*students)
+        return students
+
+    def mark(self, statuses):
+        return self.client.post(
+            reverse('academics:mark_attendance', args=[self.classes[0].id]),
+            {f'status_{student.id}': status for student, status in statuses.items()}
+        )
+
+    def test_mark_attendance_query_count_is_flat(self):
+        few = self.enroll(3)
+        # Warm the cached navigation counters so both rounds run the same queries
+        self.client.get(reverse('academics:mark_attendance', args=[self.classes[0].id]))
+        with CaptureQueriesContext(connection) as small_post:
+            self.mark({student: 'present' for student in few})
+        with CaptureQueriesContext(connection) as small_get:
+            self.client.get(reverse('academics:mark_attendance', args=[self.classes[0].id]))
+
+        many = self.enroll(45)
+        with CaptureQueriesContext(connection) as large_post:
+            self.mark({student: 'late' for student in few + many})
+        with CaptureQueriesContext(connection) as large_get:
+            response = self.client.get(reverse('academics:mark_attendance', args=[self.classes[0].id]))
+
+        self.assertEqual(len(small_post), len(large_post))
+        self.assertEqual(len(small_get), len(large_get))
+        self.assertEqual(Attendance.objects.filter(status='late').count(), 48)
+        self.assertEqual(response.context['attendance_records'][few[0].id], 'late')
+
+    def test_mark_attendance_ignores_unknown_status(self):
+        student, other = self.enroll(2)
+        self.mark({student: 'absent', other: 'asleep'})
+        self.assertEqual(list(Attendance.objects.values_list('student', 'status')), [(student.id, 'absent')])
+
+    def test_sync_several_classes(self):
+        first = self.enroll(2)
+        second = self.enroll(2, self.classes[1])
+        stranger = Class.objects.create(
+            name='Other', code='ATTX', teacher=User.objects.create_user(username='other', password='pw', role='teacher'),
+            semester='1'
+        )
+        yesterday = str(date.today() - timedelta(days=1))
+        Attendance.objects.create(class_obj=self.classes[0], student=first[0], date=date.today() - timedelta(days=1), status='absent')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('academics:sync_attendance'), json.dumps({
+                'date': yesterday,
+                'classes': [
+                    {'class_id': self.classes[0].id, 'records': [
+                        {'student_id': first[0].id, 'status': 'present'},
+                        {'student_id': first[1].id, 'status': 'late'},
+                        {'student_id': second[0].id, 'status': 'present'},
+                    ]},
+                    {'class_id': self.classes[1].id, 'date': str(date.today() + timedelta(days=1)), 'records': [
+                        {'student_id': second[0].id, 'status': 'present'},
+                    ]},
+                    {'class_id': self.classes[1].id, 'records': [
+                        {'student_id': second[1].id, 'status': 'gone'},
+                        {'student_id': second[1].id, 'status': 'absent'},
+                    ]},
+                    {'class_id': stranger.id, 'records': [{'student_id': first[0].id, 'status': 'present'}]},
+                ],
+            }), content_type='application/json')
+
+        self.assertEqual(response.json(), {'saved': 3, 'rejected': [
+            {'class_id': self.classes[0].id, 'student_id': second[0].id, 'error': 'student not enrolled'},
+            {'class_id': self.classes[1].id, 'student_id': second[0].id, 'error': 'date in the future'},
+            {'class_id': self.classes[1].id, 'student_id': second[1].id, 'error': 'invalid status'},
+            {'class_id': stranger.id, 'student_id': first[0].id, 'error': 'not your class'},
+        ]})
+        self.assertEqual(
+            sorted(Attendance.objects.filter(date=yesterday).values_list('student', 'status')),
+            [(first[0].id, 'present'), (first[1].id, 'late'), (second[1].id, 'absent')]
+        )
+        # Session, user, classes, enrollments and the upsert
+        self.assertEqual(len(queries), 5)
+
+    def test_sync_rejects_malformed_payload(self):
+        response = self.client.post(reverse('academics:sync_attendance'), '{"classes": 3}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_sync_rejects_malformed_entries(self):
+        student, = self.enroll(1)
+        response = self.client.post(reverse('academics:sync_attendance'), json.dumps({'classes': [
+            'oops',
+            {'class_id': self.classes[0].id, 'records': 5},
+            {'class_id': [self.classes[0].id], 'records': [{'student_id': student.id, 'status': 'present'}]},
+            {'class_id': self.classes[0].id, 'records': [{'student_id': [student.id], 'status': ['present']}, 'present']},
+            {'class_id': self.classes[0].id, 'records': [{'student_id': student.id, 'status': 'present'}]},
+        ]}), content_type='application/json')
+
+        self.assertEqual(response.json(), {'saved': 1, 'rejected': [
+            {'class_id': None, 'student_id': None, 'error': 'invalid entry'},
+            {'class_id': self.classes[0].id, 'student_id': None, 'error': 'invalid entry'},
+            {'class_id': [self.classes[0].id], 'student_id': student.id, 'error': 'not your class'},
+            {'class_id': self.classes[0].id, 'student_id': [student.id], 'error': 'student not enrolled'},
+            {'class_id': self.classes[0].id, 'student_id': None, 'error': 'student not enrolled'},
+        ]})
+        self.assertEqual(list(Attendance.objects.values_list('student', 'status')), [(student.id, 'present')])
+
+
+class GradebookTests(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='teacher', password='pw', role='teacher')
+        self.student = User.objects.create_user(username='student', password='pw', role='student', first_name='Ana')
+        self.other = User.objects.create_user(username='other', password='pw', role='student', first_name='Ben')
+        self.classes = [
+            Class.objects.create(name=f'Subject {i}', code=f'GB{i}', teacher=self.teacher, semester='1') for i in range(2)
+        ]
+        for cls in self.classes:
+            cls.students.add(self.student, self.other)
+
+    def assignments(self, cls, *points):
+        return [
+            Assignment.objects.create(class_obj=cls, title=f'{cls.code} {i}', description='', due_date=timezone.now(), total_points=p)
+            for i, p in enumerate(points)
+        ]
+
+    def submit(self, assignment, student, score, feedback=''):
+        Submission.objects.create(assignment=assignment, student=student, score=score, feedback=feedback)
+
+    def test_matrix_math(self):
+        quiz, exam, ungraded = self.assignments(self.classes[0], 10, 90, 20)
+        self.submit(quiz, self.student, 5)
+        self.submit(exam, self.student, 90)
+        self.submit(ungraded, self.student, None)
+        self.submit(quiz, self.other, 10)
+
+        gradebook = Gradebook.for_class(self.classes[0])
+        np.testing.assert_allclose(gradebook.percentages()[0], [50, 100, np.nan])
+        # Points-weighted, so the exam counts nine times the quiz
+        np.testing.assert_allclose(gradebook.totals(), [95, 100])
+        np.testing.assert_allclose(gradebook.gpa(), [3.8, 4.0])
+        np.testing.assert_allclose(gradebook.assignment_averages(), [75, 100, np.nan])
+        self.assertTrue(gradebook.submitted[0, 2])
+
+    def test_student_grades_query_count_is_flat(self):
+        self.client.login(username='student', password='pw')
+        self.client.get(reverse('academics:student_grades'))
+        first = self.assignments(self.classes[0], 10)
+        self.submit(first[0], self.student, 8, 'Good')
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('academics:student_grades'))
+
+        for cls in self.classes:
+            for assignment in self.assignments(cls, 10, 10, 10):
+                self.submit(assignment, self.student, 10)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('academics:student_grades'))
+
+        self.assertEqual(len(few), len(many))
+        first_class = response.context['grades_by_class'][0]
+        self.assertEqual(len(first_class['grades']), 4)
+        self.assertEqual(first_class['grades'][0]['feedback'], 'Good')
+        self.assertAlmostEqual(first_class['average'], 95.0)
+        self.assertEqual(response.context['gpa'], 3.89)
+
+    def test_teacher_gradebook_and_csv(self):
+        quiz, exam = self.assignments(self.classes[0], 10, 20)
+        self.submit(quiz, self.student, 7)
+        self.submit(exam, self.other, 20)
+
+        self.client.login(username='teacher', password='pw')
+        response = self.client.get(reverse('academics:class_gradebook', args=[self.classes[0].id]))
+        self.assertEqual([row['total'] for row in response.context['rows']], [70.0, 100.0])
+
+        response = self.client.get(reverse('academics:class_gradebook', args=[self.classes[0].id]), {'format': 'csv'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response.content.decode().splitlines(), [
+            'Student,Username,GB0 0 (10),GB0 1 (20),Total %',
+            'Ana,student,7,,70.0',
+            'Ben,other,,20,100.0',
+        ])
+
+        self.client.login(username='student', password='pw')
+        response = self.client.get(reverse('academics:class_gradebook', args=[self.classes[0].id]))
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+
+    def test_csv_does_not_export_formulas(self):
+        quiz, = self.assignments(self.classes[0], 10)
+        Assignment.objects.filter(pk=quiz.pk).update(title='=HYPERLINK("http://evil")')
+        User.objects.filter(pk=self.student.pk).update(first_name='+cmd', last_name='')
+        User.objects.filter(pk=self.other.pk).update(first_name='-1', last_name='', username='@other')
+
+        out = StringIO()
+        Gradebook.for_class(self.classes[0]).write_csv(out)
+        self.assertEqual(out.getvalue().splitlines(), [
+            'Student,Username,"\'=HYPERLINK(""http://evil"") (10)",Total %',
+            "'+cmd,student,,",
+            "'-1,'@other,,",
+        ])
+
+
+class SubmissionStatusTests(TestCase):
+    def setUp(self):
+        teacher = User.objects.create_user(username='teacher', password='pw', role='teacher')
+        self.student = User.objects.create_user(username='student', password='pw', role='student')
+        self.client.login(username='student', password='pw')
+        self.cls = Class.objects.create(name='History', code='HIS', teacher=teacher, semester='1')
+        self.cls.students.add(self.student)
+        self.count = 0
+
+    def add_assignments(self, count):
+        """Add count assignments to the class, alternating graded, ungraded and unsubmitted ones"""
+        for i in range(count):
+            self.count += 1
+            assignment = Assignment.objects.create(
+                class_obj=self.cls, title=f'Essay {self.count}', description='',
+                due_date=timezone.now() + timedelta(days=self.count - 3), total_points=10
+            )
+            if self.count % 3 == 1:
+                Submission.objects.create(assignment=assignment, student=self.student, score=9, feedback='Well argued')
+            elif self.count % 3 == 2:
+                Submission.objects.create(assignment=assignment, student=self.student)
+
+    def assertQueryCountIsFlat(self, url):
+        self.client.get(url)
+        self.add_assignments(3)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        self.add_assignments(30)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(len(few), len(many))
+        return response
+
+    def test_student_assignments(self):
+        response = self.assertQueryCountIsFlat(reverse('academics:student_assignments'))
+        self.assertEqual(response.context['completed_count'], 22)
+        self.assertEqual(response.context['overdue_count'], 1)
+        self.assertEqual(response.context['upcoming_count'], 10)
+        graded = response.context['completed_assignments'][0]
+        self.assertEqual((graded.submission_score, graded.submission_feedback, graded.is_graded), (9, 'Well argued', True))
+        self.assertContains(response, 'Well argued')
+
+    def test_class_detail(self):
+        response = self.assertQueryCountIsFlat(reverse('academics:class_detail', args=[self.cls.id]))
+        flags = {assignment.title: assignment.has_submission for assignment in response.context['assignments']}
+        self.assertEqual(sum(flags.values()), 22)
+        self.assertFalse(flags['Essay 3'])
+
+    def test_other_students_submissions_are_ignored(self):
+        self.add_assignments(3)
+        other = User.objects.create_user(username='other', password='pw', role='student')
+        for assignment in Assignment.objects.all():
+            Submission.objects.create(assignment=assignment, student=other, score=1, feedback='Too short')
+
+        assignments = with_submission_status(Assignment.objects.order_by('title'), self.student)
+        # One join on the student's submission, no subquery per column
+        self.assertEqual(str(assignments.query).count('SELECT'), 1)
+        self.assertEqual(
+            [(a.title, a.has_submission, a.is_graded, a.submission_score, a.submission_feedback) for a in assignments],
+            [('Essay 1', True, True, 9, 'Well argued'), ('Essay 2', True, False, None, ''), ('Essay 3', False, False, None, None)],
+        )
+        self.assertEqual(assignments.filter(has_submission=False).count(), 1)
+
+
+class StudentAttendanceReportTests(TestCase):
+    def setUp(self):
+        teacher = User.objects.create_user(username='teacher', password='pw', role='teacher')
+        self.student = User.objects.create_user(username='student', password='pw', role='student')
+        self.client.login(username='student', password='pw')
+        self.classes = [
+            Class.objects.create(name=f'Subject {i}', code=f'REP{i}', teacher=teacher, semester='1') for i in range(3)
+        ]
+        for cls in self.classes:
+            cls.students.add(self.student)
+        self.today = timezone.now().date()
+
+    def mark(self, days, statuses, classes=None):
+        Attendance.objects.bulk_create([
+            Attendance(class_obj=cls, student=self.student, date=self.today - timedelta(days=day), status=statuses[day % len(statuses)])
+            for cls in classes or self.classes for day in days
+        ])
+
+    def test_query_count_is_flat_for_any_range(self):
+        url = reverse('academics:student_attendance')
+        self.client.get(url)
+        self.mark(range(3), ['present'], self.classes[:1])
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url)
+        self.mark(range(3, 120), ['present', 'late', 'absent'])
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url, {'start': str(self.today - timedelta(days=100))})
+
+        self.assertEqual(len(small), len(large))
+        first = response.context['attendance_by_class'][0]
+        # 101 days in range: 3 marked present only in the first class, 98 cycling through the statuses
+        self.assertEqual((first['present'], first['late'], first['absent'], first['total']), (36, 33, 32, 101))
+        self.assertEqual(len(first['records']), 30)
+        self.assertEqual(first['records'][0].date, self.today)
+        self.assertEqual(response.context['total_count'], 101 + 98 * 2)
+
+    def test_month_presets_and_class_filter(self):
+        self.mark(range(0, 70), ['present'])
+        response = self.client.get(reverse('academics:student_attendance'), {
+            'month_filter': 'last', 'class_filter': str(self.classes[1].id)
+        })
+        last_month_end = self.today.replace(day=1) - timedelta(days=1)
+        self.assertEqual(response.context['end'], last_month_end)
+        self.assertEqual([row['class'] for row in response.context['attendance_by_class']], [self.classes[1]])
+        self.assertEqual(response.context['attendance_by_class'][0]['total'], last_month_end.day)
+
+    def test_heatmap(self):
+        self.mark([0], ['present'], self.classes[:1])
+        self.mark([0], ['late'], self.classes[1:2])
+        self.mark([2], ['absent'], self.classes[:1])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('academics:student_attendance_heatmap'), {
+                'start': str(self.today - timedelta(days=3)), 'end': str(self.today)
+            })
+        self.assertEqual(response.json()['days'], [0, 4, 0, 3])
+        # Session, user and the attendance query
+        self.assertEqual(len(queries), 3)
+
+        response = self.client.get(reverse('academics:student_attendance_heatmap'), {'start': '2000-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unparseable_dates_are_rejected(self):
+        for params in [{'start': '2024-13-01'}, {'end': 'yesterday'}, {'start': str(self.today), 'end': '01/02/2024'}]:
+            response = self.client.get(reverse('academics:student_attendance_heatmap'), params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('expected YYYY-MM-DD', response.json()['error'])
 
-# Create your tests here.
+        # The report page falls back to the month preset and says why
+        response = self.client.get(reverse('academics:student_attendance'), {'month_filter': 'current', 'start': 'soon'})
+        self.assertEqual((response.context['start'], response.context['end']), (self.today.replace(day=1), self.today))
+        self.assertContains(response, 'Invalid start date')
@@ -16,8 +16,10 @@ urlpatterns = [
     path('class/<int:class_id>/students/drop/<int:student_id>/', views.drop_student, name='drop_student'),
     path('class/<int:class_id>/assignment/create/', views.create_assignment, name='create_assignment'),
     path('class/<int:class_id>/attendance/', views.mark_attendance, name='mark_attendance'),
+    path('attendance/sync/', views.sync_attendance, name='sync_attendance'),
     path('class/<int:class_id>/assignment/<int:assignment_id>/submissions/', views.view_submissions, name='view_submissions'),
     path('submission/<int:submission_id>/grade/', views.grade_submission, name='grade_submission'),
+    path('class/<int:class_id>/gradebook/', views.class_gradebook, name='class_gradebook'),
     path('class/<int:class_id>/material/upload/', views.upload_material, name='upload_material'),
     path('material/<int:material_id>/delete/', views.delete_material, name='delete_material'),
     
@@ -28,4 +30,5 @@ urlpatterns = [
     path('student/assignment/<int:assignment_id>/submit/', views.submit_assignment, name='submit_assignment'),
     path('student/grades/', views.student_grades, name='student_grades'),
     path('student/attendance/', views.student_attendance, name='student_attendance'),
+    path('student/attendance/heatmap/', views.student_attendance_heatmap, name='student_attendance_heatmap'),
 ]
@@ -2,13 +2,27 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db.models import Q, Avg
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_POST
 from django.utils import timezone
 from .models import Class, Announcement, Material, Assignment, Attendance, Submission, Grade
 from .forms import ClassForm, AssignmentForm, MaterialForm
+from .attendance import (
+    STATUS_BITS, STATUSES, class_counts, day_statuses, heatmap, in_range, latest_records, parse_range, sync_roll_calls,
+    upsert,
+)
+from .gradebook import Gradebook
+from .submissions import with_submission_status
 from datetime import date, datetime, timedelta
 import json
 
+import numpy as np
+
+# Records listed per class on the student attendance page; the counts cover the whole range
+RECENT_RECORDS = 30
+# Longest range the attendance heatmap API serves
+HEATMAP_MAX_DAYS = 366 * 5
+
 @login_required
 def class_detail(request, class_id):
     class_obj = get_object_or_404(Class, id=class_id)
@@ -27,13 +41,9 @@ def class_detail(request, class_id):
     materials = class_obj.materials.all()
     assignments = class_obj.assignments.all().order_by('-due_date')
     
-    # For students, check submission status for each assignment
+    # For students, load their submission status with the assignments
     if request.user.role == 'student':
-        for assignment in assignments:
-            assignment.has_submission = Submission.objects.filter(
-                assignment=assignment,
-                student=request.user
-            ).exists()
+        assignments = with_submission_status(assignments, request.user)
     
     context = {
         'class': class_obj,
@@ -229,26 +239,17 @@ def mark_attendance(request, class_id):
     today = date.today()
     
     if request.method == 'POST':
-        for student in students:
-            status = request.POST.get(f'status_{student.id}')
-            if status:
-                Attendance.objects.update_or_create(
-                    class_obj=class_obj,
-                    student=student,
-                    date=today,
-                    defaults={'status': status}
-                )
+        # One upsert for the whole class instead of a query per student
+        upsert([
+            Attendance(class_obj=class_obj, student_id=student_id, date=today, status=request.POST[f'status_{student_id}'])
+            for student_id in students.values_list('id', flat=True)
+            if request.POST.get(f'status_{student_id}') in STATUSES
+        ])
         messages.success(request, 'Attendance marked successfully!')
         return redirect('academics:class_detail', class_id=class_id)
     
     # Get today's attendance
-    attendance_records = {}
-    for student in students:
-        try:
-            record = Attendance.objects.get(class_obj=class_obj, student=student, date=today)
-            attendance_records[student.id] = record.status
-        except Attendance.DoesNotExist:
-            attendance_records[student.id] = None
+    attendance_records = day_statuses(class_obj, today)
     
     context = {
         'class': class_obj,
@@ -258,6 +259,22 @@ def mark_attendance(request, class_id):
     }
     return render(request, 'academics/mark_attendance.html', context)
 
+@login_required
+@require_POST
+def sync_attendance(request):
+    """Save roll calls for several classes at once (e.g. an offline tablet's backlog) as JSON"""
+    if request.user.role != 'teacher':
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    if not isinstance(payload, dict) or not isinstance(payload.get('classes'), list):
+        return JsonResponse({'error': 'Expected {"date": ..., "classes": [...]}'}, status=400)
+    
+    saved, rejected = sync_roll_calls(request.user, payload)
+    return JsonResponse({'saved': saved, 'rejected': rejected})
+
 @login_required
 def view_submissions(request, class_id, assignment_id):
     class_obj = get_object_or_404(Class, id=class_id)
@@ -327,6 +344,48 @@ def grade_submission(request, submission_id):
     }
     return render(request, 'academics/grade_submission.html', context)
 
+@login_required
+def class_gradebook(request, class_id):
+    class_obj = get_object_or_404(Class, id=class_id)
+    
+    if request.user.role != 'teacher' or class_obj.teacher != request.user:
+        messages.error(request, 'Permission denied.')
+        return redirect('dashboard')
+    
+    gradebook = Gradebook.for_class(class_obj)
+    
+    if request.GET.get('format') == 'csv':
+        response = HttpResponse(content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="{class_obj.code}-gradebook.csv"'
+        gradebook.write_csv(response)
+        return response
+    
+    totals = gradebook.totals()
+    rows = [
+        {
+            'student': student,
+            'cells': [
+                {'score': None if np.isnan(score) else int(score), 'submitted': submitted}
+                for score, submitted in zip(scores, submitted_row)
+            ],
+            'total': None if np.isnan(total) else float(total),
+        }
+        for student, scores, submitted_row, total in zip(
+            gradebook.students, gradebook.scores, gradebook.submitted, totals
+        )
+    ]
+    
+    context = {
+        'class': class_obj,
+        'columns': [
+            {'assignment': assignment, 'average': None if np.isnan(average) else float(average)}
+            for assignment, average in zip(gradebook.assignments, gradebook.assignment_averages())
+        ],
+        'rows': rows,
+        'class_average': float(np.nanmean(totals)) if (~np.isnan(totals)).any() else None,
+    }
+    return render(request, 'academics/class_gradebook.html', context)
+
 @login_required
 def upload_material(request, class_id):
     class_obj = get_object_or_404(Class, id=class_id)
@@ -490,7 +549,9 @@ def student_assignments(request):
         return redirect('dashboard')
     
     my_classes = request.user.enrolled_classes.all()
-    all_assignments = Assignment.objects.filter(class_obj__in=my_classes)
+    all_assignments = with_submission_status(
+        Assignment.objects.filter(class_obj__in=my_classes).select_related('class_obj'), request.user
+    )
     
     now = timezone.now()
     upcoming_assignments = []
@@ -498,11 +559,9 @@ def student_assignments(request):
     completed_assignments = []
     
     for assignment in all_assignments:
-        submission = Submission.objects.filter(assignment=assignment, student=request.user).first()
-        assignment.submission = submission
         assignment.is_overdue = assignment.due_date < now
         
-        if submission:
+        if assignment.has_submission:
             completed_assignments.append(assignment)
         elif assignment.is_overdue:
             overdue_assignments.append(assignment)
@@ -587,56 +646,38 @@ def student_grades(request):
     if class_filter:
         my_classes = my_classes.filter(id=class_filter)
     
-    grades_by_class = []
-    total_score = 0
-    total_points = 0
+    # The whole score matrix in two queries rather than one per assignment
+    gradebook = Gradebook.for_student(request.user, my_classes)
+    percentages = gradebook.percentages()[0]
+    averages = gradebook.class_averages()[0]
     
-    for class_obj in my_classes:
-        assignments = Assignment.objects.filter(class_obj=class_obj)
+    grades_by_class = []
+    for position, class_id in enumerate(gradebook.class_ids):
         grades = []
-        class_score = 0
-        class_points = 0
-        
-        for assignment in assignments:
-            submission = Submission.objects.filter(assignment=assignment, student=request.user).first()
-            if submission and submission.score is not None:
-                percentage = (submission.score / assignment.total_points) * 100 if assignment.total_points > 0 else 0
-                grades.append({
-                    'assignment': assignment,
-                    'submission': submission,
-                    'score': submission.score,
-                    'percentage': percentage,
-                    'feedback': submission.feedback,
-                })
-                class_score += submission.score
-                class_points += assignment.total_points
-                total_score += submission.score
-                total_points += assignment.total_points
-            elif submission:
-                grades.append({
-                    'assignment': assignment,
-                    'submission': submission,
-                    'score': None,
-                    'percentage': None,
-                    'feedback': None,
-                })
-        
-        class_average = (class_score / class_points * 100) if class_points > 0 else None
+        for column in np.flatnonzero((gradebook.class_index == position) & gradebook.submitted[0]):
+            graded = gradebook.graded[0, column]
+            grades.append({
+                'assignment': gradebook.assignments[column],
+                'submission': True,
+                'score': int(gradebook.scores[0, column]) if graded else None,
+                'percentage': float(percentages[column]) if graded else None,
+                'feedback': gradebook.feedback.get((0, column)) if graded else None,
+            })
         
         if grades:
             grades_by_class.append({
-                'class': class_obj,
+                'class': grades[0]['assignment'].class_obj,
                 'grades': grades,
-                'average': class_average,
+                'average': None if np.isnan(averages[position]) else float(averages[position]),
             })
     
-    gpa = (total_score / total_points * 4.0) if total_points > 0 else None
+    gpa = gradebook.gpa()[0]
     
     context = {
         'grades_by_class': grades_by_class,
         'my_classes': request.user.enrolled_classes.all(),
         'class_filter': class_filter,
-        'gpa': round(gpa, 2) if gpa else None,
+        'gpa': None if np.isnan(gpa) else round(float(gpa), 2),
     }
     return render(request, 'academics/student_grades.html', context)
 
@@ -646,63 +687,82 @@ def student_attendance(request):
         messages.error(request, 'Permission denied.')
         return redirect('dashboard')
     
-    my_classes = request.user.enrolled_classes.all()
+    my_classes = list(request.user.enrolled_classes.select_related('teacher'))
     class_filter = request.GET.get('class_filter', '')
     month_filter = request.GET.get('month_filter', '')
+    try:
+        start, end = parse_range(request.GET, timezone.now().date())
+    except ValueError as error:
+        messages.error(request, str(error))
+        start, end = parse_range({'month_filter': month_filter}, timezone.now().date())
     
-    if class_filter:
-        my_classes = my_classes.filter(id=class_filter)
-    
-    attendance_records = Attendance.objects.filter(student=request.user)
+    attendance_records = in_range(Attendance.objects.filter(student=request.user), start, end)
     
-    if month_filter:
-        today = timezone.now().date()
-        if month_filter == 'current':
-            attendance_records = attendance_records.filter(date__month=today.month, date__year=today.year)
-        elif month_filter == 'last':
-            last_month = today.replace(day=1) - timedelta(days=1)
-            attendance_records = attendance_records.filter(date__month=last_month.month, date__year=last_month.year)
-    
-    # Overall stats
-    present_count = attendance_records.filter(status='present').count()
-    late_count = attendance_records.filter(status='late').count()
-    absent_count = attendance_records.filter(status='absent').count()
-    total_count = attendance_records.count()
-    overall_rate = (present_count / total_count * 100) if total_count > 0 else 0
+    # Counts per class from one aggregate query; the overall stats are their sums
+    counts = class_counts(attendance_records)
+    totals = {key: sum(row[key] for row in counts.values()) for key in ['present', 'late', 'absent', 'total']}
+    overall_rate = (totals['present'] / totals['total'] * 100) if totals['total'] > 0 else 0
     
     # By class
+    shown = [class_obj for class_obj in my_classes if not class_filter or str(class_obj.id) == class_filter]
+    records = latest_records(attendance_records.filter(class_obj__in=[class_obj.id for class_obj in shown]), RECENT_RECORDS)
     attendance_by_class = []
-    for class_obj in my_classes:
-        class_records = attendance_records.filter(class_obj=class_obj).order_by('-date')
-        class_present = class_records.filter(status='present').count()
-        class_late = class_records.filter(status='late').count()
-        class_absent = class_records.filter(status='absent').count()
-        class_total = class_records.count()
-        class_rate = (class_present / class_total * 100) if class_total > 0 else 0
-        
-        if class_total > 0:
+    for class_obj in shown:
+        row = counts.get(class_obj.id)
+        if row:
             attendance_by_class.append({
                 'class': class_obj,
-                'records': class_records,
-                'present': class_present,
-                'late': class_late,
-                'absent': class_absent,
-                'rate': round(class_rate, 1),
+                'records': records.get(class_obj.id, []),
+                'present': row['present'],
+                'late': row['late'],
+                'absent': row['absent'],
+                'total': row['total'],
+                'rate': round(row['present'] / row['total'] * 100, 1),
             })
     
     context = {
         'attendance_by_class': attendance_by_class,
-        'my_classes': request.user.enrolled_classes.all(),
+        'my_classes': my_classes,
         'class_filter': class_filter,
         'month_filter': month_filter,
-        'present_count': present_count,
-        'late_count': late_count,
-        'absent_count': absent_count,
-        'total_count': total_count,
+        'start': start,
+        'end': end,
+        'recent_records': RECENT_RECORDS,
+        'present_count': totals['present'],
+        'late_count': totals['late'],
+        'absent_count': totals['absent'],
+        'total_count': totals['total'],
         'overall_rate': round(overall_rate, 1),
     }
     return render(request, 'academics/student_attendance.html', context)
 
+@login_required
+def student_attendance_heatmap(request):
+    """Per-day attendance bitmaps for the calendar heatmap, one query for any range"""
+    if request.user.role != 'student':
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    today = timezone.now().date()
+    try:
+        start, end = parse_range(request.GET, today)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    end = end or today
+    start = start or end - timedelta(days=364)
+    if start > end or (end - start).days >= HEATMAP_MAX_DAYS:
+        return JsonResponse({'error': f'Expected a start date before the end date, at most {HEATMAP_MAX_DAYS} days apart'}, status=400)
+    
+    records = Attendance.objects.filter(student=request.user)
+    if request.GET.get('class_filter', '').isdigit():
+        records = records.filter(class_obj_id=request.GET['class_filter'])
+    
+    return JsonResponse({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'bits': STATUS_BITS,
+        'days': heatmap(records, start, end),
+    })
+
 @login_required
 def edit_class(request, class_id):
     class_obj = get_object_or_404(Class, id=class_id)
@@ -199,17 +199,10 @@ def admin_teacher_dashboard(request, teacher_id):
     classes = Class.objects.filter(teacher=teacher)
     
     # Get all students in teacher's classes
-    students = set()
-    for cls in classes:
-        students.update(cls.students.all())
+    students = User.objects.filter(enrolled_classes__teacher=teacher).distinct()
     
     # Get at-risk students
-    from wellness.models import RiskAssessment
-    at_risk_students = []
-    for student in students:
-        latest_assessment = RiskAssessment.objects.filter(student=student).order_by('-date').first()
-        if latest_assessment and latest_assessment.risk_level == 'high':
-            at_risk_students.append(student)
+    at_risk_students = list(students.filter(current_risk__risk_level='high'))
     
     # Count pending grades
     from academics.models import Submission
@@ -222,7 +215,7 @@ def admin_teacher_dashboard(request, teacher_id):
         'teacher': teacher,
         'classes': classes,
         'at_risk_students': at_risk_students,
-        'total_students': len(students),
+        'total_students': students.count(),
         'pending_grades': pending_grades,
         'at_risk_count': len(at_risk_students),
     }
@@ -299,3 +292,21 @@ def admin_enroll_student(request):
         'recent_enrollments': recent_enrollments[:10],
     }
     return render(request, 'admin/enroll_student.html', context)
+
+@login_required
+def admin_job_queue(request):
+    if request.user.role.lower() != 'admin':
+        messages.error(request, 'Permission denied. Admin access required.')
+        return redirect('dashboard')
+
+    from jobs.models import Job
+    from jobs.queue import queue_stats
+
+    stats = queue_stats()
+    context = {
+        'stats': stats,
+        'total_queued': sum(row['queued'] for row in stats),
+        'oldest_runnable': min((row['oldest_runnable'] for row in stats if row['oldest_runnable']), default=None),
+        'recent_failures': Job.objects.exclude(last_error='').order_by('-id')[:10],
+    }
+    return render(request, 'admin/job_queue.html', context)
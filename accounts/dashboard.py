@@ -0,0 +1,38 @@
+"""Cached submission figures for the teacher dashboard.
+
+The pending-grade count and the recent submissions of a teacher's classes are
+cached per teacher. Signals delete the entry whenever a submission in one of
+their classes is saved or deleted, so the dashboard only goes to the database
+for them after a change.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+TEACHER_STATS_KEY = 'dashboard:teacher:{}'
+# Signals keep the entry current; the timeout only bounds how long it can stay
+# off after a change they did not see (a class moved to another teacher)
+TEACHER_STATS_TIMEOUT = 10 * 60
+RECENT_SUBMISSIONS = 10
+
+
+def teacher_submission_stats(teacher):
+    """{'pending_grades', 'recent_submissions'} of teacher's classes"""
+    key = TEACHER_STATS_KEY.format(teacher.pk)
+    stats = cache.get(key)
+    if stats is None:
+        from academics.models import Submission
+        submissions = Submission.objects.filter(assignment__class_obj__teacher=teacher)
+        stats = {
+            'pending_grades': submissions.filter(score__isnull=True).count(),
+            'recent_submissions': list(
+                submissions.select_related('student', 'assignment', 'assignment__class_obj').order_by('-submitted_at')[:RECENT_SUBMISSIONS]
+            ),
+        }
+        cache.set(key, stats, TEACHER_STATS_TIMEOUT)
+    return stats
+
+
+def submissions_changed(teacher_ids):
+    keys = [TEACHER_STATS_KEY.format(teacher_id) for teacher_id in set(teacher_ids) if teacher_id is not None]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
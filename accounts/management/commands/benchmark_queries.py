@@ -0,0 +1,201 @@
+import random
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from accounts.models import User
+from academics.models import Class, Assignment, Submission, Attendance
+from messaging.models import Conversation, Message
+from wellness.models import WellnessCheckIn, RiskAssessment, Intervention, Alert
+
+# Indexes added for the hot query shapes, per model
+BENCHMARK_INDEXES = {
+    Alert: ['alert_resolved_sev_read_idx', 'alert_open_created_idx', 'alert_open_student_type_idx'],
+    RiskAssessment: ['risk_student_date_idx'],
+    WellnessCheckIn: ['checkin_student_date_idx'],
+    Message: ['message_conv_read_sender_idx', 'message_unread_idx'],
+    Attendance: ['attendance_student_date_idx'],
+    Submission: ['submission_student_score_idx'],
+    Intervention: ['intervention_status_date_idx'],
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Seed a large dataset and compare query plans and timings of the hot queries without and with indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=2000, help='Number of students to seed (default 2000, 0 to use existing data)')
+        parser.add_argument('--repeat', type=int, default=50, help='Lookups per query shape (default 50)')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded data instead of rolling it back')
+        parser.add_argument('--no-plans', action='store_true', help='Only print timings, not query plans')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['students']:
+                    self.seed(options['students'])
+                self.analyze()
+
+                shapes = self.query_shapes()
+
+                self.set_indexes(present=False)
+                self.analyze()
+                before = self.run_shapes(shapes, options, 'without indexes')
+
+                self.set_indexes(present=True)
+                self.analyze()
+                after = self.run_shapes(shapes, options, 'with indexes')
+
+                self.stdout.write('\nQuery shape' + ' ' * 30 + '  before      after   speedup')
+                for label, _ in shapes:
+                    speedup = before[label] / after[label] if after[label] else 0
+                    self.stdout.write(f'{label:<41} {before[label]:7.2f}ms {after[label]:7.2f}ms {speedup:7.1f}x')
+
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write(self.style.SUCCESS('\nBenchmark complete, seeded data rolled back'))
+        else:
+            self.stdout.write(self.style.SUCCESS('\nBenchmark complete, seeded data kept'))
+
+    def seed(self, count):
+        self.stdout.write(f'Seeding {count} students...')
+        start = time.perf_counter()
+        now = timezone.now()
+        prefix = f'bench{int(time.time())}'
+        rng = random.Random(42)
+
+        teacher = User.objects.create_user(username=f'{prefix}_teacher', role='teacher')
+        counselor = User.objects.create_user(username=f'{prefix}_counselor', role='counselor')
+        students = User.objects.bulk_create([
+            User(username=f'{prefix}_s{i}', role='student', first_name='Bench', last_name=f'Student {i}', password='!')
+            for i in range(count)
+        ], batch_size=1000)
+
+        classes = Class.objects.bulk_create([
+            Class(name=f'Bench {i}', code=f'{prefix}-{i}', teacher=teacher, semester='Bench')
+            for i in range(max(count // 40, 1))
+        ])
+        Class.students.through.objects.bulk_create([
+            Class.students.through(class_id=classes[i % len(classes)].id, user_id=student.id)
+            for i, student in enumerate(students)
+        ], batch_size=5000)
+        assignments = Assignment.objects.bulk_create([
+            Assignment(class_obj=cls, title=f'Task {j}', description='', due_date=now - timedelta(days=j), total_points=100)
+            for cls in classes for j in range(10)
+        ], batch_size=5000)
+
+        by_class = {}
+        for assignment in assignments:
+            by_class.setdefault(assignment.class_obj_id, []).append(assignment)
+
+        days = [date.today() - timedelta(days=d) for d in range(60)]
+        Attendance.objects.bulk_create([
+            Attendance(class_obj=classes[i % len(classes)], student=student, date=day, status=rng.choice(['present', 'present', 'present', 'late', 'absent']))
+            for i, student in enumerate(students) for day in days
+        ], batch_size=5000)
+        Submission.objects.bulk_create([
+            Submission(assignment=assignment, student=student, score=rng.choice([None, rng.randint(40, 100)]))
+            for i, student in enumerate(students) for assignment in by_class[classes[i % len(classes)].id] if rng.random() < 0.8
+        ], batch_size=5000)
+        WellnessCheckIn.objects.bulk_create([
+            WellnessCheckIn(student=student, stress_level=rng.randint(1, 5), motivation_level=rng.randint(1, 5), workload_level=3, sleep_quality=3)
+            for student in students for _ in range(10)
+        ], batch_size=5000)
+        RiskAssessment.objects.bulk_create([
+            RiskAssessment(student=student, risk_level=rng.choice(['low', 'medium', 'high']), risk_score=rng.randint(0, 100))
+            for student in students for _ in range(10)
+        ], batch_size=5000)
+        Alert.objects.bulk_create([
+            Alert(student=student, alert_type='high_risk', severity=rng.choice(['critical', 'high', 'medium', 'low']),
+                  message='Benchmark alert', resolved=rng.random() < 0.9, is_read=rng.random() < 0.7)
+            for student in students for _ in range(5)
+        ], batch_size=5000)
+        Intervention.objects.bulk_create([
+            Intervention(student=student, counselor=counselor, intervention_type='counseling', description='',
+                         scheduled_date=now + timedelta(days=rng.randint(-60, 30)), status=rng.choice(['scheduled', 'completed', 'completed', 'cancelled']))
+            for student in students
+        ], batch_size=5000)
+
+        conversations = Conversation.objects.bulk_create([Conversation() for _ in students], batch_size=5000)
+        Conversation.participants.through.objects.bulk_create([
+            Conversation.participants.through(conversation_id=conv.id, user_id=user_id)
+            for conv, student in zip(conversations, students) for user_id in (student.id, counselor.id)
+        ], batch_size=5000)
+        Message.objects.bulk_create([
+            Message(conversation=conv, sender=rng.choice([student, counselor]), body='Benchmark message', is_read=rng.random() < 0.95)
+            for conv, student in zip(conversations, students) for _ in range(20)
+        ], batch_size=5000)
+
+        self.sample_students = [student.id for student in rng.sample(students, min(len(students), 200))]
+        self.sample_conversations = [(conv.id, counselor.id) for conv in rng.sample(conversations, min(len(conversations), 200))]
+        self.stdout.write(f'Seeded in {time.perf_counter() - start:.1f}s')
+
+    def query_shapes(self):
+        """(label, fn(i) -> queryset) pairs mirroring the queries the views run"""
+        if not hasattr(self, 'sample_students'):
+            self.sample_students = list(User.objects.filter(role='student').values_list('id', flat=True)[:200]) or [0]
+            self.sample_conversations = [
+                (conv_id, user_id) for conv_id, user_id in
+                Conversation.participants.through.objects.values_list('conversation_id', 'user_id')[:200]
+            ] or [(0, 0)]
+
+        students = self.sample_students
+        conversations = self.sample_conversations
+        now = timezone.now()
+        month_ago = date.today() - timedelta(days=30)
+
+        def student(i):
+            return students[i % len(students)]
+
+        def conversation(i):
+            return conversations[i % len(conversations)]
+
+        return [
+            ('Alert: unresolved, newest first', lambda i: Alert.objects.filter(resolved=False).order_by('-created_at')[:10]),
+            ('Alert: unread critical', lambda i: Alert.objects.filter(severity='critical', is_read=False, resolved=False).values('pk')),
+            ('Alert: open alerts of a student', lambda i: Alert.objects.filter(student=student(i), alert_type__in=['high_risk', 'low_attendance'], resolved=False).values('alert_type')),
+            ('RiskAssessment: latest of a student', lambda i: RiskAssessment.objects.filter(student=student(i)).order_by('-date')[:1]),
+            ('WellnessCheckIn: latest of a student', lambda i: WellnessCheckIn.objects.filter(student=student(i)).order_by('-date')[:3]),
+            ('Message: unread in a conversation', lambda i: Message.objects.filter(conversation=conversation(i)[0], is_read=False).exclude(sender=conversation(i)[1]).values('pk')),
+            ('Attendance: student, last 30 days', lambda i: Attendance.objects.filter(student=student(i), date__gte=month_ago).values('status')),
+            ('Submission: graded of a student', lambda i: Submission.objects.filter(student=student(i), score__isnull=False).values('score')),
+            ('Intervention: upcoming scheduled', lambda i: Intervention.objects.filter(status='scheduled', scheduled_date__gte=now).order_by('scheduled_date')[:5]),
+        ]
+
+    def run_shapes(self, shapes, options, title):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n== {title} =='))
+        timings = {}
+        for label, make_queryset in shapes:
+            if not options['no_plans']:
+                self.stdout.write(self.style.MIGRATE_LABEL(label))
+                self.stdout.write(make_queryset(0).explain())
+
+            list(make_queryset(0))  # warm up
+            start = time.perf_counter()
+            for i in range(options['repeat']):
+                list(make_queryset(i))
+            timings[label] = (time.perf_counter() - start) * 1000 / options['repeat']
+            self.stdout.write(f'  {label}: {timings[label]:.2f}ms per query')
+        return timings
+
+    def set_indexes(self, present):
+        # Run the DDL directly rather than inside schema_editor() so it stays
+        # part of the surrounding transaction on every backend
+        editor = connection.schema_editor()
+        for model, names in BENCHMARK_INDEXES.items():
+            for index in model._meta.indexes:
+                if index.name in names:
+                    sql = index.create_sql(model, editor) if present else index.remove_sql(model, editor)
+                    editor.execute(sql)
+
+    def analyze(self):
+        # Refresh planner statistics so plans reflect the seeded data
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
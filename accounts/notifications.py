@@ -0,0 +1,255 @@
+"""Navbar notification counters and the server-sent events stream.
+
+Counters are cached per user and counter type. Signals keep them current by
+incrementing them where the change is known exactly (a new message, a new
+class announcement, new alerts) and deleting them where it is not, so in the
+steady state reading every counter is a single cache get_many.
+
+Every change that can move a user's counters (a new or read message, a new or
+read announcement, a graded submission, a raised or handled alert) bumps a
+version stamp in the cache for the affected users, or for a whole role when
+the change is visible to everyone in it. The stream only compares those stamps
+each tick and recomputes the counts when one of them moved, so an idle
+connection never touches the database.
+
+Both rely on every process sharing the cache (REDIS_URL). Without it,
+counters are only cached for a few seconds (NOTIFICATION_COUNTER_TIMEOUT),
+so changes made by another process still show up quickly.
+"""
+import asyncio
+import json
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+USER_VERSION_KEY = 'notifications:version:user:{}'
+ROLE_VERSION_KEY = 'notifications:version:role:{}'
+
+# How often an open stream checks the version stamps (seconds)
+STREAM_CHECK_INTERVAL = 1
+# Comment line sent when nothing changed so proxies keep the connection open
+STREAM_KEEPALIVE_INTERVAL = 15
+# Streams are closed after this long and the browser reconnects, which also
+# re-sends fresh counts to pick up anything that ages out (24h grade window)
+STREAM_MAX_DURATION = 55
+# Delay before the browser reconnects (milliseconds)
+STREAM_RETRY_MS = 3000
+
+
+STAFF_ROLES = ['counselor', 'admin']
+
+COUNTER_KEY = 'notifications:count:{}:{}'
+ALERTS_KEY = 'notifications:count:alerts'
+
+
+def counter_timeout():
+    """Seconds a counter stays cached.
+
+    Signals keep counters up to date; the timeout bounds how long one can stay
+    off after an update the signals did not see, which with a per-process
+    cache is every update made by another process (NOTIFICATION_COUNTER_TIMEOUT).
+    """
+    return settings.NOTIFICATION_COUNTER_TIMEOUT
+
+
+def count_messages(user):
+    from messaging.models import Message
+    return Message.objects.filter(
+        conversation__participants=user, is_read=False
+    ).exclude(sender=user).count(), counter_timeout()
+
+
+def count_announcements(user):
+    from academics.models import Announcement
+    classes = user.enrolled_classes.all()
+    return Announcement.objects.filter(
+        Q(class_obj__in=classes) | Q(class_obj__isnull=True)
+    ).exclude(read_by=user).count(), counter_timeout()
+
+
+def count_grades(user):
+    """Submissions graded in the last 24h, cached until the oldest one ages out"""
+    from academics.models import Submission
+    now = timezone.now()
+    graded = Submission.objects.filter(
+        student=user, score__isnull=False,
+        graded_at__gte=now - timedelta(hours=24)
+    ).aggregate(count=Count('id'), oldest=Min('graded_at'))
+    timeout = counter_timeout()
+    if graded['oldest']:
+        ages_out = (graded['oldest'] + timedelta(hours=24) - now).total_seconds()
+        timeout = max(1, min(timeout, int(ages_out)))
+    return graded['count'], timeout
+
+
+def count_alerts(user):
+    from wellness.models import Alert
+    return Alert.objects.filter(is_read=False, resolved=False).count(), counter_timeout()
+
+
+COUNTERS = {
+    'messages': count_messages,
+    'announcements': count_announcements,
+    'grades': count_grades,
+    'alerts': count_alerts,
+}
+
+
+def counter_keys(user):
+    """Return {counter: cache key} for the counters shown to user"""
+    keys = {'messages': COUNTER_KEY.format(user.pk, 'messages')}
+    if user.role == 'student':
+        keys['announcements'] = COUNTER_KEY.format(user.pk, 'announcements')
+        keys['grades'] = COUNTER_KEY.format(user.pk, 'grades')
+    if user.role in STAFF_ROLES:
+        # Every counselor and admin sees the same alert count
+        keys['alerts'] = ALERTS_KEY
+    return keys
+
+
+def notification_counts(user):
+    """Return the navbar counters of user.
+
+    Reads every counter with one cache get_many; only counters missing from
+    the cache are counted from the database.
+    """
+    keys = counter_keys(user)
+    cached = cache.get_many(keys.values())
+
+    data = {counter: 0 for counter in COUNTERS}
+    for counter, key in keys.items():
+        value = cached.get(key)
+        if value is None or value < 0:
+            value, timeout = COUNTERS[counter](user)
+            cache.set(key, value, timeout)
+        data[counter] = value
+
+    data['total'] = data['messages'] + data['announcements'] + data['grades'] + data['alerts']
+    return data
+
+
+def _incr(keys, delta):
+    def apply():
+        for key in keys:
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                pass  # Not cached, the next read counts it
+    transaction.on_commit(apply)
+
+
+def _invalidate(keys):
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _user_counter_keys(user_ids, counter):
+    return [COUNTER_KEY.format(user_id, counter) for user_id in set(user_ids)]
+
+
+def message_sent(message):
+    """A new message is unread for every participant but the sender"""
+    recipients = [
+        user_id for user_id in message.conversation.participants.values_list('id', flat=True)
+        if user_id != message.sender_id
+    ]
+    _incr(_user_counter_keys(recipients, 'messages'), 1)
+    notify_users(recipients)
+
+
+def messages_read(user, count):
+    """user just marked count of their messages as read"""
+    _incr(_user_counter_keys([user.pk], 'messages'), -count)
+    notify_users([user.pk])
+
+
+def messages_changed(user_ids):
+    _invalidate(_user_counter_keys(user_ids, 'messages'))
+    notify_users(user_ids)
+
+
+def announcement_posted(announcement):
+    """A new announcement is unread for its whole audience"""
+    if announcement.class_obj_id:
+        students = list(announcement.class_obj.students.values_list('id', flat=True))
+        _incr(_user_counter_keys(students, 'announcements'), 1)
+        notify_users(students)
+    else:
+        announcements_changed()
+
+
+def announcements_changed(user_ids=None):
+    """Recount announcements of these students, or of every student if None"""
+    if user_ids is None:
+        from .models import User
+        _invalidate(_user_counter_keys(User.objects.filter(role='student').values_list('id', flat=True), 'announcements'))
+        notify_roles(['student'])
+    else:
+        _invalidate(_user_counter_keys(user_ids, 'announcements'))
+        notify_users(user_ids)
+
+
+def grades_changed(student_ids):
+    _invalidate(_user_counter_keys(student_ids, 'grades'))
+    notify_users(student_ids)
+
+
+def alerts_raised(count):
+    """count new unread alerts were created"""
+    _incr([ALERTS_KEY], count)
+    notify_roles(STAFF_ROLES)
+
+
+def alerts_changed():
+    _invalidate([ALERTS_KEY])
+    notify_roles(STAFF_ROLES)
+
+
+def _bump(keys):
+    token = uuid.uuid4().hex
+    # Bump after commit so a stream that notices the change reads the new rows
+    transaction.on_commit(lambda: cache.set_many({key: token for key in keys}, timeout=None))
+
+
+def notify_users(user_ids):
+    """Mark the counters of these users as changed"""
+    keys = [USER_VERSION_KEY.format(user_id) for user_id in set(user_ids)]
+    if keys:
+        _bump(keys)
+
+
+def notify_roles(roles):
+    """Mark the counters of every user with one of these roles as changed"""
+    _bump([ROLE_VERSION_KEY.format(role) for role in roles])
+
+
+def version_keys(user):
+    return [USER_VERSION_KEY.format(user.pk), ROLE_VERSION_KEY.format(user.role)]
+
+
+async def notification_events(user):
+    """Yield server-sent events carrying user's counters whenever they change"""
+    from asgiref.sync import sync_to_async
+
+    loop = asyncio.get_running_loop()
+    started = last_sent = loop.time()
+    keys = version_keys(user)
+    version = None
+
+    yield f'retry: {STREAM_RETRY_MS}\n\n'
+    while loop.time() - started < STREAM_MAX_DURATION:
+        stamps = await cache.aget_many(keys)
+        current = tuple(stamps.get(key) for key in keys)
+        if current != version:
+            version = current
+            counts = await sync_to_async(notification_counts)(user)
+            yield f'data: {json.dumps(counts)}\n\n'
+            last_sent = loop.time()
+        elif loop.time() - last_sent >= STREAM_KEEPALIVE_INTERVAL:
+            yield ': keepalive\n\n'
+            last_sent = loop.time()
+        await asyncio.sleep(STREAM_CHECK_INTERVAL)
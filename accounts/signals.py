@@ -1,4 +1,4 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
 from .models import User
 
@@ -26,3 +26,84 @@ def create_risk_assessment_for_student(sender, instance, created, **kwargs):
             missing_assignments=0,
             notes='Initial assessment created automatically'
         )
+
+
+# Notification counters: keep the cached counters current and tell open
+# notification streams which users to refresh
+
+@receiver(post_save, sender='messaging.Message')
+def update_message_counters(sender, instance, created, **kwargs):
+    from .notifications import message_sent, messages_changed
+    if created and not instance.is_read:
+        message_sent(instance)
+    else:
+        messages_changed(instance.conversation.participants.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender='messaging.Message')
+def update_message_counters_on_delete(sender, instance, **kwargs):
+    from .notifications import messages_changed
+    messages_changed(instance.conversation.participants.values_list('id', flat=True))
+
+
+@receiver(post_save, sender='academics.Announcement')
+def update_announcement_counters(sender, instance, created, **kwargs):
+    from .notifications import announcement_posted, announcements_changed
+    if created:
+        announcement_posted(instance)
+    else:
+        announcements_changed()
+
+
+@receiver(post_delete, sender='academics.Announcement')
+def update_announcement_counters_on_delete(sender, instance, **kwargs):
+    from .notifications import announcements_changed
+    announcements_changed()
+
+
+@receiver(m2m_changed, sender='academics.Announcement_read_by')
+@receiver(m2m_changed, sender='academics.Class_students')
+def update_announcement_counters_on_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    """Announcements read or unread, or students enrolled or removed"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    from .notifications import announcements_changed
+    if reverse:
+        announcements_changed([instance.pk])
+    elif pk_set:
+        announcements_changed(pk_set)
+    else:
+        announcements_changed()
+
+
+@receiver(post_save, sender='academics.Submission')
+def update_grade_counters(sender, instance, **kwargs):
+    if instance.graded_at is not None:
+        from .notifications import grades_changed
+        grades_changed([instance.student_id])
+
+
+# Teacher dashboard: drop the cached submission figures of the class teacher
+
+@receiver(post_save, sender='academics.Submission')
+# Before the delete, while a cascading one can still find the assignment's class
+@receiver(pre_delete, sender='academics.Submission')
+def update_teacher_dashboard(sender, instance, **kwargs):
+    from academics.models import Class
+    from .dashboard import submissions_changed
+    submissions_changed(Class.objects.filter(assignments=instance.assignment_id).values_list('teacher_id', flat=True))
+
+
+@receiver(post_save, sender='wellness.Alert')
+def update_alert_counters(sender, instance, created, **kwargs):
+    from .notifications import alerts_raised, alerts_changed
+    if created and not instance.is_read and not instance.resolved:
+        alerts_raised(1)
+    else:
+        alerts_changed()
+
+
+@receiver(post_delete, sender='wellness.Alert')
+def update_alert_counters_on_delete(sender, instance, **kwargs):
+    from .notifications import alerts_changed
+    alerts_changed()
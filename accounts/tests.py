@@ -1,3 +1,253 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from academics.models import Class, Assignment, Submission, Announcement
+from messaging.models import Conversation, Message
+from wellness.models import Alert, RiskAssessment
+from .models import User
+from .notifications import COUNTERS, counter_keys, notification_counts
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'notification-tests'}})
+class NotificationCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher', password='pw', role='teacher')
+        self.counselor = User.objects.create_user(username='counselor', password='pw', role='counselor')
+        self.admin = User.objects.create_user(username='admin', password='pw', role='admin')
+        self.students = [
+            User.objects.create_user(username=f'student{i}', password='pw', role='student')
+            for i in range(3)
+        ]
+        self.cls = Class.objects.create(name='Math', code='MATH', teacher=self.teacher, semester='1')
+        self.cls.students.add(*self.students[:2])
+        self.assignment = Assignment.objects.create(
+            class_obj=self.cls, title='Quiz', description='', due_date=timezone.now(), total_points=100
+        )
+        self.conv = Conversation.objects.create()
+        self.conv.participants.add(self.students[0], self.counselor)
+
+    def users(self):
+        return [self.teacher, self.counselor, self.admin, *self.students]
+
+    def db_counts(self, user):
+        """The counters counted straight from the database"""
+        data = {counter: 0 for counter in COUNTERS}
+        for counter in counter_keys(user):
+            data[counter] = COUNTERS[counter](user)[0]
+        data['total'] = sum(data.values())
+        return data
+
+    def assertCountersMatchDatabase(self):
+        for user in self.users():
+            self.assertEqual(notification_counts(user), self.db_counts(user), user.username)
+
+    def warm(self):
+        for user in self.users():
+            notification_counts(user)
+
+    def test_steady_state_reads_only_the_cache(self):
+        self.warm()
+        for user in self.users():
+            with self.assertNumQueries(0):
+                notification_counts(user)
+
+    def test_counters_match_database_after_mixed_workload(self):
+        student, other = self.students[0], self.students[1]
+        self.warm()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(conversation=self.conv, sender=self.counselor, body='Hi')
+            Message.objects.create(conversation=self.conv, sender=self.counselor, body='Are you ok?')
+            Message.objects.create(conversation=self.conv, sender=student, body='Yes')
+        self.assertCountersMatchDatabase()
+
+        self.client.force_login(student)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('messaging:conversation', args=[self.conv.id]))
+        self.assertCountersMatchDatabase()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            class_announcement = Announcement.objects.create(class_obj=self.cls, author=self.teacher, title='Quiz', content='Friday')
+            Announcement.objects.create(author=self.admin, title='Holiday', content='Monday off')
+        self.assertCountersMatchDatabase()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('academics:mark_announcement_read', args=[class_announcement.id]))
+            self.cls.students.add(self.students[2])
+            self.cls.students.remove(other)
+        self.assertCountersMatchDatabase()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            submission = Submission.objects.create(assignment=self.assignment, student=student)
+            submission.score = 90
+            submission.graded_at = timezone.now()
+            submission.save()
+            Submission.objects.create(
+                assignment=Assignment.objects.create(class_obj=self.cls, title='Old', description='', due_date=timezone.now(), total_points=10),
+                student=student, score=5, graded_at=timezone.now() - timedelta(days=2)
+            )
+        self.assertCountersMatchDatabase()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            alerts = [
+                Alert.objects.create(student=student, alert_type='high_risk', severity='critical', message='Risk')
+                for _ in range(3)
+            ]
+            alerts[0].is_read = True
+            alerts[0].save()
+            alerts[1].delete()
+        self.assertCountersMatchDatabase()
+
+        self.client.force_login(self.counselor)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('wellness:resolve_alert', args=[alerts[2].id]))
+            self.client.get(reverse('messaging:conversation', args=[self.conv.id]))
+        self.assertCountersMatchDatabase()
+
+    @override_settings(NOTIFICATION_COUNTER_TIMEOUT=5)
+    def test_changes_signals_missed_show_within_the_timeout(self):
+        student = self.students[0]
+        self.warm()
+        # As if another process with its own cache sent it: bulk_create skips the signals here
+        Message.objects.bulk_create([Message(conversation=self.conv, sender=self.counselor, body='Hi')])
+        self.assertEqual(notification_counts(student)['messages'], 0)
+        with mock.patch('time.time', return_value=time.time() + 6):
+            self.assertEqual(notification_counts(student)['messages'], 1)
+
+    def test_poll_endpoint_returns_cached_counters(self):
+        student = self.students[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(conversation=self.conv, sender=self.counselor, body='Hi')
+            Announcement.objects.create(class_obj=self.cls, author=self.teacher, title='Quiz', content='Friday')
+
+        self.client.force_login(student)
+        response = self.client.get(reverse('notifications_poll'))
+        self.assertEqual(response.json(), self.db_counts(student))
+        self.assertEqual(response.json()['total'], 2)
+
+
+class StudentDashboardTests(TestCase):
+    def setUp(self):
+        teacher = User.objects.create_user(username='teacher', password='pw', role='teacher')
+        self.student = User.objects.create_user(username='student', password='pw', role='student', profile_completed=True)
+        self.client.login(username='student', password='pw')
+        self.classes = [
+            Class.objects.create(name=f'Subject {i}', code=f'DASH{i}', teacher=teacher, semester='1') for i in range(2)
+        ]
+        for cls in self.classes:
+            cls.students.add(self.student)
+
+    def add_assignments(self, cls, count):
+        """Add count past-due assignments to cls, submitting every other one"""
+        for i in range(count):
+            assignment = Assignment.objects.create(
+                class_obj=cls, title=f'Task {i}', description='', due_date=timezone.now() - timedelta(days=1), total_points=10
+            )
+            if i % 2:
+                Submission.objects.create(assignment=assignment, student=self.student)
+
+    def test_missing_assignments_in_flat_queries(self):
+        self.client.get(reverse('dashboard'))
+        self.add_assignments(self.classes[0], 2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('dashboard'))
+        for cls in self.classes:
+            self.add_assignments(cls, 10)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('dashboard'))
+
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(response.context['missing_assignments'], 11)
+        self.assertEqual([len(cls.missing_for_student) for cls in response.context['classes']], [6, 5])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'dashboard-tests'}})
+class TeacherDashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.teacher = User.objects.create_user(username='teacher', password='pw', role='teacher')
+        self.client.login(username='teacher', password='pw')
+        self.classes = [
+            Class.objects.create(name=f'Subject {i}', code=f'TD{i}', teacher=self.teacher, semester='1') for i in range(2)
+        ]
+        self.assignment = Assignment.objects.create(
+            class_obj=self.classes[0], title='Lab', description='', due_date=timezone.now(), total_points=10
+        )
+        self.count = 0
+
+    def enroll(self, count, risk_level='low'):
+        students = []
+        for i in range(count):
+            self.count += 1
+            student = User.objects.create_user(username=f'tdstudent{self.count}', password='pw', role='student')
+            RiskAssessment.objects.create(student=student, risk_level=risk_level, risk_score=self.count, missing_assignments=0)
+            for cls in self.classes:
+                cls.students.add(student)
+            with self.captureOnCommitCallbacks(execute=True):
+                Submission.objects.create(assignment=self.assignment, student=student)
+            students.append(student)
+        return students
+
+    def test_constant_queries(self):
+        self.enroll(2, 'high')
+        self.client.get(reverse('dashboard'))
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('dashboard'))
+
+        self.enroll(10)
+        high = self.enroll(3, 'high')
+        self.client.get(reverse('dashboard'))
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('dashboard'))
+
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(response.context['total_students'], 15)
+        self.assertEqual(response.context['at_risk_count'], 5)
+        self.assertEqual(response.context['at_risk_students'][0], high[-1])
+        self.assertEqual(response.context['pending_grades'], 15)
+        self.assertEqual([cls.student_count for cls in response.context['classes']], [15, 15])
+
+    def test_submission_changes_refresh_cached_counts(self):
+        first, second = self.enroll(2)
+        self.client.get(reverse('dashboard'))
+
+        submission = Submission.objects.get(student=first)
+        submission.score = 9
+        with self.captureOnCommitCallbacks(execute=True):
+            submission.save()
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.context['pending_grades'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assignment.delete()
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual((response.context['pending_grades'], response.context['recent_submissions']), (0, []))
+
+
+class JobQueuePageTests(TestCase):
+    def test_only_admins_see_the_queue(self):
+        from jobs.queue import enqueue
+        enqueue('calculate_risk')
+        for role in ('student', 'teacher', 'counselor'):
+            self.client.force_login(User.objects.create_user(username=role, password='pw', role=role))
+            self.assertRedirects(self.client.get(reverse('admin_job_queue')), reverse('dashboard'), fetch_redirect_response=False)
+
+        self.client.force_login(User.objects.create_user(username='admin', password='pw', role='admin'))
+        response = self.client.get(reverse('admin_job_queue'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_queued'], 1)
+        self.assertContains(response, 'calculate_risk')
+
+    def test_anonymous_users_must_log_in(self):
+        response = self.client.get(reverse('admin_job_queue'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(reverse('login'), response['Location'])
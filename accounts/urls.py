@@ -16,6 +16,7 @@ urlpatterns = [
     path('google/login/', oauth2_login, name='google_login'),
     path('fix-site/', views.fix_site_domain, name='fix_site_domain'),
     path('notifications/poll/', views.notifications_poll, name='notifications_poll'),
+    path('notifications/stream/', views.notifications_stream, name='notifications_stream'),
     
     # Admin URLs
     path('manage/users/', admin_views.admin_manage_users, name='admin_manage_users'),
@@ -25,4 +26,5 @@ urlpatterns = [
     path('manage/teacher/<int:teacher_id>/dashboard/', admin_views.admin_teacher_dashboard, name='admin_teacher_dashboard'),
     path('manage/create-class/', admin_views.admin_create_class, name='admin_create_class'),
     path('manage/enroll-student/', admin_views.admin_enroll_student, name='admin_enroll_student'),
+    path('manage/jobs/', admin_views.admin_job_queue, name='admin_job_queue'),
 ]
@@ -3,11 +3,14 @@ from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import HttpResponse
-from django.db.models import Count, Avg, Q
+from django.db.models import Count, Avg, F, Q, OuterRef, Subquery
+from django.utils import timezone
 from datetime import datetime, timedelta
 from academics.models import Class, Assignment, Submission, Attendance, Grade
-from wellness.models import WellnessCheckIn, RiskAssessment, Alert, Intervention
+from academics.submissions import with_submission_status
+from wellness.models import WellnessCheckIn, CurrentRisk, Alert, Intervention
 from .models import User
+from .dashboard import teacher_submission_stats
 
 def landing_view(request):
     if request.user.is_authenticated:
@@ -15,49 +18,32 @@ def landing_view(request):
     return render(request, 'landing.html')
 
 
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 
 @login_required
 def notifications_poll(request):
-    """Single endpoint polled by base.html every 5s for all notification counts."""
-    from messaging.models import Message
-    from academics.models import Announcement, Submission
-    from wellness.models import Alert
-    from django.db.models import Q
+    """Fallback for browsers that cannot keep notifications_stream open."""
+    from .notifications import notification_counts
+    return JsonResponse(notification_counts(request.user))
 
-    user = request.user
-    data = {}
-
-    # Unread messages
-    data['messages'] = Message.objects.filter(
-        conversation__participants=user, is_read=False
-    ).exclude(sender=user).count()
 
-    # New unread announcements (student/teacher)
-    if user.role == 'student':
-        classes = user.enrolled_classes.all()
-        data['announcements'] = Announcement.objects.filter(
-            Q(class_obj__in=classes) | Q(class_obj__isnull=True)
-        ).exclude(read_by=user).count()
-        # New grades (submissions graded in last 24h not yet seen)
-        from datetime import timedelta
-        from django.utils import timezone
-        data['grades'] = Submission.objects.filter(
-            student=user, score__isnull=False,
-            graded_at__gte=timezone.now() - timedelta(hours=24)
-        ).count()
-    else:
-        data['announcements'] = 0
-        data['grades'] = 0
+async def notifications_stream(request):
+    """Server-sent events pushing the notification counts whenever they change."""
+    from django.core.handlers.asgi import ASGIRequest
+    from .notifications import notification_events
 
-    # Unread alerts (counselor/admin)
-    if user.role in ['counselor', 'admin']:
-        data['alerts'] = Alert.objects.filter(is_read=False, resolved=False).count()
-    else:
-        data['alerts'] = 0
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+    if not isinstance(request, ASGIRequest):
+        # A WSGI worker would be tied up for the whole stream; 204 tells
+        # EventSource not to reconnect so base.html falls back to polling
+        return HttpResponse(status=204)
 
-    data['total'] = data['messages'] + data['announcements'] + data['grades'] + data['alerts']
-    return JsonResponse(data)
+    response = StreamingHttpResponse(notification_events(user), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 
 def fix_site_domain(request):
@@ -173,18 +159,20 @@ def student_dashboard(request):
     user = request.user
     classes = user.enrolled_classes.all()
     
-    # Attach missing assignments per class for the dashboard panel
-    submitted_ids = Submission.objects.filter(student=user).values_list('assignment_id', flat=True)
+    # Attach missing assignments per class for the dashboard panel, all in one query
+    missing = {}
+    for assignment in with_submission_status(
+        Assignment.objects.filter(class_obj__in=classes, due_date__lt=timezone.now()), user
+    ).filter(has_submission=False).order_by('due_date'):
+        missing.setdefault(assignment.class_obj_id, []).append(assignment)
     for cls in classes:
-        cls.missing_for_student = cls.assignment_set.filter(
-            due_date__lt=datetime.now()
-        ).exclude(id__in=submitted_ids)
+        cls.missing_for_student = missing.get(cls.id, [])
     
     # Get upcoming assignments
     assignments = Assignment.objects.filter(
         class_obj__in=classes,
-        due_date__gte=datetime.now()
-    ).order_by('due_date')[:5]
+        due_date__gte=timezone.now()
+    ).select_related('class_obj').order_by('due_date')[:5]
     
     # Get recent announcements (unread only)
     from academics.models import Announcement
@@ -202,8 +190,9 @@ def student_dashboard(request):
     last_checkin = WellnessCheckIn.objects.filter(student=user).order_by('-date').first()
     
     # Count missing assignments
-    all_assignments = Assignment.objects.filter(class_obj__in=classes)
-    missing_assignments = all_assignments.exclude(id__in=submitted_ids).count()
+    missing_assignments = with_submission_status(
+        Assignment.objects.filter(class_obj__in=classes), user
+    ).filter(has_submission=False).count()
     
     context = {
         'classes': classes,
@@ -217,49 +206,45 @@ def student_dashboard(request):
 
 def teacher_dashboard(request):
     user = request.user
-    classes = Class.objects.filter(teacher=user)
+    classes = Class.objects.filter(teacher=user).annotate(student_count=Count('students'))
     
-    # Get all students in teacher's classes
-    students = set()
-    for cls in classes:
-        students.update(cls.students.all())
+    # Every student in the teacher's classes with their current risk, in one query
+    students = list(User.objects.filter(
+        id__in=Class.students.through.objects.filter(class__teacher=user).values('user_id')
+    ).annotate(
+        risk_level=F('current_risk__risk_level'), risk_score=F('current_risk__risk_score')
+    ).only('id', 'username', 'first_name', 'last_name'))
     
     # Get at-risk students
-    at_risk_students = []
-    for student in students:
-        latest_assessment = RiskAssessment.objects.filter(student=student).order_by('-date').first()
-        if latest_assessment and latest_assessment.risk_level == 'high':
-            at_risk_students.append(student)
-    
-    # Count pending grades
-    pending_grades = Submission.objects.filter(
-        assignment__class_obj__in=classes,
-        score__isnull=True
-    ).count()
+    at_risk_students = sorted(
+        (student for student in students if student.risk_level == 'high'), key=lambda student: -student.risk_score
+    )
     
-    # Get recent submissions (last 10)
-    recent_submissions = Submission.objects.filter(
-        assignment__class_obj__in=classes
-    ).select_related('student', 'assignment', 'assignment__class_obj').order_by('-submitted_at')[:10]
+    # Pending grades and recent submissions are cached until a submission changes
+    stats = teacher_submission_stats(user)
     
     context = {
         'classes': classes,
         'at_risk_students': at_risk_students,
         'total_students': len(students),
-        'pending_grades': pending_grades,
+        'pending_grades': stats['pending_grades'],
         'at_risk_count': len(at_risk_students),
-        'recent_submissions': recent_submissions,
+        'recent_submissions': stats['recent_submissions'],
     }
     return render(request, 'dashboard/teacher_dashboard.html', context)
 
 def counselor_dashboard(request):
-    # Get risk assessments
-    high_risk_students = RiskAssessment.objects.filter(
+    # Get current risk levels
+    high_risk_students = CurrentRisk.objects.filter(
         risk_level='high'
-    ).order_by('-risk_score')[:10]
+    ).select_related('student').order_by('-risk_score')[:10]
     
-    high_risk_count = RiskAssessment.objects.filter(risk_level='high').count()
-    medium_risk_count = RiskAssessment.objects.filter(risk_level='medium').count()
+    risk_counts = CurrentRisk.objects.aggregate(
+        high=Count('pk', filter=Q(risk_level='high')),
+        medium=Count('pk', filter=Q(risk_level='medium')),
+    )
+    high_risk_count = risk_counts['high']
+    medium_risk_count = risk_counts['medium']
     
     # Get alerts
     alerts = Alert.objects.filter(resolved=False).order_by('-created_at')[:10]
@@ -287,15 +272,10 @@ def counselor_dashboard(request):
 def admin_dashboard(request):
     from django.db.models import Count
     from datetime import datetime, timedelta
-    from django.core.management import call_command
+    from jobs.queue import last_finished
     
-    # Auto-calculate risk assessments if none exist or if last calculation was > 1 day ago
-    latest_assessment = RiskAssessment.objects.order_by('-date').first()
-    if not latest_assessment or (datetime.now().date() - latest_assessment.date).days > 0:
-        try:
-            call_command('calculate_risk')
-        except:
-            pass
+    # Risk assessments are recalculated by the run_jobs worker; only read the results here
+    risk_refreshed_at = last_finished('calculate_risk')
     
     # User statistics
     total_users = User.objects.count()
@@ -312,12 +292,17 @@ def admin_dashboard(request):
     top_classes = Class.objects.annotate(student_count=Count('students')).order_by('-student_count')[:5]
     
     # Risk statistics
-    high_risk_count = RiskAssessment.objects.filter(risk_level='high').values('student').distinct().count()
-    medium_risk_count = RiskAssessment.objects.filter(risk_level='medium').values('student').distinct().count()
-    low_risk_count = RiskAssessment.objects.filter(risk_level='low').values('student').distinct().count()
+    risk_counts = CurrentRisk.objects.aggregate(
+        high=Count('pk', filter=Q(risk_level='high')),
+        medium=Count('pk', filter=Q(risk_level='medium')),
+        low=Count('pk', filter=Q(risk_level='low')),
+    )
+    high_risk_count = risk_counts['high']
+    medium_risk_count = risk_counts['medium']
+    low_risk_count = risk_counts['low']
     
     # High risk students
-    high_risk_students = RiskAssessment.objects.filter(risk_level='high').select_related('student').order_by('-risk_score')[:10]
+    high_risk_students = CurrentRisk.objects.filter(risk_level='high').select_related('student').order_by('-risk_score')[:10]
     
     # Alerts and interventions
     unresolved_alerts = Alert.objects.filter(resolved=False).count()
@@ -353,6 +338,7 @@ def admin_dashboard(request):
         'recent_alerts': recent_alerts,
         'activity_labels': activity_labels,
         'activity_data': activity_data,
+        'risk_refreshed_at': risk_refreshed_at,
     }
     return render(request, 'dashboard/admin_dashboard.html', context)
 
@@ -375,8 +361,8 @@ def profile_view(request):
     context = {}
     if request.user.role == 'student':
         # Get GPA
-        latest_assessment = RiskAssessment.objects.filter(student=request.user).order_by('-date').first()
-        gpa = latest_assessment.gpa if latest_assessment else None
+        current_risk = CurrentRisk.objects.filter(student=request.user).first()
+        gpa = current_risk.gpa if current_risk else None
         
         # Calculate attendance rate
         attendance_records = Attendance.objects.filter(student=request.user)
@@ -406,7 +392,7 @@ def student_profile_view(request, student_id):
     enrolled_classes = student.enrolled_classes.all()
     
     # Get risk assessment
-    risk_assessment = RiskAssessment.objects.filter(student=student).order_by('-date').first()
+    risk_assessment = CurrentRisk.objects.filter(student=student).first()
     
     # Get AI prediction
     from ml_models.models import PredictionLog
@@ -439,10 +425,10 @@ def student_profile_view(request, student_id):
     ai_recommendations = None
     academic_pattern = None
     if request.user.role == 'counselor' and risk_assessment and risk_assessment.risk_level in ['medium', 'high']:
-        from ml_models.gemini_client import GeminiClient
+        from ml_models.gemini_client import shared_client
         from ml_models.utils import get_student_profile_for_intervention, get_student_academic_pattern_data
         try:
-            client = GeminiClient()
+            client = shared_client()
             profile = get_student_profile_for_intervention(student)
             result = client.recommend_intervention(profile)
             ai_recommendations = result.get('recommendations', [])
@@ -480,45 +466,48 @@ def students_list_view(request):
     # Get teacher's classes
     my_classes = Class.objects.filter(teacher=request.user)
     
-    # Get all students from teacher's classes
-    students = set()
-    for cls in my_classes:
-        students.update(cls.students.all())
-    
     # Apply filters
     search_query = request.GET.get('search', '')
     class_filter = request.GET.get('class_filter', '')
     year_level_filter = request.GET.get('year_level_filter', '')
     
-    if class_filter:
-        filtered_class = Class.objects.filter(id=class_filter, teacher=request.user).first()
-        if filtered_class:
-            students = set(filtered_class.students.all())
+    # Get all students from teacher's classes (or just the filtered class)
+    enrollments = Class.students.through.objects.filter(class__teacher=request.user)
+    if class_filter and my_classes.filter(id=class_filter).exists():
+        enrollments = enrollments.filter(class_id=class_filter)
+    students = User.objects.filter(id__in=enrollments.values('user_id'))
     
     if year_level_filter:
-        students = [s for s in students if s.year_level == year_level_filter]
+        students = students.filter(year_level=year_level_filter)
     
     if search_query:
-        students = [s for s in students if 
-                   search_query.lower() in s.first_name.lower() or 
-                   search_query.lower() in s.last_name.lower() or 
-                   search_query.lower() in s.email.lower() or 
-                   search_query.lower() in s.username.lower()]
+        students = students.filter(
+            Q(first_name__icontains=search_query) |
+            Q(last_name__icontains=search_query) |
+            Q(email__icontains=search_query) |
+            Q(username__icontains=search_query)
+        )
+    
+    # Prepare student data with stats, all in one query
+    attendance = Attendance.objects.filter(student=OuterRef('pk')).values('student')
+    students = students.select_related('current_risk').annotate(
+        classes_count=Count('enrolled_classes'),
+        attendance_total=Subquery(attendance.annotate(n=Count('id')).values('n')),
+        attendance_present=Subquery(attendance.filter(status='present').annotate(n=Count('id')).values('n')),
+    )
     
-    # Prepare student data with stats
     students_data = []
     for student in students:
-        risk_assessment = RiskAssessment.objects.filter(student=student).order_by('-date').first()
-        attendance_records = Attendance.objects.filter(student=student)
+        risk_assessment = getattr(student, 'current_risk', None)
         
-        if attendance_records.exists():
-            attendance_rate = round((attendance_records.filter(status='present').count() / attendance_records.count()) * 100, 1)
+        if student.attendance_total:
+            attendance_rate = round(((student.attendance_present or 0) / student.attendance_total) * 100, 1)
         else:
             attendance_rate = None
         
         students_data.append({
             'student': student,
-            'classes_count': student.enrolled_classes.count(),
+            'classes_count': student.classes_count,
             'gpa': risk_assessment.gpa if risk_assessment else None,
             'attendance_rate': attendance_rate,
             'risk_level': risk_assessment.risk_level if risk_assessment else None,
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import warnings
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from wellness.models import Alert
+from .views import weekly_summary
+
+
+async def fake_stream(self, prompt):
+    for text in ['Hello', ' **world**']:
+        yield text
+
+
+class ChatStreamTests(TestCase):
+    def setUp(self):
+        self.counselor = User.objects.create_user(username='counselor', password='pw', role='counselor')
+
+    async def post(self, name, body):
+        await self.async_client.aforce_login(self.counselor)
+        return await self.async_client.post(reverse(name), json.dumps(body), content_type='application/json')
+
+    async def read(self, response):
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    async def test_ask_ai_streams_text(self):
+        with mock.patch('ml_models.gemini_client.GeminiClient.stream_text', fake_stream):
+            response = await self.post('ai_assistant:counselor_chat_stream', {'action': 'ask_ai', 'message': 'hi'})
+            body = await self.read(response)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(body, 'data: {"text": "Hello"}\n\ndata: {"text": " **world**"}\n\nevent: done\ndata: {}\n\n')
+
+    async def test_report_sends_figures_first(self):
+        with mock.patch('ml_models.gemini_client.GeminiClient.stream_text', fake_stream):
+            response = await self.post('ai_assistant:counselor_chat_stream', {'action': 'weekly_summary'})
+            body = await self.read(response)
+        event, data = body.split('\n\n')[0].split('\n')
+        self.assertEqual(event, 'event: report')
+        self.assertEqual(json.loads(data[len('data: '):])['new_alerts'], 0)
+
+    async def test_disconnect_closes_gemini_stream(self):
+        closed = asyncio.Event()
+
+        async def endless(self, prompt):
+            try:
+                while True:
+                    yield 'more'
+                    await asyncio.sleep(0)
+            finally:
+                closed.set()
+
+        with mock.patch('ml_models.gemini_client.GeminiClient.stream_text', endless):
+            response = await self.post('ai_assistant:counselor_chat_stream', {'action': 'ask_ai', 'message': 'hi'})
+            # On disconnect the ASGI handler cancels the task sending the response
+            task = asyncio.create_task(self.read(response))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        self.assertTrue(closed.is_set())
+
+    async def test_permissions(self):
+        response = await self.post('ai_assistant:admin_chat_stream', {'action': 'generate_report'})
+        self.assertEqual(response.status_code, 403)
+        response = await self.post('ai_assistant:counselor_chat_stream', {'action': 'draft_email'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_wsgi_falls_back_to_json(self):
+        self.client.force_login(self.counselor)
+        response = self.client.post(
+            reverse('ai_assistant:counselor_chat_stream'), json.dumps({'action': 'ask_ai', 'message': 'hi'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 204)
+
+
+class WeeklySummaryTests(TestCase):
+    def test_counts_the_last_seven_days(self):
+        student = User.objects.create_user(username='student', password='pw', role='student')
+        Alert.objects.create(student=student, alert_type='high_risk', severity='high', message='')
+        old = Alert.objects.create(student=student, alert_type='high_risk', severity='high', message='', resolved=True)
+        Alert.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=8))
+
+        # A naive cutoff would trip Django's RuntimeWarning about naive datetimes
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            data, _ = weekly_summary()
+        self.assertEqual((data['new_alerts'], data['pending_alerts']), (1, 1))
@@ -8,4 +8,7 @@ urlpatterns = [
     path('admin/', views.admin_chat_view, name='admin_chat_view'),
     path('counselor/chat/', views.counselor_chat, name='counselor_chat'),
     path('admin/chat/', views.admin_chat, name='admin_chat'),
+    path('counselor/interventions/<int:job_id>/', views.auto_interventions_status, name='auto_interventions_status'),
+    path('counselor/chat/stream/', views.counselor_chat_stream, name='counselor_chat_stream'),
+    path('admin/chat/stream/', views.admin_chat_stream, name='admin_chat_stream'),
 ]
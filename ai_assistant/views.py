@@ -1,14 +1,111 @@
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
 from django.views.decorators.http import require_http_methods
-from ml_models.gemini_client import GeminiClient
+from ml_models.gemini_client import shared_client
 from ml_models.utils import get_student_profile_for_intervention
 from accounts.models import User
-from wellness.models import RiskAssessment, Alert, Intervention, WellnessCheckIn, TeacherConcern
-from django.db.models import Q
+from wellness.models import RiskAssessment, CurrentRisk, Alert, Intervention, WellnessCheckIn, TeacherConcern
+from django.db.models import Count, Q
 import json
 
+def system_overview():
+    """(data, prompt) for the counselor's system overview report"""
+    risk_counts = CurrentRisk.objects.aggregate(
+        high=Count('pk', filter=Q(risk_level='high')),
+        medium=Count('pk', filter=Q(risk_level='medium')),
+    )
+    high_risk = risk_counts['high']
+    medium_risk = risk_counts['medium']
+    unresolved_alerts = Alert.objects.filter(resolved=False).count()
+    pending_interventions = Intervention.objects.filter(status='scheduled').count()
+
+    summary_data = {
+        'high_risk_count': high_risk,
+        'medium_risk_count': medium_risk,
+        'unresolved_alerts': unresolved_alerts,
+        'pending_interventions': pending_interventions
+    }
+
+    prompt = f"""Generate a system overview report for a school counselor. Use this data:
+
+Current Status: {high_risk} high-risk students, {medium_risk} medium-risk students, {unresolved_alerts} unresolved alerts, {pending_interventions} pending interventions
+
+Write in a conversational, easy-to-read style:
+- Use emojis (🔴 critical, ⚠️ warning, 📊 stats, 💡 insight)
+- Create 4 sections: Current Status, Priority Actions, System Health, Recommendations
+- Each section should have 2-3 short bullet points
+- Start each bullet with an emoji
+- Keep sentences short and natural
+- No bold text, no asterisks, no markdown
+- Use plain text only"""
+    return summary_data, prompt
+
+
+def weekly_summary():
+    """(data, prompt) for the counselor's weekly summary"""
+    from datetime import timedelta
+    week_ago = timezone.now() - timedelta(days=7)
+
+    new_alerts = Alert.objects.filter(created_at__gte=week_ago).count()
+    new_interventions = Intervention.objects.filter(scheduled_date__gte=week_ago).count()
+    new_concerns = TeacherConcern.objects.filter(created_at__gte=week_ago).count()
+    new_high_risk = RiskAssessment.objects.filter(date__gte=week_ago, risk_level='high').values('student').distinct().count()
+    pending_alerts = Alert.objects.filter(resolved=False).count()
+
+    weekly_data = {
+        'new_alerts': new_alerts,
+        'new_interventions': new_interventions,
+        'new_concerns': new_concerns,
+        'new_high_risk_students': new_high_risk,
+        'pending_alerts': pending_alerts
+    }
+
+    prompt = f"""Generate an engaging weekly summary for a school counselor. Use this data:
+
+This Week: {new_alerts} new alerts, {new_interventions} interventions, {new_concerns} concerns, {new_high_risk} high-risk students, {pending_alerts} pending alerts
+
+Write in a conversational, easy-to-read style:
+- Use emojis (🔴 urgent, ⚠️ attention, ✅ positive, 📋 action)
+- Create 4 sections: What Happened, Watch Out For, Good News, Next Steps
+- Each section should have 2-3 short bullet points
+- Start each bullet with an emoji
+- Keep sentences short and natural
+- No bold text, no asterisks, no markdown
+- Use plain text only"""
+    return weekly_data, prompt
+
+
+def executive_summary():
+    """(data, prompt) for the admin's executive summary"""
+    total_students = User.objects.filter(role='student').count()
+    total_teachers = User.objects.filter(role='teacher').count()
+    total_counselors = User.objects.filter(role='counselor').count()
+    high_risk = CurrentRisk.objects.filter(risk_level='high').count()
+
+    summary_data = {
+        'total_students': total_students,
+        'total_teachers': total_teachers,
+        'total_counselors': total_counselors,
+        'high_risk_students': high_risk
+    }
+
+    prompt = f"""Generate an executive summary report for a school admin. Use this data:
+
+System Status: {total_students} students, {total_teachers} teachers, {total_counselors} counselors, {high_risk} high-risk students
+
+Write in a conversational, easy-to-read style:
+- Use emojis (📊 stats, 👥 people, ⚠️ warning, 💡 insight)
+- Create 4 sections: System Overview, Staffing Status, Student Wellness, Action Items
+- Each section should have 2-3 short bullet points
+- Start each bullet with an emoji
+- Keep sentences short and natural
+- No bold text, no asterisks, no markdown
+- Use plain text only"""
+    return summary_data, prompt
+
+
 @login_required
 def counselor_chat_view(request):
     """Render counselor chatbox page"""
@@ -41,7 +138,7 @@ def counselor_chat(request):
         action = data.get('action')
         message = data.get('message', '')
         
-        client = GeminiClient()
+        client = shared_client()
         
         if action == 'create_intervention':
             student_id = data.get('student_id')
@@ -85,30 +182,7 @@ def counselor_chat(request):
                 return JsonResponse({'error': f'Error: {str(e)}'}, status=500)
         
         elif action == 'generate_report':
-            high_risk = RiskAssessment.objects.filter(risk_level='high').count()
-            medium_risk = RiskAssessment.objects.filter(risk_level='medium').count()
-            unresolved_alerts = Alert.objects.filter(resolved=False).count()
-            pending_interventions = Intervention.objects.filter(status='scheduled').count()
-            
-            summary_data = {
-                'high_risk_count': high_risk,
-                'medium_risk_count': medium_risk,
-                'unresolved_alerts': unresolved_alerts,
-                'pending_interventions': pending_interventions
-            }
-            
-            prompt = f"""Generate a system overview report for a school counselor. Use this data:
-
-Current Status: {high_risk} high-risk students, {medium_risk} medium-risk students, {unresolved_alerts} unresolved alerts, {pending_interventions} pending interventions
-
-Write in a conversational, easy-to-read style:
-- Use emojis (🔴 critical, ⚠️ warning, 📊 stats, 💡 insight)
-- Create 4 sections: Current Status, Priority Actions, System Health, Recommendations
-- Each section should have 2-3 short bullet points
-- Start each bullet with an emoji
-- Keep sentences short and natural
-- No bold text, no asterisks, no markdown
-- Use plain text only"""
+            summary_data, prompt = system_overview()
             summary = client.generate_text(prompt)
             
             return JsonResponse({'response': summary, 'data': summary_data})
@@ -121,15 +195,16 @@ Write in a conversational, easy-to-read style:
                 return JsonResponse({'error': 'Student not found'}, status=404)
             
             # Get student data
-            from academics.models import Attendance, Submission
-            attendance = Attendance.objects.filter(student=student).order_by('-date')[:30]
-            submissions = Submission.objects.filter(student=student).order_by('-submitted_at')[:20]
+            from ml_models.utils import get_academic_patterns
+            pattern = get_academic_patterns(User.objects.filter(pk=student.pk), attendance_limit=30, score_limit=20)[student.pk]
             wellness = WellnessCheckIn.objects.filter(student=student).order_by('-date')[:10]
             
             behavior_data = {
                 'student_name': student.get_full_name(),
-                'attendance_pattern': [{'date': str(a.date), 'status': a.status} for a in attendance],
-                'submission_pattern': [{'date': str(s.submitted_at.date()) if s.submitted_at else 'N/A', 'score': s.score if s.score else 'N/A'} for s in submissions],
+                'attendance_pattern': pattern['attendance_records'],
+                'submission_pattern': [{'date': s['date'], 'score': s['percentage']} for s in pattern['assignment_scores']],
+                'grade_trend': pattern['grade_trend'],
+                'recent_performance': pattern['recent_performance'],
                 'wellness_trend': [{'date': str(w.date), 'stress': w.stress_level, 'motivation': w.motivation_level} for w in wellness]
             }
             
@@ -147,30 +222,43 @@ Provide:
             return JsonResponse({'response': analysis})
         
         elif action == 'weekly_summary':
-            from datetime import datetime, timedelta
-            week_ago = datetime.now() - timedelta(days=7)
+            weekly_data, prompt = weekly_summary()
+            summary = client.generate_text(prompt)
+            return JsonResponse({'response': summary, 'data': weekly_data})
+        
+        elif action == 'pattern_report':
+            from ml_models.utils import get_academic_patterns
+            students = User.objects.filter(role='student')
+            patterns = get_academic_patterns(students)
+            names = {student.pk: student.get_full_name() or student.username for student in students.only('first_name', 'last_name', 'username')}
             
-            new_alerts = Alert.objects.filter(created_at__gte=week_ago).count()
-            new_interventions = Intervention.objects.filter(scheduled_date__gte=week_ago).count()
-            new_concerns = TeacherConcern.objects.filter(created_at__gte=week_ago).count()
-            new_high_risk = RiskAssessment.objects.filter(date__gte=week_ago, risk_level='high').count()
-            pending_alerts = Alert.objects.filter(resolved=False).count()
+            trends = {'improving': 0, 'stable': 0, 'declining': 0, 'insufficient_data': 0}
+            for pattern in patterns.values():
+                trends[pattern['grade_trend']] += 1
+            declining = sorted(
+                [{
+                    'id': student_id,
+                    'name': names.get(student_id, ''),
+                    'avg_score': pattern['recent_performance']['avg_score'],
+                    'attendance_rate': pattern['recent_performance']['attendance_rate']
+                } for student_id, pattern in patterns.items() if pattern['grade_trend'] == 'declining'],
+                key=lambda s: s['avg_score']
+            )
             
-            weekly_data = {
-                'new_alerts': new_alerts,
-                'new_interventions': new_interventions,
-                'new_concerns': new_concerns,
-                'new_high_risk_students': new_high_risk,
-                'pending_alerts': pending_alerts
+            report_data = {
+                'students': len(patterns),
+                'trends': trends,
+                'declining_students': declining[:10]
             }
             
-            prompt = f"""Generate an engaging weekly summary for a school counselor. Use this data:
+            prompt = f"""Generate a short academic pattern report for a school counselor. Use this data:
 
-This Week: {new_alerts} new alerts, {new_interventions} interventions, {new_concerns} concerns, {new_high_risk} high-risk students, {pending_alerts} pending alerts
+Grade trends across {len(patterns)} students: {trends['improving']} improving, {trends['stable']} stable, {trends['declining']} declining, {trends['insufficient_data']} without enough graded work
+Lowest-scoring declining students: {', '.join(f"{s['name']} ({s['avg_score']}% average, {s['attendance_rate']}% attendance)" for s in declining[:5]) or 'none'}
 
 Write in a conversational, easy-to-read style:
-- Use emojis (🔴 urgent, ⚠️ attention, ✅ positive, 📋 action)
-- Create 4 sections: What Happened, Watch Out For, Good News, Next Steps
+- Use emojis (📉 declining, 📈 improving, 📋 action)
+- Create 3 sections: Overall Picture, Students To Watch, Next Steps
 - Each section should have 2-3 short bullet points
 - Start each bullet with an emoji
 - Keep sentences short and natural
@@ -178,7 +266,7 @@ Write in a conversational, easy-to-read style:
 - Use plain text only"""
             
             summary = client.generate_text(prompt)
-            return JsonResponse({'response': summary, 'data': weekly_data})
+            return JsonResponse({'response': summary, 'data': report_data})
         
         elif action == 'draft_email':
             student_id = data.get('student_id')
@@ -189,7 +277,7 @@ Write in a conversational, easy-to-read style:
                 return JsonResponse({'error': 'Student not found'}, status=404)
             
             # Get recent data
-            risk = RiskAssessment.objects.filter(student=student).order_by('-date').first()
+            risk = CurrentRisk.objects.filter(student=student).first()
             concerns = TeacherConcern.objects.filter(student=student).order_by('-created_at')[:3]
             
             email_context = {
@@ -226,8 +314,7 @@ Format: Subject line and email body"""
             if filters.get('severity'):
                 risk_level_map = {'critical': 'high', 'high': 'high', 'medium': 'medium', 'low': 'low'}
                 risk_level = risk_level_map.get(filters['severity'])
-                student_ids = RiskAssessment.objects.filter(risk_level=risk_level).values_list('student_id', flat=True)
-                students = students.filter(id__in=student_ids)
+                students = students.filter(current_risk__risk_level=risk_level)
             
             results = [{
                 'id': s.id,
@@ -240,51 +327,27 @@ Format: Subject line and email body"""
             return JsonResponse({'students': results})
         
         elif action == 'auto_create_interventions':
-            # Auto-create interventions for all high-risk students without existing interventions
-            from datetime import datetime, timedelta
-            
-            high_risk_students = RiskAssessment.objects.filter(risk_level='high').values_list('student_id', flat=True)
-            students_needing_intervention = User.objects.filter(
-                id__in=high_risk_students,
-                role='student'
-            ).exclude(
-                interventions__status='scheduled'
-            )
+            # Runs in the job worker; the page polls auto_interventions_status
+            from jobs.models import Job
+            from jobs.queue import enqueue
+            job = Job.objects.filter(name='auto_create_interventions', status__in=['queued', 'running']).first()
+            if job is None:
+                job = enqueue('auto_create_interventions', {'counselor_id': request.user.id})
             
-            created_count = 0
-            for student in students_needing_intervention:
-                try:
-                    profile = get_student_profile_for_intervention(student)
-                    result = client.recommend_intervention(profile)
-                    
-                    # Create intervention
-                    Intervention.objects.create(
-                        student=student,
-                        counselor=request.user,
-                        intervention_type='counseling',
-                        description=f"AI Auto-Generated: {result.get('summary', 'Intervention needed for high-risk student')}",
-                        scheduled_date=datetime.now() + timedelta(days=3),
-                        status='scheduled'
-                    )
-                    
-                    # Create alert
-                    Alert.objects.create(
-                        student=student,
-                        alert_type='ai_intervention',
-                        severity='high',
-                        message=f"🤖 BT Assistant auto-created intervention for {student.get_full_name()}. High-risk student requires immediate attention.",
-                        resolved=False
-                    )
-                    
-                    created_count += 1
-                except Exception as e:
-                    print(f"Error creating intervention for {student.username}: {e}")
-                    continue
+            # One job covers every high-risk student, so a second click joins the pending
+            # one, whose interventions go to the counselor who started it
+            if job.payload['counselor_id'] == request.user.id:
+                message = 'Creating interventions for high-risk students in the background'
+            else:
+                counselor = User.objects.filter(id=job.payload['counselor_id']).first()
+                name = counselor.get_full_name() or counselor.username if counselor else 'another counselor'
+                message = f'{name} is already creating interventions for high-risk students; they will be assigned to {name}'
             
             return JsonResponse({
                 'success': True,
-                'created_count': created_count,
-                'message': f'Successfully created {created_count} interventions for high-risk students'
+                'job_id': job.id,
+                'started_by_me': job.payload['counselor_id'] == request.user.id,
+                'message': message
             })
         
         elif action == 'ask_ai':
@@ -297,6 +360,25 @@ Format: Subject line and email body"""
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@login_required
+def auto_interventions_status(request, job_id):
+    """Progress of an auto_create_interventions job"""
+    if request.user.role not in ['counselor', 'admin']:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    from jobs.models import Job
+    job = Job.objects.filter(id=job_id, name='auto_create_interventions').first()
+    if job is None:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    
+    return JsonResponse({
+        'status': job.status,
+        'done': job.progress.get('done', 0),
+        'total': job.progress.get('total'),
+        'created_count': job.result.get('created', 0),
+        'failed_count': job.result.get('failed', 0),
+        'retrying': job.status == 'queued' and job.attempts > 0
+    })
+
 @login_required
 @require_http_methods(["POST"])
 def admin_chat(request):
@@ -309,33 +391,10 @@ def admin_chat(request):
         action = data.get('action')
         message = data.get('message', '')
         
-        client = GeminiClient()
+        client = shared_client()
         
         if action == 'generate_report':
-            total_students = User.objects.filter(role='student').count()
-            total_teachers = User.objects.filter(role='teacher').count()
-            total_counselors = User.objects.filter(role='counselor').count()
-            high_risk = RiskAssessment.objects.filter(risk_level='high').count()
-            
-            summary_data = {
-                'total_students': total_students,
-                'total_teachers': total_teachers,
-                'total_counselors': total_counselors,
-                'high_risk_students': high_risk
-            }
-            
-            prompt = f"""Generate an executive summary report for a school admin. Use this data:
-
-System Status: {total_students} students, {total_teachers} teachers, {total_counselors} counselors, {high_risk} high-risk students
-
-Write in a conversational, easy-to-read style:
-- Use emojis (📊 stats, 👥 people, ⚠️ warning, 💡 insight)
-- Create 4 sections: System Overview, Staffing Status, Student Wellness, Action Items
-- Each section should have 2-3 short bullet points
-- Start each bullet with an emoji
-- Keep sentences short and natural
-- No bold text, no asterisks, no markdown
-- Use plain text only"""
+            summary_data, prompt = executive_summary()
             summary = client.generate_text(prompt)
             
             return JsonResponse({'response': summary, 'data': summary_data})
@@ -349,3 +408,68 @@ Write in a conversational, easy-to-read style:
     
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
+
+
+async def chat_events(client, prompt, report=None):
+    """Yield server-sent events: the report figures, the answer as Gemini writes it, then done"""
+    if report is not None:
+        yield f"event: report\ndata: {json.dumps(report)}\n\n"
+    chunks = client.stream_text(prompt)
+    try:
+        async for text in chunks:
+            yield f"data: {json.dumps({'text': text})}\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        return
+    finally:
+        # Also runs when the browser disconnects, which stops the Gemini stream
+        await chunks.aclose()
+    yield 'event: done\ndata: {}\n\n'
+
+
+async def stream_chat(request, roles, reports):
+    """Stream an ask_ai answer or one of reports {action: builder} to a user with one of roles"""
+    from asgiref.sync import sync_to_async
+    from django.core.handlers.asgi import ASGIRequest
+
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+    if user.role not in roles:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    if not isinstance(request, ASGIRequest):
+        # A WSGI worker would be tied up for the whole answer; 204 tells the
+        # page to use the JSON endpoint instead
+        return HttpResponse(status=204)
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    action = data.get('action')
+    if action == 'ask_ai':
+        report, prompt = None, data.get('message', '')
+    elif action in reports:
+        report, prompt = await sync_to_async(reports[action])()
+    else:
+        return JsonResponse({'error': 'Invalid action'}, status=400)
+
+    response = StreamingHttpResponse(chat_events(shared_client(), prompt, report), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_http_methods(["POST"])
+async def counselor_chat_stream(request):
+    """counselor_chat's ask_ai and report actions as server-sent events"""
+    return await stream_chat(request, ['counselor', 'admin'], {
+        'generate_report': system_overview,
+        'weekly_summary': weekly_summary,
+    })
+
+
+@require_http_methods(["POST"])
+async def admin_chat_stream(request):
+    """admin_chat's ask_ai and executive summary as server-sent events"""
+    return await stream_chat(request, ['admin'], {'generate_report': executive_summary})
@@ -59,6 +59,7 @@ INSTALLED_APPS = [
     'cloudinary',
     'cloudinary_storage',
     'messaging',
+    'jobs',
 ]
 
 MIDDLEWARE = [
@@ -94,6 +95,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'campus_care.wsgi.application'
+ASGI_APPLICATION = 'campus_care.asgi.application'
 
 
 # Database
@@ -115,6 +117,23 @@ else:
     }
 
 
+# Cache
+# Shared by every web and worker process when REDIS_URL is set, so signals
+# raised anywhere reach the open notification streams
+
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# How long a cached navbar counter is served (seconds). Signals keep the cached
+# counters current, but without REDIS_URL each process has its own cache and
+# only sees the signals raised in that process, so another gunicorn worker's
+# badges would stay off until the counter expires: keep it to a few seconds then
+NOTIFICATION_COUNTER_TIMEOUT = config('NOTIFICATION_COUNTER_TIMEOUT', default=10 * 60 if REDIS_URL else 5, cast=int)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -181,6 +200,27 @@ AUTH_USER_MODEL = 'accounts.User'
 
 # Gemini API Configuration
 GEMINI_API_KEY = config('GEMINI_API_KEY', default='')
+# Gemini quota shared by every process through the cache (free tier: 15 RPM, 1M TPM)
+GEMINI_RPM = config('GEMINI_RPM', default=15, cast=int)
+GEMINI_TPM = config('GEMINI_TPM', default=1000000, cast=int)
+# Calls a single command or job keeps in flight at once
+GEMINI_MAX_CONCURRENCY = config('GEMINI_MAX_CONCURRENCY', default=4, cast=int)
+# Where cached Gemini responses are kept: 'db' (cache + CachedResponse table, survives restarts) or 'cache'
+GEMINI_CACHE_STORE = config('GEMINI_CACHE_STORE', default='db')
+
+# Local models (manage.py train_risk_model / benchmark_sentiment --train) and how sure they must be to skip Gemini
+ML_ARTIFACTS_DIR = BASE_DIR / 'ml_models' / 'artifacts'
+RISK_MODEL_CONFIDENCE = config('RISK_MODEL_CONFIDENCE', default=0.9, cast=float)
+SENTIMENT_MODEL_CONFIDENCE = config('SENTIMENT_MODEL_CONFIDENCE', default=0.75, cast=float)
+# Share of confidently classified check-ins still sent to Gemini, as labels benchmark_sentiment can trust
+SENTIMENT_AUDIT_RATE = config('SENTIMENT_AUDIT_RATE', default=0.05, cast=float)
+
+# Background jobs queued by `python manage.py run_jobs` (job name -> interval in seconds)
+JOB_SCHEDULE = {
+    'calculate_risk': config('RISK_REFRESH_SECONDS', default=24 * 60 * 60, cast=int),
+    'predict_risks': config('PREDICTION_REFRESH_SECONDS', default=24 * 60 * 60, cast=int),
+    'analyze_existing_checkins': config('SENTIMENT_BACKFILL_SECONDS', default=60 * 60, cast=int),
+}
 
 # Django Allauth Configuration
 SITE_ID = 1
@@ -0,0 +1,12 @@
+from django.contrib import admin
+from .models import Job, Checkpoint
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'run_at', 'attempts', 'locked_by', 'finished_at']
+    list_filter = ['name', 'status']
+    readonly_fields = ['created_at', 'started_at', 'finished_at', 'last_error', 'progress', 'result']
+
+@admin.register(Checkpoint)
+class CheckpointAdmin(admin.ModelAdmin):
+    list_display = ['name', 'position', 'updated_at']
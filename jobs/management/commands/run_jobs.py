@@ -0,0 +1,78 @@
+import os
+import socket
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, close_old_connections, connection
+
+from jobs.queue import claim, execute, schedule_due
+
+
+class Command(BaseCommand):
+    help = 'Run the background job worker (scheduled risk recalculation, AI predictions, sentiment analysis)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the runnable jobs and exit instead of waiting for more')
+        parser.add_argument('--poll-interval', type=float, default=5, help='Seconds to sleep when the queue is empty (default 5)')
+        parser.add_argument('--no-schedule', action='store_true', help='Only run queued jobs, do not queue scheduled ones')
+        parser.add_argument('--concurrency', type=int, default=1, help='Number of jobs to run at the same time (default 1)')
+
+    def handle(self, *args, **options):
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self.stop = threading.Event()
+        self.stdout.write(f'Job worker {worker_id} started with {options["concurrency"]} thread(s)')
+
+        threads = [
+            threading.Thread(target=self.work, args=(f'{worker_id}:{n}', options, n == 0), name=f'run_jobs-{n}')
+            for n in range(max(options['concurrency'], 1))
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            # Let every thread finish the job it is running
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.stdout.write(f'Job worker {worker_id} stopped')
+
+    def work(self, worker_id, options, schedule):
+        """One worker thread: claim and run jobs until stopped (or drained with --once)"""
+        try:
+            while not self.stop.is_set():
+                close_old_connections()
+                if schedule and not options['no_schedule']:
+                    for job in schedule_due():
+                        self.stdout.write(f'Scheduled {job.name} #{job.id}')
+
+                try:
+                    job = claim(worker_id)
+                except DatabaseError as e:
+                    # Keep the thread alive through a dropped connection or lock timeout
+                    self.stderr.write(f'Could not claim a job: {e}')
+                    connection.close()
+                    self.stop.wait(options['poll_interval'])
+                    continue
+                if job is None:
+                    if options['once']:
+                        break
+                    self.stop.wait(options['poll_interval'])
+                    continue
+
+                self.stdout.write(f'Running {job.name} #{job.id} (attempt {job.attempts}/{job.max_attempts})')
+                start = time.perf_counter()
+                execute(job)
+                elapsed = time.perf_counter() - start
+                if job.status == 'succeeded':
+                    self.stdout.write(self.style.SUCCESS(f'{job.name} #{job.id} succeeded in {elapsed:.1f}s'))
+                elif job.status == 'queued':
+                    self.stdout.write(self.style.WARNING(f'{job.name} #{job.id} failed, retrying at {job.run_at:%H:%M:%S}'))
+                else:
+                    self.stdout.write(self.style.ERROR(f'{job.name} #{job.id} failed after {job.attempts} attempts'))
+        finally:
+            connection.close()
@@ -0,0 +1,175 @@
+"""DB-backed job queue.
+
+Handlers are registered with the ``task`` decorator in an app's tasks.py and
+run by ``python manage.py run_jobs``. A handler may record its progress with
+``report_progress`` and return a JSON-serialisable result, both kept on the
+Job. A worker claims a job by taking a lease on it; if the worker dies the
+lease expires and another worker picks the job up again. Failed jobs are retried with exponential backoff until
+``max_attempts`` is reached.
+"""
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+
+from .models import Job
+
+DEFAULT_LEASE_SECONDS = 5 * 60
+RETRY_BACKOFF_SECONDS = 30
+
+HANDLERS = {}
+
+
+class Handler:
+    def __init__(self, func, lease, max_attempts):
+        self.func = func
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+
+def task(name, lease=DEFAULT_LEASE_SECONDS, max_attempts=3):
+    """Register a function taking the Job as the handler for jobs called name"""
+    def decorator(func):
+        HANDLERS[name] = Handler(func, lease, max_attempts)
+        return func
+    return decorator
+
+
+def enqueue(name, payload=None, run_at=None):
+    """Queue a job to run as soon as a worker is free (or at run_at)"""
+    handler = HANDLERS.get(name)
+    return Job.objects.create(
+        name=name,
+        payload=payload or {},
+        run_at=run_at or timezone.now(),
+        max_attempts=handler.max_attempts if handler else 3,
+    )
+
+
+def report_progress(job, **progress):
+    """Record how far a running job got, for pages polling it"""
+    job.progress = {**job.progress, **progress}
+    Job.objects.filter(pk=job.pk).update(progress=job.progress)
+
+
+def last_finished(name, status='succeeded'):
+    """Return the finish time of the newest job called name with this status"""
+    return Job.objects.filter(
+        name=name, status=status
+    ).order_by('-finished_at').values_list('finished_at', flat=True).first()
+
+
+def _lock_schedule(name):
+    """Serialise schedule_due() across workers for name until the transaction ends"""
+    # Other databases in use here (SQLite in development) already serialise writers
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(hashtext(%s))', [f'jobs.schedule:{name}'])
+
+
+def schedule_due():
+    """Queue every job in settings.JOB_SCHEDULE whose interval has elapsed"""
+    now = timezone.now()
+    queued = []
+    for name, interval in getattr(settings, 'JOB_SCHEDULE', {}).items():
+        # Check and insert under one lock, or two workers could both queue the job
+        with transaction.atomic():
+            _lock_schedule(name)
+            if Job.objects.filter(name=name, status__in=['queued', 'running']).exists():
+                continue
+            last = Job.objects.filter(
+                name=name, finished_at__isnull=False
+            ).order_by('-finished_at').values_list('finished_at', flat=True).first()
+            if last is None or last <= now - timedelta(seconds=interval):
+                queued.append(enqueue(name))
+    return queued
+
+
+def claim(worker_id):
+    """Lease the next runnable job to worker_id, or return None"""
+    now = timezone.now()
+    with transaction.atomic():
+        while True:
+            job = Job.objects.select_for_update(skip_locked=True).filter(
+                Q(status='queued', run_at__lte=now) |
+                Q(status='running', lease_expires_at__lt=now)
+            ).order_by('run_at').first()
+            if job is None:
+                return None
+            if job.status == 'queued' or job.attempts < job.max_attempts:
+                break
+            # The lease ran out on the last attempt: a job that kills its worker is not retried forever
+            job.status = 'failed'
+            job.finished_at = now
+            job.last_error = f'Lease expired on attempt {job.attempts} of {job.max_attempts} (worker {job.locked_by} stopped)'
+            job.locked_by = ''
+            job.lease_expires_at = None
+            job.save(update_fields=['status', 'finished_at', 'last_error', 'locked_by', 'lease_expires_at'])
+
+        handler = HANDLERS.get(job.name)
+        job.status = 'running'
+        job.locked_by = worker_id
+        job.attempts += 1
+        job.started_at = now
+        job.lease_expires_at = now + timedelta(seconds=handler.lease if handler else DEFAULT_LEASE_SECONDS)
+        job.save(update_fields=['status', 'locked_by', 'attempts', 'started_at', 'lease_expires_at'])
+    return job
+
+
+def execute(job):
+    """Run a claimed job and record the outcome.
+
+    The result is only written while the worker still holds the lease, so a
+    worker that overran its lease cannot clobber the job after another worker
+    has reclaimed it.
+    """
+    handler = HANDLERS.get(job.name)
+    try:
+        if handler is None:
+            raise LookupError(f'No handler registered for job "{job.name}"')
+        result = handler.func(job)
+    except Exception:
+        now = timezone.now()
+        updates = {'last_error': traceback.format_exc()}
+        if job.attempts < job.max_attempts:
+            updates['status'] = 'queued'
+            updates['run_at'] = now + timedelta(seconds=RETRY_BACKOFF_SECONDS * 2 ** (job.attempts - 1))
+        else:
+            updates['status'] = 'failed'
+            updates['finished_at'] = now
+    else:
+        updates = {'status': 'succeeded', 'finished_at': timezone.now()}
+        if result is not None:
+            updates['result'] = result
+
+    updates.update(locked_by='', lease_expires_at=None)
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(**updates)
+    for field, value in updates.items():
+        setattr(job, field, value)
+    return job
+
+
+def queue_stats():
+    """Per job name: queue depth, lag of the oldest runnable job, and recent outcomes"""
+    now = timezone.now()
+    day_ago = now - timedelta(days=1)
+    runnable = Q(status='queued', run_at__lte=now)
+    rows = Job.objects.values('name').annotate(
+        queued=Count('id', filter=runnable),
+        scheduled=Count('id', filter=Q(status='queued', run_at__gt=now)),
+        running=Count('id', filter=Q(status='running')),
+        retrying=Count('id', filter=runnable & Q(attempts__gt=0)),
+        succeeded_24h=Count('id', filter=Q(status='succeeded', finished_at__gte=day_ago)),
+        failed_24h=Count('id', filter=Q(status='failed', finished_at__gte=day_ago)),
+        oldest_runnable=Min('run_at', filter=runnable),
+        last_finished=Max('finished_at'),
+    ).order_by('name')
+
+    stats = []
+    for row in rows:
+        row['lag'] = now - row['oldest_runnable'] if row['oldest_runnable'] else None
+        stats.append(row)
+    return stats
@@ -0,0 +1,161 @@
+import threading
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .models import Job
+from .queue import RETRY_BACKOFF_SECONDS, claim, enqueue, execute, queue_stats, report_progress, schedule_due, task
+
+calls = []
+
+
+@task('test_succeeds', lease=60)
+def succeeds(job):
+    report_progress(job, done=1)
+    calls.append(job.payload)
+    return {'echo': job.payload}
+
+
+@task('test_fails', lease=60, max_attempts=2)
+def fails(job):
+    raise RuntimeError('boom')
+
+
+class QueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_claim_and_execute(self):
+        job = enqueue('test_succeeds', {'n': 1})
+        claimed = claim('worker-1')
+        self.assertEqual((claimed.id, claimed.status, claimed.attempts, claimed.locked_by), (job.id, 'running', 1, 'worker-1'))
+        self.assertIsNone(claim('worker-2'))
+
+        execute(claimed)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.progress, job.locked_by), ('succeeded', {'echo': {'n': 1}}, {'done': 1}, ''))
+        self.assertEqual(calls, [{'n': 1}])
+
+    def test_future_jobs_wait(self):
+        enqueue('test_succeeds', run_at=timezone.now() + timedelta(minutes=5))
+        self.assertIsNone(claim('worker-1'))
+
+    def test_retry_with_backoff_then_fail(self):
+        job = enqueue('test_fails')
+        before = timezone.now()
+        execute(claim('worker-1'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn('RuntimeError: boom', job.last_error)
+        self.assertGreaterEqual(job.run_at, before + timedelta(seconds=RETRY_BACKOFF_SECONDS))
+        self.assertIsNone(claim('worker-1'))
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        execute(claim('worker-1'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_unknown_handler_fails(self):
+        job = enqueue('test_missing')
+        Job.objects.filter(pk=job.pk).update(max_attempts=1)
+        execute(claim('worker-1'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('No handler registered', job.last_error)
+
+    def test_expired_lease_is_reclaimed(self):
+        job = enqueue('test_succeeds')
+        stale = claim('worker-1')
+        Job.objects.filter(pk=job.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+        reclaimed = claim('worker-2')
+        self.assertEqual((reclaimed.id, reclaimed.attempts, reclaimed.locked_by), (job.id, 2, 'worker-2'))
+        # The first worker lost its lease, so its outcome is not recorded
+        execute(stale)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), ('running', 'worker-2'))
+        execute(reclaimed)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded')
+
+    def test_expired_lease_on_last_attempt_fails(self):
+        crashing = enqueue('test_fails')
+        Job.objects.filter(pk=crashing.pk).update(
+            status='running', attempts=2, locked_by='worker-1', lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        waiting = enqueue('test_succeeds')
+
+        self.assertEqual(claim('worker-2').id, waiting.id)
+        crashing.refresh_from_db()
+        self.assertEqual((crashing.status, crashing.attempts, crashing.locked_by), ('failed', 2, ''))
+        self.assertIn('Lease expired on attempt 2 of 2', crashing.last_error)
+
+    @override_settings(JOB_SCHEDULE={'test_succeeds': 3600})
+    def test_schedule_due(self):
+        first = schedule_due()
+        self.assertEqual([job.name for job in first], ['test_succeeds'])
+        # Already queued
+        self.assertEqual(schedule_due(), [])
+
+        execute(claim('worker-1'))
+        self.assertEqual(schedule_due(), [])
+        Job.objects.update(finished_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(len(schedule_due()), 1)
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_queue_stats(self):
+        enqueue('test_succeeds')
+        enqueue('test_succeeds', run_at=timezone.now() + timedelta(minutes=5))
+        execute(claim('worker-1'))
+        enqueue('test_succeeds', run_at=timezone.now() - timedelta(minutes=2))
+        failing = enqueue('test_fails')
+        Job.objects.filter(pk=failing.pk).update(run_at=timezone.now() - timedelta(hours=1))
+        execute(claim('worker-1'))
+        Job.objects.filter(pk=failing.pk).update(run_at=timezone.now() - timedelta(minutes=1))
+
+        fails, succeeds = queue_stats()
+        self.assertEqual(
+            {key: fails[key] for key in ('name', 'queued', 'retrying', 'running', 'failed_24h')},
+            {'name': 'test_fails', 'queued': 1, 'retrying': 1, 'running': 0, 'failed_24h': 0},
+        )
+        self.assertEqual(
+            {key: succeeds[key] for key in ('name', 'queued', 'scheduled', 'retrying', 'succeeded_24h')},
+            {'name': 'test_succeeds', 'queued': 1, 'scheduled': 1, 'retrying': 0, 'succeeded_24h': 1},
+        )
+        self.assertGreaterEqual(succeeds['lag'], timedelta(minutes=2))
+
+
+class RunJobsTests(SimpleTestCase):
+    def test_concurrency_runs_jobs_at_once(self):
+        pending = list(range(12))
+        lock = threading.Lock()
+        ran, threads = [], set()
+        # The first three jobs only finish once three threads are running jobs together
+        together = threading.Barrier(3, timeout=5)
+
+        def fake_claim(worker_id):
+            with lock:
+                return SimpleNamespace(id=pending.pop(), name='test_succeeds', attempts=1, max_attempts=3) if pending else None
+
+        def fake_execute(job):
+            if job.id >= 9:
+                together.wait()
+            with lock:
+                ran.append(job.id)
+                threads.add(threading.current_thread().name)
+            job.status = 'succeeded'
+            return job
+
+        out = StringIO()
+        with mock.patch('jobs.management.commands.run_jobs.claim', fake_claim), \
+                mock.patch('jobs.management.commands.run_jobs.execute', fake_execute):
+            call_command('run_jobs', '--once', '--no-schedule', '--concurrency', '3', stdout=out)
+        self.assertIn('started with 3 thread(s)', out.getvalue())
+        self.assertEqual(sorted(ran), list(range(12)))
+        self.assertEqual(len(threads), 3)
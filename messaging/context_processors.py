@@ -1,9 +1,5 @@
 def unread_messages_count(request):
     if request.user.is_authenticated:
-        from messaging.models import Message
-        count = Message.objects.filter(
-            conversation__participants=request.user,
-            is_read=False
-        ).exclude(sender=request.user).count()
-        return {'unread_messages_count': count}
+        from accounts.notifications import notification_counts
+        return {'unread_messages_count': notification_counts(request.user)['messages']}
     return {'unread_messages_count': 0}
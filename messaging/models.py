@@ -1,9 +1,12 @@
 from django.db import models
 from django.conf import settings
+from django.urls import reverse
 
 
 class Conversation(models.Model):
     participants = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='conversations')
+    # Denormalized newest message, kept current by messaging.signals
+    last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -27,8 +30,27 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['conversation', 'is_read', 'sender'], name='message_conv_read_sender_idx'),
+            # Keyset pagination of a conversation's history
+            models.Index(fields=['conversation', '-created_at', '-id'], name='message_conv_history_idx'),
+            # Partial index: unread messages are the only ones the badges count
+            models.Index(fields=['conversation', 'sender'], name='message_unread_idx', condition=models.Q(is_read=False)),
+        ]
 
     def is_image(self):
         if self.attachment:
             return self.attachment.name.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp'))
         return False
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'sender_id': self.sender_id,
+            'body': self.body,
+            # Resolved by the attachment view on demand, never for off-screen messages
+            'attachment_url': reverse('messaging:attachment', args=[self.id]) if self.attachment else None,
+            'attachment_name': self.attachment.name.rsplit('/', 1)[-1] if self.attachment else None,
+            'is_image': self.is_image(),
+            'created_at': self.created_at.strftime('%b %d, %I:%M %p'),
+        }
@@ -0,0 +1,170 @@
+"""In-process pub/sub feeding the conversation streams.
+
+Message saves, read receipts and typing pings are published to a per
+conversation channel; every open stream in this process subscribed to the
+channel gets the event straight away without touching the database.
+
+Streams served by another process do not see those events, so new message
+ids and read receipts are also stamped in the cache. A stream compares the
+stamps once a second and only reads the database when a stamp shows it missed
+something, which keeps idle streams off the database in both cases.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+
+LAST_MESSAGE_KEY = 'messaging:conversation:{}:last'
+READ_KEY = 'messaging:conversation:{}:read'
+STAMP_TIMEOUT = 24 * 60 * 60
+
+# Events a slow stream may fall behind by before new ones are dropped (it
+# catches up from the cache stamps)
+QUEUE_SIZE = 100
+# How often an open stream checks the cache stamps (seconds)
+STREAM_CHECK_INTERVAL = 1
+STREAM_KEEPALIVE_INTERVAL = 15
+# Streams are closed after this long and the browser reconnects
+STREAM_MAX_DURATION = 5 * 60
+STREAM_RETRY_MS = 2000
+
+
+class Broker:
+    """Fan events out to asyncio queues, safe to publish from any thread"""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscription = (asyncio.get_running_loop(), asyncio.Queue(maxsize=QUEUE_SIZE))
+        with self._lock:
+            self._subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, channel, subscription):
+        with self._lock:
+            self._subscribers[channel].discard(subscription)
+            if not self._subscribers[channel]:
+                del self._subscribers[channel]
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscriptions = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscriptions:
+            try:
+                loop.call_soon_threadsafe(_put, queue, event)
+            except RuntimeError:
+                pass  # Loop already closed, the stream is gone
+
+
+def _put(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        pass
+
+
+broker = Broker()
+
+
+def channel_name(conv_id):
+    return f'conversation:{conv_id}'
+
+
+def publish_message(message):
+    """Send a saved message to the conversation's streams once committed"""
+    event = {'type': 'message', **message.to_dict()}
+
+    def send():
+        cache.set(LAST_MESSAGE_KEY.format(message.conversation_id), message.id, STAMP_TIMEOUT)
+        broker.publish(channel_name(message.conversation_id), event)
+    transaction.on_commit(send)
+
+
+def publish_read(conv_id, user_id, up_to):
+    """user_id has read every message up to the id up_to"""
+    event = {'type': 'read', 'user_id': user_id, 'up_to': up_to}
+
+    def send():
+        receipts = cache.get(READ_KEY.format(conv_id)) or {}
+        receipts[str(user_id)] = up_to
+        cache.set(READ_KEY.format(conv_id), receipts, STAMP_TIMEOUT)
+        broker.publish(channel_name(conv_id), event)
+    transaction.on_commit(send)
+
+
+def publish_typing(conv_id, user_id):
+    # Typing pings are throwaway, streams in other processes just miss them
+    broker.publish(channel_name(conv_id), {'type': 'typing', 'user_id': user_id})
+
+
+def _format(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def conversation_events(conv_id, after):
+    """Yield server-sent events for a conversation, starting after message id after"""
+    from asgiref.sync import sync_to_async
+    from .models import Message
+
+    def missed_messages(after_id):
+        return [
+            {'type': 'message', **msg.to_dict()}
+            for msg in Message.objects.filter(conversation_id=conv_id, id__gt=after_id)
+        ]
+
+    channel = channel_name(conv_id)
+    keys = [LAST_MESSAGE_KEY.format(conv_id), READ_KEY.format(conv_id)]
+    subscription = broker.subscribe(channel)
+    queue = subscription[1]
+    loop = asyncio.get_running_loop()
+    started = last_sent = last_checked = loop.time()
+    last_id = after
+    receipts = None
+
+    try:
+        yield f'retry: {STREAM_RETRY_MS}\n\n'
+        while loop.time() - started < STREAM_MAX_DURATION:
+            events = []
+            try:
+                events.append(await asyncio.wait_for(queue.get(), STREAM_CHECK_INTERVAL))
+                while not queue.empty():
+                    events.append(queue.get_nowait())
+            except asyncio.TimeoutError:
+                pass
+            seen_id = last_id
+            for event in events:
+                if event['type'] == 'message':
+                    seen_id = max(seen_id, event['id'])
+                elif event['type'] == 'read' and receipts is not None:
+                    receipts[str(event['user_id'])] = event['up_to']
+
+            if loop.time() - last_checked >= STREAM_CHECK_INTERVAL:
+                last_checked = loop.time()
+                stamps = await cache.aget_many(keys)
+                if (stamps.get(keys[0]) or 0) > seen_id:
+                    events.extend(await sync_to_async(missed_messages)(seen_id))
+                current_receipts = stamps.get(keys[1]) or {}
+                if receipts is not None:
+                    for user_id, up_to in current_receipts.items():
+                        if receipts.get(user_id) != up_to:
+                            events.append({'type': 'read', 'user_id': int(user_id), 'up_to': up_to})
+                receipts = current_receipts
+
+            for event in events:
+                if event['type'] == 'message':
+                    if event['id'] <= last_id:
+                        continue
+                    last_id = event['id']
+                yield _format(event)
+                last_sent = loop.time()
+
+            if loop.time() - last_sent >= STREAM_KEEPALIVE_INTERVAL:
+                yield ': keepalive\n\n'
+                last_sent = loop.time()
+    finally:
+        broker.unsubscribe(channel, subscription)
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Conversation, Message
+from .pubsub import publish_message
+
+
+@receiver(post_save, sender=Message)
+def push_new_message(sender, instance, created, **kwargs):
+    """Deliver new messages to the open conversation streams"""
+    if created:
+        publish_message(instance)
+
+
+@receiver(post_save, sender=Message)
+def update_last_message(sender, instance, created, **kwargs):
+    """Point the conversation at its newest message for the inbox"""
+    if created:
+        Conversation.objects.filter(id=instance.conversation_id).update(last_message=instance)
+
+
+@receiver(post_delete, sender=Message)
+def reset_last_message(sender, instance, **kwargs):
+    newest = Message.objects.filter(conversation_id=instance.conversation_id).order_by('-created_at', '-id').first()
+    Conversation.objects.filter(id=instance.conversation_id, last_message__isnull=True).update(last_message=newest)
@@ -1,3 +1,166 @@
+import asyncio
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts.models import User
+from .models import Conversation, Message
+from .pubsub import LAST_MESSAGE_KEY, READ_KEY, STREAM_RETRY_MS, broker, channel_name, conversation_events
+
+
+class InboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.counselor = User.objects.create_user(username='counselor', password='pw', role='counselor')
+        self.client.force_login(self.counselor)
+
+    def add_conversations(self, count):
+        for i in range(count):
+            student = User.objects.create_user(username=f'student{User.objects.count()}', password='pw', role='student')
+            conv = Conversation.objects.create()
+            conv.participants.add(self.counselor, student)
+            Message.objects.create(conversation=conv, sender=self.counselor, body='How are you?')
+            Message.objects.create(conversation=conv, sender=student, body=f'Fine {i}')
+
+    def inbox_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('messaging:inbox'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_query_count_is_constant(self):
+        self.add_conversations(2)
+        few, _ = self.inbox_queries()
+        self.add_conversations(40)
+        many, response = self.inbox_queries()
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.context['conversations']), 25)
+
+    def test_annotated_values(self):
+        self.add_conversations(3)
+        _, response = self.inbox_queries()
+        for item in response.context['conversations']:
+            conv = item['conv']
+            self.assertEqual(item['other'], conv.get_other_participant(self.counselor))
+            self.assertEqual(item['unread'], conv.unread_count_for(self.counselor))
+            self.assertEqual(item['unread'], 1)
+            self.assertEqual(item['last_msg'], conv.messages.last())
+
+    def test_last_message_follows_deletes(self):
+        self.add_conversations(1)
+        conv = Conversation.objects.get()
+        first, last = conv.messages.all()
+        last.delete()
+        conv.refresh_from_db()
+        self.assertEqual(conv.last_message, first)
+
+
+class ConversationHistoryTests(TestCase):
+    def setUp(self):
+        self.counselor = User.objects.create_user(username='counselor', password='pw', role='counselor')
+        self.student = User.objects.create_user(username='student', password='pw', role='student')
+        self.conv = Conversation.objects.create()
+        self.conv.participants.add(self.counselor, self.student)
+        Message.objects.bulk_create([
+            Message(conversation=self.conv, sender=self.student if i % 2 else self.counselor, body=f'Message {i}')
+            for i in range(120)
+        ])
+        self.client.force_login(self.counselor)
+
+    def test_pages_cover_the_whole_history_once(self):
+        response = self.client.get(reverse('messaging:conversation', args=[self.conv.id]))
+        ids = [msg.id for msg in response.context['msgs']]
+        self.assertEqual(len(ids), 50)
+        cursor = response.context['older_cursor']
+        while cursor:
+            data = self.client.get(reverse('messaging:message_history', args=[self.conv.id]), {'before': cursor}).json()
+            ids = [msg['id'] for msg in data['messages']] + ids
+            cursor = data['older_cursor']
+        self.assertEqual(ids, list(self.conv.messages.order_by('created_at', 'id').values_list('id', flat=True)))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('messaging:message_history', args=[self.conv.id]), {'before': 'nope'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_history_of_other_conversations_is_denied(self):
+        outsider = User.objects.create_user(username='outsider', password='pw', role='student')
+        self.client.force_login(outsider)
+        response = self.client.get(reverse('messaging:message_history', args=[self.conv.id]), {'before': 'x,1'})
+        self.assertEqual(response.status_code, 404)
+
+
+@mock.patch('messaging.pubsub.STREAM_CHECK_INTERVAL', 0.01)
+class ConversationStreamTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.counselor = User.objects.create_user(username='counselor', password='pw', role='counselor')
+        self.student = User.objects.create_user(username='student', password='pw', role='student')
+        self.conv = Conversation.objects.create()
+        self.conv.participants.add(self.counselor, self.student)
+        self.client.force_login(self.counselor)
+
+    async def test_stream_relays_published_events(self):
+        events = conversation_events(self.conv.id, 0)
+        self.assertEqual(await anext(events), f'retry: {STREAM_RETRY_MS}\n\n')
+        channel = channel_name(self.conv.id)
+        # Published from another thread, as signal handlers in sync views do
+        for event in [{'type': 'message', 'id': 7, 'body': 'hi'}, {'type': 'message', 'id': 7, 'body': 'hi'}, {'type': 'typing', 'user_id': 3}]:
+            await asyncio.to_thread(broker.publish, channel, event)
+        self.assertEqual(await anext(events), 'event: message\ndata: {"type": "message", "id": 7, "body": "hi"}\n\n')
+        # The repeated message is dropped
+        self.assertEqual(await anext(events), 'event: typing\ndata: {"type": "typing", "user_id": 3}\n\n')
+        await events.aclose()
+        self.assertNotIn(channel, broker._subscribers)
+
+    async def test_stream_catches_up_from_cache_stamps(self):
+        """Events published in another process only show up as cache stamps"""
+        events = conversation_events(self.conv.id, 0)
+        await anext(events)
+        message = await Message.objects.acreate(conversation=self.conv, sender=self.student, body='From elsewhere')
+        await cache.aset(LAST_MESSAGE_KEY.format(self.conv.id), message.id)
+        self.assertIn('"body": "From elsewhere"', await anext(events))
+
+        await cache.aset(READ_KEY.format(self.conv.id), {str(self.student.id): message.id})
+        self.assertEqual(
+            await anext(events),
+            f'event: read\ndata: {{"type": "read", "user_id": {self.student.id}, "up_to": {message.id}}}\n\n'
+        )
+        await events.aclose()
+
+    def test_new_message_and_read_receipt_stamps(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.create(conversation=self.conv, sender=self.student, body='Hello')
+        self.assertEqual(cache.get(LAST_MESSAGE_KEY.format(self.conv.id)), message.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('messaging:read_messages', args=[self.conv.id]), {'up_to': message.id})
+        self.assertEqual(response.status_code, 200)
+        message.refresh_from_db()
+        self.assertTrue(message.is_read)
+        self.assertEqual(cache.get(READ_KEY.format(self.conv.id)), {str(self.counselor.id): message.id})
+
+    def test_typing(self):
+        with mock.patch('messaging.views.publish_typing') as publish:
+            response = self.client.post(reverse('messaging:typing', args=[self.conv.id]))
+        self.assertEqual(response.status_code, 200)
+        publish.assert_called_once_with(self.conv.id, self.counselor.id)
+
+        self.client.force_login(User.objects.create_user(username='outsider', password='pw', role='student'))
+        response = self.client.post(reverse('messaging:typing', args=[self.conv.id]))
+        self.assertEqual(response.status_code, 403)
+
+    def test_invalid_ids_are_rejected(self):
+        response = self.client.get(reverse('messaging:poll_messages', args=[self.conv.id]), {'after': 'x'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('messaging:read_messages', args=[self.conv.id]), {'up_to': 'x'})
+        self.assertEqual(response.status_code, 400)
 
-# Create your tests here.
+    async def test_stream_rejects_invalid_after(self):
+        await self.async_client.aforce_login(self.counselor)
+        response = await self.async_client.get(reverse('messaging:conversation_stream', args=[self.conv.id]), {'after': 'x'})
+        self.assertEqual(response.status_code, 400)
@@ -9,4 +9,9 @@ urlpatterns = [
     path('new/<int:recipient_id>/', views.new_message, name='new_message_to'),
     path('<int:conv_id>/', views.conversation, name='conversation'),
     path('<int:conv_id>/poll/', views.poll_messages, name='poll_messages'),
+    path('<int:conv_id>/history/', views.message_history, name='message_history'),
+    path('attachment/<int:message_id>/', views.attachment, name='attachment'),
+    path('<int:conv_id>/stream/', views.conversation_stream, name='conversation_stream'),
+    path('<int:conv_id>/typing/', views.typing, name='typing'),
+    path('<int:conv_id>/read/', views.read_messages, name='read_messages'),
 ]
@@ -1,12 +1,17 @@
 import json
+from datetime import datetime
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
-from django.db.models import Q
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.core.paginator import Paginator
+from django.db.models import Count, FilteredRelation, OuterRef, Q, Subquery
 from django.views.decorators.http import require_POST
 from .models import Conversation, Message
 from accounts.models import User
+from accounts.notifications import messages_read
+from .pubsub import publish_read, publish_typing
 
 # Role-based allowed recipients
 ALLOWED_RECIPIENTS = {
@@ -17,16 +22,69 @@ ALLOWED_RECIPIENTS = {
 }
 
 
+INBOX_PAGE_SIZE = 25
+
+
 @login_required
 def inbox(request):
-    convs = request.user.conversations.prefetch_related('participants', 'messages').all()
-    data = []
-    for conv in convs:
-        other = conv.get_other_participant(request.user)
-        last_msg = conv.messages.last()
-        unread = conv.unread_count_for(request.user)
-        data.append({'conv': conv, 'other': other, 'last_msg': last_msg, 'unread': unread})
-    return render(request, 'messaging/inbox.html', {'conversations': data})
+    user = request.user
+    other_participant = Conversation.participants.through.objects.filter(
+        conversation=OuterRef('pk')
+    ).exclude(user=user).values('user')[:1]
+    convs = user.conversations.select_related('last_message').annotate(
+        unread_messages=FilteredRelation('messages', condition=Q(messages__is_read=False) & ~Q(messages__sender=user)),
+    ).annotate(
+        unread=Count('unread_messages'),
+        other_id=Subquery(other_participant),
+    ).order_by('-updated_at', '-id')
+
+    page = Paginator(convs, INBOX_PAGE_SIZE).get_page(request.GET.get('page'))
+    others = User.objects.in_bulk([conv.other_id for conv in page if conv.other_id])
+    data = [
+        {'conv': conv, 'other': others.get(conv.other_id), 'last_msg': conv.last_message, 'unread': conv.unread}
+        for conv in page
+    ]
+    return render(request, 'messaging/inbox.html', {'conversations': data, 'page_obj': page})
+
+
+HISTORY_PAGE_SIZE = 50
+
+
+def encode_cursor(msg):
+    return f'{msg.created_at.isoformat()},{msg.id}'
+
+
+def decode_cursor(cursor):
+    created_at, msg_id = cursor.rsplit(',', 1)
+    created_at = datetime.fromisoformat(created_at)
+    if timezone.is_naive(created_at):
+        raise ValueError('cursor timestamp has no timezone')
+    return created_at, int(msg_id)
+
+
+def message_page(conv, before=None, size=HISTORY_PAGE_SIZE):
+    """Return (messages, has_more): the newest size messages before the
+    (created_at, id) cursor before, oldest first."""
+    msgs = conv.messages.order_by('-created_at', '-id')
+    if before:
+        created_at, msg_id = before
+        msgs = msgs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=msg_id))
+    page = list(msgs[:size + 1])
+    return page[:size][::-1], len(page) > size
+
+
+def mark_read(conv, user, up_to=None):
+    """Mark the messages user received in conv as read and send the receipt"""
+    unread = conv.messages.filter(is_read=False).exclude(sender=user)
+    if up_to is not None:
+        unread = unread.filter(id__lte=up_to)
+    newest = unread.order_by('-id').values_list('id', flat=True).first()
+    if newest is None:
+        return
+    marked = unread.filter(id__lte=newest).update(is_read=True)
+    if marked:
+        messages_read(user, marked)
+        publish_read(conv.id, user.id, newest)
 
 
 @login_required
@@ -37,7 +95,7 @@ def conversation(request, conv_id):
         return redirect('messaging:inbox')
 
     # Mark all unread messages as read
-    conv.messages.filter(is_read=False).exclude(sender=request.user).update(is_read=True)
+    mark_read(conv, request.user)
 
     if request.method == 'POST':
         body = request.POST.get('body', '').strip()
@@ -52,49 +110,114 @@ def conversation(request, conv_id):
             conv.save()
             # AJAX send — return JSON
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                return JsonResponse({
-                    'id': msg.id,
-                    'body': msg.body,
-                    'attachment_url': msg.attachment.url if msg.attachment else None,
-                    'is_image': msg.is_image() if msg.attachment else False,
-                    'created_at': msg.created_at.strftime('%b %d, %I:%M %p'),
-                    'is_mine': True,
-                })
+                return JsonResponse({**msg.to_dict(), 'is_mine': True})
         return redirect('messaging:conversation', conv_id=conv.id)
 
     other = conv.get_other_participant(request.user)
+    msgs, has_more = message_page(conv)
     return render(request, 'messaging/conversation.html', {
         'conv': conv,
         'other': other,
-        'msgs': conv.messages.all(),
+        'msgs': msgs,
+        'last_id': msgs[-1].id if msgs else 0,
+        'older_cursor': encode_cursor(msgs[0]) if has_more else '',
+    })
+
+
+@login_required
+def message_history(request, conv_id):
+    """Return the page of messages before ?before=<cursor> as JSON, oldest first."""
+    conv = get_object_or_404(Conversation, id=conv_id, participants=request.user)
+    try:
+        before = decode_cursor(request.GET['before'])
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'invalid cursor'}, status=400)
+
+    msgs, has_more = message_page(conv, before)
+    return JsonResponse({
+        'messages': [{**msg.to_dict(), 'is_mine': msg.sender_id == request.user.id} for msg in msgs],
+        'older_cursor': encode_cursor(msgs[0]) if has_more else None,
     })
 
 
+@login_required
+def attachment(request, message_id):
+    """Redirect to the storage URL of a message attachment, resolved only when requested."""
+    msg = get_object_or_404(Message, id=message_id, conversation__participants=request.user)
+    if not msg.attachment:
+        raise Http404
+    return redirect(msg.attachment.url)
+
+
 @login_required
 def poll_messages(request, conv_id):
-    """Return messages newer than ?after=<message_id> as JSON."""
+    """Return messages newer than ?after=<message_id> as JSON.
+
+    Fallback for browsers that cannot keep conversation_stream open.
+    """
     conv = get_object_or_404(Conversation, id=conv_id)
     if request.user not in conv.participants.all():
         return JsonResponse({'error': 'denied'}, status=403)
 
-    after_id = int(request.GET.get('after', 0))
-    new_msgs = conv.messages.filter(id__gt=after_id).select_related('sender')
+    try:
+        after_id = int(request.GET.get('after', 0))
+    except ValueError:
+        return JsonResponse({'error': 'invalid after'}, status=400)
+    new_msgs = list(conv.messages.filter(id__gt=after_id))
     # Mark incoming as read
-    new_msgs.filter(is_read=False).exclude(sender=request.user).update(is_read=True)
-
-    data = []
-    for msg in new_msgs:
-        data.append({
-            'id': msg.id,
-            'body': msg.body,
-            'attachment_url': msg.attachment.url if msg.attachment else None,
-            'is_image': msg.is_image() if msg.attachment else False,
-            'created_at': msg.created_at.strftime('%b %d, %I:%M %p'),
-            'is_mine': msg.sender == request.user,
-        })
+    if any(msg.sender_id != request.user.id and not msg.is_read for msg in new_msgs):
+        mark_read(conv, request.user)
+
+    data = [{**msg.to_dict(), 'is_mine': msg.sender_id == request.user.id} for msg in new_msgs]
     return JsonResponse({'messages': data})
 
 
+async def conversation_stream(request, conv_id):
+    """Server-sent events with the conversation's new messages, typing pings and read receipts."""
+    from django.core.handlers.asgi import ASGIRequest
+    from .pubsub import conversation_events
+
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+    if not await Conversation.objects.filter(id=conv_id, participants=user).aexists():
+        return HttpResponse(status=403)
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI the page falls back to polling poll_messages
+        return HttpResponse(status=204)
+
+    try:
+        after_id = int(request.GET.get('after', 0))
+    except ValueError:
+        return HttpResponse(status=400)
+    response = StreamingHttpResponse(conversation_events(conv_id, after_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+@require_POST
+def typing(request, conv_id):
+    if not Conversation.objects.filter(id=conv_id, participants=request.user).exists():
+        return JsonResponse({'error': 'denied'}, status=403)
+    publish_typing(conv_id, request.user.id)
+    return JsonResponse({'ok': True})
+
+
+@login_required
+@require_POST
+def read_messages(request, conv_id):
+    """Mark messages up to ?up_to=<message_id> as read (sent by the stream client)."""
+    conv = get_object_or_404(Conversation, id=conv_id, participants=request.user)
+    try:
+        up_to = int(request.POST.get('up_to', 0))
+    except ValueError:
+        return JsonResponse({'error': 'invalid up_to'}, status=400)
+    mark_read(conv, request.user, up_to or None)
+    return JsonResponse({'ok': True})
+
+
 @login_required
 def new_message(request, recipient_id=None):
     allowed_roles = ALLOWED_RECIPIENTS.get(request.user.role, [])
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import PredictionLog, SentimentAnalysis
+from .models import PredictionLog, SentimentAnalysis, CachedResponse
 
 @admin.register(PredictionLog)
 class PredictionLogAdmin(admin.ModelAdmin):
@@ -9,5 +9,11 @@ class PredictionLogAdmin(admin.ModelAdmin):
 
 @admin.register(SentimentAnalysis)
 class SentimentAnalysisAdmin(admin.ModelAdmin):
-    list_display = ['wellness_checkin', 'sentiment', 'alert_level', 'confidence', 'analyzed_at']
-    list_filter = ['sentiment', 'alert_level', 'analyzed_at']
+    list_display = ['wellness_checkin', 'sentiment', 'alert_level', 'confidence', 'source', 'provisional', 'analyzed_at']
+    list_filter = ['sentiment', 'alert_level', 'source', 'provisional', 'analyzed_at']
+
+@admin.register(CachedResponse)
+class CachedResponseAdmin(admin.ModelAdmin):
+    list_display = ['task', 'version', 'created_at', 'expires_at']
+    list_filter = ['task', 'version']
+    readonly_fields = ['key', 'features', 'response']
@@ -1,49 +1,194 @@
 from google import genai
 from django.conf import settings
 from django.core.cache import cache
+from django.db import connection
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
-import hashlib
+import time
+
+from . import response_cache
+
+# Response tokens reserved per call before the real usage is known
+DEFAULT_OUTPUT_TOKENS = 300
+
+INTERVENTIONS = 'One-on-One Counseling, Group Counseling, Academic Tutoring, Peer Mentoring, Parent Meeting, Study Skills Workshop'
+
+
+class RateLimitExceeded(Exception):
+    """The API kept answering 429 after every retry"""
+
+
+class RateLimiter:
+    """Token buckets on requests and tokens per minute, shared through the cache.
+
+    Every process using the same cache (gunicorn workers, management
+    commands, the job worker) draws from the same buckets. The bucket state is
+    updated under a short cache.add() lock, which is atomic on both the
+    local-memory and Redis backends.
+    """
+
+    LOCK_TIMEOUT = 5
+
+    def __init__(self, name='gemini', rpm=None, tpm=None, clock=time.time, sleep=time.sleep):
+        self.key = f'ratelimit:{name}'
+        self.rpm = rpm or settings.GEMINI_RPM
+        self.tpm = tpm or settings.GEMINI_TPM
+        self.clock = clock
+        self.sleep = sleep
+
+    def _update(self, change):
+        """Run change(state, now) on the bucket state under the lock and return its result"""
+        lock_key = f'{self.key}:lock'
+        while not cache.add(lock_key, 1, self.LOCK_TIMEOUT):
+            self.sleep(0.005)
+        try:
+            now = self.clock()
+            state = cache.get(self.key) or {
+                'requests': self.rpm, 'tokens': self.tpm, 'updated': now, 'blocked_until': 0, 'backoff': 0,
+            }
+            # Refill both buckets for the time since the last update
+            elapsed = max(0, now - state['updated'])
+            state['requests'] = min(self.rpm, state['requests'] + elapsed * self.rpm / 60)
+            state['tokens'] = min(self.tpm, state['tokens'] + elapsed * self.tpm / 60)
+            state['updated'] = now
+            result = change(state, now)
+            cache.set(self.key, state, None)
+            return result
+        finally:
+            cache.delete(lock_key)
+
+    def try_acquire(self, tokens=1):
+        """Take one request and tokens from the buckets, or return the seconds to wait"""
+        tokens = min(tokens, self.tpm)
+
+        def take(state, now):
+            if state['blocked_until'] > now:
+                return state['blocked_until'] - now
+            if state['requests'] >= 1 and state['tokens'] >= tokens:
+                state['requests'] -= 1
+                state['tokens'] -= tokens
+                return 0
+            return max(
+                (1 - state['requests']) * 60 / self.rpm,
+                (tokens - state['tokens']) * 60 / self.tpm,
+            )
+        return self._update(take)
+
+    def acquire(self, tokens=1):
+        """Block until one request and tokens are available"""
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            self.sleep(wait)
+
+    def settle(self, reserved, used):
+        """Correct the token bucket once a call's real token usage is known"""
+        def correct(state, now):
+            state['tokens'] = min(self.tpm, state['tokens'] + reserved - used)
+        self._update(correct)
+
+    def throttled(self, base=1.0, maximum=60.0):
+        """The API answered 429: pause every caller, doubling the pause while it keeps happening"""
+        def back_off(state, now):
+            state['backoff'] = min(maximum, state['backoff'] * 2 if state['backoff'] else base)
+            state['blocked_until'] = max(state['blocked_until'], now + state['backoff'])
+            return state['backoff']
+        return self._update(back_off)
+
+    def succeeded(self):
+        def reset(state, now):
+            state['backoff'] = 0
+        self._update(reset)
+
+
+def is_rate_limit_error(error):
+    return getattr(error, 'code', None) == 429 or getattr(error, 'status_code', None) == 429
+
 
 class GeminiClient:
-    def __init__(self):
-        self.client = genai.Client(api_key=settings.GEMINI_API_KEY)
+    MODEL = 'gemini-2.5-flash'
+    MAX_RETRIES = 5
+
+    def __init__(self, limiter=None):
+        self._client = None
+        self.limiter = limiter or RateLimiter()
+
+    @property
+    def client(self):
+        """The SDK client, created on first use so building a GeminiClient needs no API key"""
+        if self._client is None:
+            self._client = genai.Client(api_key=settings.GEMINI_API_KEY)
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+
+    def _generate(self, prompt, **kwargs):
+        """generate_content behind the shared rate limiter, retrying 429s"""
+        reserved = self.estimate_tokens(prompt) + DEFAULT_OUTPUT_TOKENS
+        for attempt in range(self.MAX_RETRIES + 1):
+            self.limiter.acquire(reserved)
+            try:
+                response = self.client.models.generate_content(model=self.MODEL, contents=prompt, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                if attempt == self.MAX_RETRIES:
+                    raise RateLimitExceeded(str(e)) from e
+                self.limiter.throttled()
+                continue
+
+            self.limiter.succeeded()
+            usage = getattr(response, 'usage_metadata', None)
+            if usage is not None and getattr(usage, 'total_token_count', None):
+                self.limiter.settle(reserved, usage.total_token_count)
+            return response
+
+    def map_concurrent(self, func, items, max_workers=None):
+        """Yield (item, result, error) for func(item) over items as calls finish.
+
+        At most max_workers calls (default settings.GEMINI_MAX_CONCURRENCY) are
+        in flight; the rate limiter decides when each one may start.
+        """
+        def run(item):
+            try:
+                return func(item)
+            finally:
+                connection.close()  # The response cache may have opened one in this thread
+
+        with ThreadPoolExecutor(max_workers=max_workers or settings.GEMINI_MAX_CONCURRENCY) as pool:
+            futures = {pool.submit(run, item): item for item in items}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
     
-    def _get_cache_key(self, prompt):
-        """Generate cache key from prompt"""
-        return f"gemini_{hashlib.md5(prompt.encode()).hexdigest()}"
+    def _call(self, prompt):
+        """Call Gemini in JSON mode and return the parsed response"""
+        response = self._generate(prompt, config={'response_mime_type': 'application/json'})
+        return json.loads(response.text)
     
-    def _call_with_cache(self, prompt, cache_hours=24):
-        """Call Gemini with caching"""
-        cache_key = self._get_cache_key(prompt)
-        
-        # Check cache first
-        cached = cache.get(cache_key)
-        if cached:
-            return cached
-        
-        # Call API with JSON mode
-        response = self.client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt,
-            config={'response_mime_type': 'application/json'}
-        )
-        result = json.loads(response.text)
-        
-        # Cache result
-        cache.set(cache_key, result, cache_hours * 3600)
-        
+    def _call_with_cache(self, task, data, build_prompt):
+        """Call Gemini with build_prompt(features), cached on the task's canonical features"""
+        features = response_cache.canonical(task, data)
+        result = response_cache.get(task, features)
+        if result is None:
+            result = self._call(build_prompt(features))
+            response_cache.put(task, features, result)
         return result
     
-    def predict_risk(self, student_data):
-        """Predict student risk level"""
-        prompt = f"""Analyze this student's academic risk level.
+    def _risk_prompt(self, features):
+        return f"""Analyze this student's academic risk level.
 
 Student Data:
-- GPA: {student_data.get('gpa', 0)}
-- Attendance Rate: {student_data.get('attendance', 0)}%
-- Missing Assignments: {student_data.get('missing', 0)}
-- Stress Level: {student_data.get('stress', 0)}/5
-- Motivation Level: {student_data.get('motivation', 0)}/5
+- GPA: {features['gpa']}
+- Attendance Rate: {features['attendance']}%
+- Missing Assignments: {features['missing']}
+- Stress Level: {features['stress']}/5
+- Motivation Level: {features['motivation']}/5
 
 Return JSON only:
 {{
@@ -52,14 +197,112 @@ Return JSON only:
   "risk_factors": ["factor1", "factor2"],
   "recommendations": ["action1", "action2"]
 }}"""
-        
-        return self._call_with_cache(prompt, cache_hours=24)
-    
+
+    def predict_risk(self, student_data):
+        """Predict student risk level"""
+        return self._call_with_cache('risk', student_data, self._risk_prompt)
+
+    @staticmethod
+    def valid_risk_prediction(result):
+        """True if result has the shape predict_risk promises"""
+        try:
+            return (
+                result['risk_level'] in ('low', 'medium', 'high')
+                and 0 <= float(result['risk_probability']) <= 1
+                and isinstance(result.get('risk_factors', []), list)
+                and isinstance(result.get('recommendations', []), list)
+            )
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    def _call_batch(self, task, items, build_prompt, build_single_prompt, valid):
+        """Answer many items of a task in one call.
+
+        items maps a key to the task's input; build_prompt(batch) gets a list of
+        canonical features dicts each with an "id". Returns {key: result}.
+        Cached answers are reused, and any item missing or failing valid() in
+        the batch response is retried with build_single_prompt(features). Items
+        whose single call fails or fails valid() too are left out of the result.
+        """
+        keys = list(items)
+        features = [response_cache.canonical(task, items[key]) for key in keys]
+        results = {}
+        # Items in the same feature buckets share one answer, so each bucket is asked once
+        pending = {}
+        for key, item_features, cached in zip(keys, features, response_cache.get_many(task, features)):
+            if cached is not None:
+                results[key] = cached
+            else:
+                ref = response_cache.entry_key(task, item_features)[:12]
+                pending.setdefault(ref, ([], item_features))[0].append(key)
+
+        if pending:
+            batch = [{'id': ref, **item_features} for ref, (group, item_features) in pending.items()]
+            try:
+                answers = self._call(build_prompt(batch))
+            except (ValueError, KeyError):
+                answers = []  # Unparseable response, every item falls back below
+            if isinstance(answers, dict):
+                answers = answers.get('students') or answers.get('results') or []
+
+            answered = set()
+            for answer in answers if isinstance(answers, list) else []:
+                if not isinstance(answer, dict) or str(answer.get('id')) not in pending:
+                    continue
+                ref = str(answer.pop('id'))
+                if ref not in answered and valid(answer):
+                    answered.add(ref)
+                    response_cache.put(task, pending[ref][1], answer)
+                    results.update((key, answer) for key in pending[ref][0])
+
+            for ref, (group, item_features) in pending.items():
+                if ref not in answered:
+                    try:
+                        result = self._call(build_single_prompt(item_features))
+                    except Exception:
+                        continue  # Leave these keys out, the answers already in hand still count
+                    if not valid(result):
+                        continue  # Never cache or return a malformed answer
+                    response_cache.put(task, item_features, result)
+                    results.update((key, result) for key in group)
+        return results
+
+    def predict_risk_batch(self, students):
+        """Predict the risk level of many students in one call.
+
+        students maps a key (e.g. the student id) to the same feature dict
+        predict_risk takes. Returns {key: result}. Results already cached by
+        predict_risk are reused, and any item missing or malformed in the batch
+        response is retried with a single-student call; students whose retry
+        fails as well are left out.
+        """
+        return self._call_batch('risk', students, lambda batch: f"""Analyze the academic risk level of each of these students.
+
+Fields: gpa, attendance (%), missing (assignments), stress (1-5), motivation (1-5).
+Students:
+{json.dumps(batch)}
+
+Return a JSON array with exactly one object per student, in any order:
+[
+  {{
+    "id": "the student's id",
+    "risk_probability": 0.0-1.0,
+    "risk_level": "low|medium|high",
+    "risk_factors": ["factor1", "factor2"],
+    "recommendations": ["action1", "action2"]
+  }}
+]""", self._risk_prompt, self.valid_risk_prediction)
+
+    @staticmethod
+    def estimate_tokens(text):
+        """Rough token count (about 4 characters per token)"""
+        return len(text) // 4 + 1
+
     def analyze_sentiment(self, text):
         """Analyze sentiment of wellness check-in text"""
-        prompt = f"""Analyze this student's wellness response for emotional distress.
+        return self._call_with_cache('sentiment', text, lambda features: f"""Analyze this student's wellness response for emotional distress.
 
-Text: "{text}"
+Text: "{features['text']}"
 
 Return JSON only:
 {{
@@ -67,18 +310,15 @@ Return JSON only:
   "confidence": 0.0-1.0,
   "alert_level": "none|low|medium|high|critical",
   "concerning_phrases": ["phrase1"]
-}}"""
-        
-        return self._call_with_cache(prompt, cache_hours=168)  # 7 days
+}}""")
     
-    def recommend_intervention(self, student_profile):
-        """Recommend interventions for at-risk student"""
-        prompt = f"""Recommend top 2 interventions for this at-risk student.
+    def _intervention_prompt(self, features):
+        return f"""Recommend top 2 interventions for this at-risk student.
 
 Student Profile:
-{json.dumps(student_profile, indent=2)}
+{json.dumps(features, indent=2)}
 
-Available interventions: One-on-One Counseling, Group Counseling, Academic Tutoring, Peer Mentoring, Parent Meeting, Study Skills Workshop
+Available interventions: {INTERVENTIONS}
 
 Return JSON only:
 {{
@@ -90,18 +330,51 @@ Return JSON only:
     }}
   ]
 }}"""
-        
-        return self._call_with_cache(prompt, cache_hours=24)
+
+    def recommend_intervention(self, student_profile):
+        """Recommend interventions for at-risk student"""
+        return self._call_with_cache('intervention', student_profile, self._intervention_prompt)
+
+    @staticmethod
+    def valid_intervention_recommendation(result):
+        """True if result has the shape recommend_intervention promises"""
+        recommendations = result.get('recommendations')
+        return isinstance(recommendations, list) and bool(recommendations) and all(
+            isinstance(item, dict) and item.get('type') for item in recommendations
+        )
+
+    def recommend_intervention_batch(self, profiles):
+        """recommend_intervention for {key: profile} in one call, returning {key: result}"""
+        return self._call_batch('intervention', profiles, lambda batch: f"""Recommend top 2 interventions for each of these at-risk students.
+
+Students:
+{json.dumps(batch)}
+
+Available interventions: {INTERVENTIONS}
+
+Return a JSON array with exactly one object per student, in any order:
+[
+  {{
+    "id": "the student's id",
+    "recommendations": [
+      {{
+        "type": "intervention name",
+        "success_probability": 0.0-1.0,
+        "reasoning": "why this will work"
+      }}
+    ]
+  }}
+]""", self._intervention_prompt, self.valid_intervention_recommendation)
     
     def analyze_academic_pattern(self, student_data):
         """Analyze academic performance patterns"""
-        prompt = f"""Analyze this student's academic performance patterns.
+        return self._call_with_cache('academic_pattern', student_data, lambda features: f"""Analyze this student's academic performance patterns.
 
-Student Data:
-- Attendance Records: {student_data.get('attendance_records', [])}
-- Assignment Scores: {student_data.get('assignment_scores', [])}
-- Grade Trend: {student_data.get('grade_trend', 'stable')}
-- Recent Performance: {student_data.get('recent_performance', {})}
+Student Data (most recent first):
+- Attendance Records: {', '.join(features['attendance']) or 'none'}
+- Assignment Scores (%): {', '.join(str(score) for score in features['scores']) or 'none'}
+- Grade Trend: {features['grade_trend']}
+- Recent Performance: average score {features['avg_score']}%, attendance rate {features['attendance_rate']}%
 
 Return JSON only:
 {{
@@ -112,18 +385,66 @@ Return JSON only:
   "performance_pattern": "consistent|improving|declining|erratic",
   "risk_indicators": ["indicator1"],
   "recommendations": ["action1", "action2"]
-}}"""
-        
-        return self._call_with_cache(prompt, cache_hours=24)
+}}""")
     
     def generate_text(self, prompt):
         """Generate text response for general queries"""
         try:
             # Use gemini-2.5-flash without JSON mode for text generation
-            response = self.client.models.generate_content(
-                model='gemini-2.5-flash',
-                contents=prompt
-            )
+            response = self._generate(prompt)
             return response.text
         except Exception as e:
             return f"I apologize, but I encountered an error: {str(e)}. Please try again."
+
+    async def stream_text(self, prompt):
+        """Yield the text of a generate_text answer as Gemini produces it.
+
+        Closing or cancelling the generator (the browser went away) closes the
+        HTTP stream, so Gemini stops generating. 429s are retried until the
+        first chunk arrives; errors after that propagate.
+        """
+        from asgiref.sync import sync_to_async
+
+        def limiter(method):
+            return sync_to_async(getattr(self.limiter, method), thread_sensitive=False)
+
+        reserved = self.estimate_tokens(prompt) + DEFAULT_OUTPUT_TOKENS
+        for attempt in range(self.MAX_RETRIES + 1):
+            await limiter('acquire')(reserved)
+            stream = None
+            try:
+                stream = await self.client.aio.models.generate_content_stream(model=self.MODEL, contents=prompt)
+                chunk = await anext(stream, None)
+                break
+            except Exception as e:
+                if stream is not None:
+                    await stream.aclose()
+                if not is_rate_limit_error(e):
+                    raise
+                if attempt == self.MAX_RETRIES:
+                    raise RateLimitExceeded(str(e)) from e
+                await limiter('throttled')()
+
+        await limiter('succeeded')()
+        usage = None
+        try:
+            while chunk is not None:
+                usage = getattr(chunk, 'usage_metadata', None) or usage
+                if chunk.text:
+                    yield chunk.text
+                chunk = await anext(stream, None)
+        finally:
+            await stream.aclose()
+            if usage is not None and getattr(usage, 'total_token_count', None):
+                await limiter('settle')(reserved, usage.total_token_count)
+
+
+_shared = None
+
+
+def shared_client():
+    """One GeminiClient per process, so web requests reuse its HTTP connections"""
+    global _shared
+    if _shared is None:
+        _shared = GeminiClient()
+    return _shared
@@ -1,78 +1,179 @@
-from django.core.management.base import BaseCommand
-from wellness.models import WellnessCheckIn, Alert
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from accounts.notifications import alerts_raised
+from jobs.models import Checkpoint
 from ml_models.gemini_client import GeminiClient
 from ml_models.models import SentimentAnalysis
-import time
+from ml_models.sentiment_model import audited, classify_many
+from ml_models.utils import distress_alert, mark_screening_started
+from wellness.models import Alert, WellnessCheckIn
+
+DISTRESS = ['high', 'critical']
+
 
 class Command(BaseCommand):
     help = 'Analyze existing wellness check-ins with AI sentiment analysis'
-    
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=str, help='Only check-ins submitted on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--limit', type=int, help='Stop after this many check-ins')
+        parser.add_argument('--dry-run', action='store_true', help='Classify locally and report, without calling Gemini or saving anything')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Check-ins per chunk and per commit (default 200)')
+        parser.add_argument('--restart', action='store_true', help='Ignore the saved checkpoint and start from the first check-in')
+        parser.add_argument('--concurrency', type=int, default=None, help='Calls in flight at once (default GEMINI_MAX_CONCURRENCY)')
+
     def handle(self, *args, **options):
-        # Get check-ins with comments but no sentiment analysis
-        checkins = WellnessCheckIn.objects.filter(
-            comments__isnull=False
-        ).exclude(comments='')
-        
-        # Filter out those already analyzed
-        analyzed_ids = SentimentAnalysis.objects.values_list('wellness_checkin_id', flat=True)
-        checkins = checkins.exclude(id__in=analyzed_ids)
-        
-        self.stdout.write(f"Found {checkins.count()} check-ins to analyze...")
-        
-        if checkins.count() == 0:
-            self.stdout.write(self.style.SUCCESS("No check-ins to analyze!"))
-            return
-        
-        client = GeminiClient()
-        analyzed = 0
-        alerts_created = 0
-        
-        for i, checkin in enumerate(checkins):
-            # Rate limiting: 15 RPM = 1 request per 4 seconds
-            if i > 0 and i % 15 == 0:
-                self.stdout.write("Rate limit: waiting 60 seconds...")
-                time.sleep(60)
-            
+        since = None
+        if options['since']:
             try:
-                # Copy comments to text_response if empty
-                if not checkin.text_response:
-                    checkin.text_response = checkin.comments
-                    checkin.save()
-                
-                # Analyze sentiment
-                result = client.analyze_sentiment(checkin.comments)
-                
-                # Save analysis
-                SentimentAnalysis.objects.create(
-                    wellness_checkin=checkin,
-                    sentiment=result['sentiment'],
-                    confidence=result['confidence'],
-                    alert_level=result['alert_level'],
-                    concerning_phrases=result.get('concerning_phrases', [])
-                )
-                
-                analyzed += 1
-                
-                # Create alert if high distress
-                if result['alert_level'] in ['high', 'critical']:
-                    Alert.objects.create(
-                        student=checkin.student,
-                        alert_type='emotional_distress',
-                        severity='high',
-                        description=f"Emotional distress detected in wellness check-in"
-                    )
-                    alerts_created += 1
-                    self.stdout.write(self.style.WARNING(
-                        f"[!] {checkin.student.get_full_name()}: {result['alert_level']} distress - Alert created"
-                    ))
-                else:
-                    self.stdout.write(self.style.SUCCESS(
-                        f"[OK] {checkin.student.get_full_name()}: {result['sentiment']} ({result['alert_level']})"
-                    ))
-                
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f"[X] Error analyzing check-in {checkin.id}: {e}"))
-        
+                since = timezone.make_aware(datetime.strptime(options['since'], '%Y-%m-%d'))
+            except ValueError:
+                raise CommandError('--since must be a date like 2026-01-31')
+
+        # Check-ins with text and no final analysis (provisional local results still go to Gemini)
+        pending = WellnessCheckIn.objects.filter(
+            Q(text_response__gt='') | Q(comments__gt='')
+        ).exclude(
+            Exists(SentimentAnalysis.objects.filter(wellness_checkin=OuterRef('pk'), provisional=False))
+        ).select_related('student').order_by('id')
+        if since:
+            pending = pending.filter(date__gte=since)
+
+        checkpoint_name = f"analyze_existing_checkins:{options['since'] or 'all'}"
+        checkpoint = Checkpoint(name=checkpoint_name)
+        if not options['dry_run']:
+            checkpoint, _ = Checkpoint.objects.get_or_create(name=checkpoint_name)
+            if options['restart']:
+                checkpoint.position = 0
+                checkpoint.save()
+            elif checkpoint.position:
+                self.stdout.write(f"Resuming after check-in {checkpoint.position}")
+
+        client = GeminiClient()
+        totals = {'checkins': 0, 'local': 0, 'gemini': 0, 'alerts': 0, 'failed': 0}
+        position = checkpoint.position
+        limit = options['limit']
+
+        while limit is None or totals['checkins'] < limit:
+            size = options['chunk_size'] if limit is None else min(options['chunk_size'], limit - totals['checkins'])
+            # Walk primary-key ranges: the next chunk starts after the last id of this one
+            chunk = list(pending.filter(id__gt=position)[:size].iterator())
+            if not chunk:
+                if position and not options['dry_run']:
+                    # Drained: the next run starts over, so check-ins left provisional below the
+                    # checkpoint (a live escalation whose job gave up) are picked up again
+                    checkpoint.position = 0
+                    checkpoint.save(update_fields=['position', 'updated_at'])
+                break
+
+            failed = self.process(chunk, client, checkpoint, options, totals)
+            totals['checkins'] += len(chunk) - len(failed)
+            position = checkpoint.position if not options['dry_run'] else chunk[-1].id
+
+            self.stdout.write(
+                f"Check-ins up to {position}: {totals['checkins']} done "
+                f"({totals['local']} local, {totals['gemini']} Gemini, {totals['alerts']} alerts)"
+            )
+            if failed:
+                totals['failed'] = len(failed)
+                break
+
+        prefix = '[dry run] Would analyze' if options['dry_run'] else 'Analysis complete! Analyzed'
         self.stdout.write(self.style.SUCCESS(
-            f"\nAnalysis complete! Analyzed: {analyzed}, Alerts created: {alerts_created}"
+            f"\n{prefix}: {totals['checkins']} (settled locally: {totals['local']}, by Gemini: {totals['gemini']}), "
+            f"Alerts created: {totals['alerts']}, Failed: {totals['failed']}"
         ))
+        if totals['failed']:
+            # An error exit lets the job queue retry, which resumes from the checkpoint
+            raise CommandError(
+                f"{totals['failed']} Gemini calls failed, stopping. Run the command again to resume from check-in {position + 1}."
+            )
+
+    def process(self, chunk, client, checkpoint, options, totals):
+        """Analyze one chunk and save it with the checkpoint in one transaction; returns the failed check-ins"""
+        existing = dict(
+            SentimentAnalysis.objects.filter(wellness_checkin__in=chunk).values_list('wellness_checkin_id', 'alert_level')
+        )
+        for checkin in chunk:
+            if not checkin.text_response:
+                checkin.text_response = checkin.comments
+
+        # Screen new check-ins locally first; provisional ones already were
+        results = {}
+        audits = set()
+        escalated = [checkin for checkin in chunk if checkin.id in existing]
+        new = [checkin for checkin in chunk if checkin.id not in existing]
+        for checkin, result in zip(new, classify_many([checkin.text_response for checkin in new])):
+            if audited(result):
+                audits.add(checkin.id)
+            escalate = result['escalate'] or checkin.id in audits
+            results[checkin.id] = (result, 'local', escalate)
+            if escalate:
+                escalated.append(checkin)
+
+        failed = []
+        if options['dry_run']:
+            totals['local'] += len(chunk) - len(escalated)
+            totals['gemini'] += len(escalated)
+            return failed
+
+        # The shared rate limiter paces the calls; results are saved here in the main thread
+        for checkin, result, error in client.map_concurrent(
+            lambda checkin: client.analyze_sentiment(checkin.text_response), escalated, max_workers=options['concurrency']
+        ):
+            if error is not None:
+                failed.append(checkin)
+                self.stdout.write(self.style.ERROR(f"[X] Error analyzing check-in {checkin.id}: {error}"))
+            else:
+                results[checkin.id] = (result, 'gemini', False)
+
+        alerts = []
+        analyses = []
+        for checkin in chunk:
+            if checkin.id not in results:
+                continue
+            result, source, provisional = results[checkin.id]
+            analyses.append(SentimentAnalysis(
+                wellness_checkin=checkin,
+                sentiment=result['sentiment'],
+                confidence=result['confidence'],
+                alert_level=result['alert_level'],
+                concerning_phrases=result.get('concerning_phrases', []),
+                source=source,
+                provisional=provisional,
+                audit=checkin.id in audits,
+            ))
+            # One alert per check-in, even when Gemini confirms a local one
+            if result['alert_level'] in DISTRESS and existing.get(checkin.id) not in DISTRESS:
+                alerts.append(distress_alert(checkin))
+                existing[checkin.id] = result['alert_level']
+            if source == 'gemini':
+                totals['gemini'] += 1
+            elif not provisional:
+                totals['local'] += 1
+            if options['verbosity'] >= 2:
+                self.stdout.write(f"{checkin.student.get_full_name()}: {result['sentiment']} ({result['alert_level']}, {source})")
+
+        with transaction.atomic():
+            if new:
+                mark_screening_started()
+            WellnessCheckIn.objects.bulk_update([checkin for checkin in chunk if checkin.id in results], ['text_response'])
+            SentimentAnalysis.objects.bulk_create(
+                analyses,
+                update_conflicts=True,
+                unique_fields=['wellness_checkin'],
+                update_fields=['sentiment', 'confidence', 'alert_level', 'concerning_phrases', 'source', 'provisional'],
+            )
+            Alert.objects.bulk_create(alerts)
+            if alerts:
+                alerts_raised(len(alerts))
+            # A failed call is retried from the checkpoint on the next run
+            checkpoint.position = min(checkin.id for checkin in failed) - 1 if failed else chunk[-1].id
+            checkpoint.save(update_fields=['position', 'updated_at'])
+        totals['alerts'] += len(alerts)
+        return failed
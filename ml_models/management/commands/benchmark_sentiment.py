@@ -0,0 +1,96 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from ml_models.models import SentimentAnalysis
+from ml_models.sentiment_model import SENTIMENTS, SentimentModel, classify_many, load_latest
+from ml_models.utils import screening_started
+
+DISTRESS = ('high', 'critical')
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the local sentiment classifier against Gemini labels that sample all check-ins (the audit sample and '
+        'labels from before local screening), optionally retraining it'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--train', action='store_true', help='Train a new model on 80%% of the labels and measure it on the rest')
+        parser.add_argument('--dry-run', action='store_true', help='With --train, do not save the model')
+        parser.add_argument('--min-rows', type=int, default=50, help='Refuse to train on fewer labels (default 50)')
+        parser.add_argument('--threshold', type=float, default=None, help='Escalation threshold to measure at (default SENTIMENT_MODEL_CONFIDENCE)')
+
+    def handle(self, *args, **options):
+        # Since screening started Gemini mostly labels what the classifier escalated, the hard
+        # cases; measuring or training on those alone would skew both
+        gemini = SentimentAnalysis.objects.filter(source='gemini', provisional=False)
+        started = screening_started()
+        before_screening = Q(analyzed_at__lt=started) if started else Q(analyzed_at__isnull=False)
+        representative = Q(audit=True) | before_screening
+
+        labels, audited = [], 0
+        for text_response, comments, sentiment, alert_level, audit in gemini.filter(representative).values_list(
+            'wellness_checkin__text_response', 'wellness_checkin__comments', 'sentiment', 'alert_level', 'audit'
+        ):
+            if (text_response or comments) and sentiment in SENTIMENTS:
+                labels.append((text_response or comments, sentiment, alert_level))
+                audited += audit
+        if not labels:
+            raise CommandError('No Gemini sentiment labels from the audit sample or from before local screening to compare against')
+        self.stdout.write(
+            f"Population: {audited} audit-sampled labels and {len(labels) - audited} from before local screening "
+            f"(a sample of all check-ins); {gemini.exclude(representative).count()} labels of escalated check-ins left out"
+        )
+
+        model = load_latest()
+        if options['train']:
+            if len(labels) < options['min_rows']:
+                raise CommandError(f"Only {len(labels)} labels, need at least {options['min_rows']}")
+            order = np.random.default_rng(0).permutation(len(labels))
+            held_out = set(order[:len(labels) // 5].tolist())
+            train = [row for i, row in enumerate(labels) if i not in held_out]
+            labels = [row for i, row in enumerate(labels) if i in held_out]
+            model = SentimentModel.fit([text for text, _, _ in train], [sentiment for _, sentiment, _ in train])
+            self.stdout.write(f"Trained on {len(train)} labels, measuring on {len(labels)} held out")
+        elif model is None:
+            self.stdout.write('No sentiment model trained yet, measuring the lexicon alone')
+        else:
+            self.stdout.write(f"Measuring sentiment model v{model.version} on {len(labels)} labels")
+
+        results = classify_many([text for text, _, _ in labels], model=model, threshold=options['threshold'])
+        self.report(labels, results)
+
+        if options['train'] and not options['dry_run']:
+            path = model.save()
+            self.stdout.write(self.style.SUCCESS(f"Saved sentiment model v{model.version} to {path}"))
+
+    def precision_recall(self, predicted, actual):
+        true_positive = sum(1 for p, a in zip(predicted, actual) if p and a)
+        precision = true_positive / sum(predicted) if any(predicted) else 0
+        recall = true_positive / sum(actual) if any(actual) else 0
+        return precision, recall, sum(actual)
+
+    def report(self, labels, results):
+        self.stdout.write(f"\n{'label':<12}{'precision':>10}{'recall':>8}{'support':>9}")
+        for sentiment in SENTIMENTS:
+            precision, recall, support = self.precision_recall(
+                [result['sentiment'] == sentiment for result in results], [label == sentiment for _, label, _ in labels]
+            )
+            self.stdout.write(f"{sentiment:<12}{precision:>10.1%}{recall:>8.1%}{support:>9}")
+        precision, recall, support = self.precision_recall(
+            [result['alert_level'] in DISTRESS for result in results], [level in DISTRESS for _, _, level in labels]
+        )
+        self.stdout.write(f"{'distress':<12}{precision:>10.1%}{recall:>8.1%}{support:>9}")
+
+        settled = [(result, label) for result, (_, label, _) in zip(results, labels) if not result['escalate']]
+        missed = sum(
+            1 for result, (_, _, level) in zip(results, labels) if not result['escalate'] and level in DISTRESS
+        )
+        agreement = sum(1 for result, label in settled if result['sentiment'] == label) / len(settled) if settled else 0
+        self.stdout.write(
+            f"\nEscalated to Gemini: {len(labels) - len(settled)} of {len(labels)} ({1 - len(settled) / len(labels):.0%})"
+        )
+        self.stdout.write(f"Settled locally: {len(settled)}, agreeing with Gemini on {agreement:.1%}")
+        style = self.style.ERROR if missed else self.style.SUCCESS
+        self.stdout.write(style(f"Gemini high/critical distress settled locally without escalation: {missed}"))
@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ml_models import response_cache
+from ml_models.models import CachedResponse
+
+
+class Command(BaseCommand):
+    help = 'Show hit rates of the Gemini response cache, list its entries or purge them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--task', choices=sorted(response_cache.TASKS), help='Only this task')
+        parser.add_argument('--list', type=int, nargs='?', const=20, metavar='N', help='List the N newest stored entries (default 20)')
+        parser.add_argument('--purge', action='store_true', help='Delete stored entries (all of them unless --expired or --stale)')
+        parser.add_argument('--expired', action='store_true', help='With --purge, only entries past their expiry')
+        parser.add_argument('--stale', action='store_true', help='With --purge, only entries from an older prompt version')
+        parser.add_argument('--reset-stats', action='store_true', help='Zero the hit and miss counters')
+
+    def handle(self, *args, **options):
+        if (options['expired'] or options['stale']) and not options['purge']:
+            raise CommandError('--expired and --stale only apply with --purge')
+        if (options['purge'] or options['list']) and not response_cache.use_db():
+            raise CommandError(
+                f"GEMINI_CACHE_STORE is '{settings.GEMINI_CACHE_STORE}': entries live in the cache backend only "
+                "and cannot be listed or purged one by one. Bump the task's version in "
+                "ml_models/response_cache.py TASKS to retire them."
+            )
+
+        if options['purge']:
+            count = response_cache.purge(options['task'], expired=options['expired'], stale=options['stale'])
+            self.stdout.write(self.style.SUCCESS(f'Purged {count} entries'))
+            return
+
+        if options['reset_stats']:
+            response_cache.reset_stats()
+            self.stdout.write(self.style.SUCCESS('Hit and miss counters reset'))
+            return
+
+        if options['list']:
+            entries = CachedResponse.objects.all()
+            if options['task']:
+                entries = entries.filter(task=options['task'])
+            now = timezone.now()
+            for entry in entries[:options['list']]:
+                state = 'expired' if entry.expires_at <= now else f"expires {entry.expires_at:%Y-%m-%d %H:%M}"
+                self.stdout.write(f"{entry.key[:12]}  {entry.task} v{entry.version}  {state}")
+                self.stdout.write(f"    features: {entry.features}")
+                self.stdout.write(f"    response: {entry.response}")
+            return
+
+        self.stdout.write(f"{'task':<18}{'version':>8}{'hits':>8}{'misses':>8}{'hit rate':>10}{'entries':>9}{'expired':>9}{'stale':>7}")
+        for task, data in response_cache.stats().items():
+            if options['task'] and task != options['task']:
+                continue
+            lookups = data['hits'] + data['misses']
+            rate = f"{data['hits'] / lookups:.0%}" if lookups else '-'
+            self.stdout.write(
+                f"{task:<18}{response_cache.TASKS[task][0]:>8}{data['hits']:>8}{data['misses']:>8}{rate:>10}"
+                f"{data['entries']:>9}{data['expired']:>9}{data['stale']:>7}"
+            )
+        if settings.CACHES['default']['BACKEND'].endswith('LocMemCache'):
+            self.stdout.write('Hit and miss counters are per process without REDIS_URL; these are only this command\'s.')
@@ -2,52 +2,88 @@ from django.core.management.base import BaseCommand
 from accounts.models import User
 from ml_models.gemini_client import GeminiClient
 from ml_models.models import PredictionLog
-from ml_models.utils import get_student_data_for_prediction
-import time
+from ml_models.risk_model import settle
+from ml_models.utils import get_prediction_features
+import json
+
+# Prompt instructions sent once per batch, and response tokens per student
+BATCH_OVERHEAD_TOKENS = 200
+OUTPUT_TOKENS_PER_STUDENT = 120
 
 
 class Command(BaseCommand):
     help = 'Run daily AI risk predictions for all students'
-    
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-tokens', type=int, default=8000, help='Token budget (prompt + response) per batched call (default 8000)')
+        parser.add_argument('--confidence', type=float, default=None, help='Settle students locally when the local model is at least this sure (default RISK_MODEL_CONFIDENCE)')
+        parser.add_argument('--concurrency', type=int, default=None, help='Batched calls in flight at once (default GEMINI_MAX_CONCURRENCY)')
+
+    def batches(self, features, token_budget):
+        """Split {student_id: features} into batches that fit token_budget"""
+        batch, used = {}, BATCH_OVERHEAD_TOKENS
+        for student_id, data in features.items():
+            cost = GeminiClient.estimate_tokens(json.dumps(data)) + OUTPUT_TOKENS_PER_STUDENT
+            if batch and used + cost > token_budget:
+                yield batch
+                batch, used = {}, BATCH_OVERHEAD_TOKENS
+            batch[student_id] = data
+            used += cost
+        if batch:
+            yield batch
+
     def handle(self, *args, **options):
         client = GeminiClient()
-        students = User.objects.filter(role='student', is_active=True)
-        
-        self.stdout.write(f"Starting AI predictions for {students.count()} students...")
-        
+        queryset = User.objects.filter(role='student', is_active=True)
+        students = {student.id: student for student in queryset}
+
+        self.stdout.write(f"Starting AI predictions for {len(students)} students...")
+
+        features = {student_id: row for student_id, row in get_prediction_features(queryset).items() if student_id in students}
+
+        # Confident cases are settled by the local model, only the uncertain band goes to Gemini
+        settled, uncertain = settle(features, options['confidence'])
+        self.save(students, features, settled)
+        batches = list(self.batches(uncertain, options['batch_tokens']))
+        avoided = len(list(self.batches(features, options['batch_tokens']))) - len(batches)
+        self.stdout.write(
+            f"Settled {len(settled)} students locally, sending {len(uncertain)} to Gemini in {len(batches)} batched requests "
+            f"({avoided} requests avoided)..."
+        )
+
         success_count = 0
         error_count = 0
-        
-        for i, student in enumerate(students):
-            # Rate limiting: 15 requests per minute
-            if i > 0 and i % 15 == 0:
-                self.stdout.write("Rate limit: Waiting 60 seconds...")
-                time.sleep(60)
-            
-            try:
-                # Get student data
-                data = get_student_data_for_prediction(student)
-                
-                # Predict risk (cached for 24h)
-                result = client.predict_risk(data)
-                
-                # Save prediction
-                PredictionLog.objects.create(
-                    student=student,
-                    prediction_type='risk',
-                    prediction_value=result,
-                    confidence=result.get('confidence', 0.8)
-                )
-                
-                # Update student risk level
-                student.risk_level = result['risk_level']
-                student.save(update_fields=['risk_level'])
-                
-                success_count += 1
-                self.stdout.write(f"[{i+1}/{students.count()}] {student.username}: {result['risk_level'].upper()}")
-                
-            except Exception as e:
-                error_count += 1
-                self.stdout.write(self.style.ERROR(f"[{i+1}/{students.count()}] {student.username}: ERROR - {e}"))
-        
-        self.stdout.write(self.style.SUCCESS(f"\nComplete! Success: {success_count}, Errors: {error_count}"))
+
+        # The shared rate limiter paces the calls; results are saved here in the main thread
+        done = client.map_concurrent(client.predict_risk_batch, batches, max_workers=options['concurrency'])
+        for i, (batch, results, error) in enumerate(done):
+            if error is not None:
+                error_count += len(batch)
+                self.stdout.write(self.style.ERROR(f"[{i+1}/{len(batches)}] batch of {len(batch)}: ERROR - {error}"))
+                continue
+
+            self.save(students, features, results)
+
+            success_count += len(results)
+            # Students whose single-student retry failed are left out of results
+            error_count += len(batch) - len(results)
+            if options['verbosity'] >= 2:
+                for student_id, result in results.items():
+                    self.stdout.write(f"{students[student_id].username}: {result['risk_level'].upper()}")
+            self.stdout.write(f"[{i+1}/{len(batches)}] {len(results)} students predicted")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"\nComplete! Local: {len(settled)}, Gemini: {success_count}, Errors: {error_count}, Requests avoided: {avoided}"
+        ))
+
+    def save(self, students, features, results):
+        """Log results along with the features they were made from (train_risk_model learns from them)"""
+        PredictionLog.objects.bulk_create([
+            PredictionLog(
+                student=students[student_id],
+                prediction_type='risk',
+                prediction_value={'source': 'gemini', **result, 'features': features[student_id]},
+                confidence=result.get('confidence', 0.8)
+            )
+            for student_id, result in results.items()
+        ])
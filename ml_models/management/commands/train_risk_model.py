@@ -0,0 +1,114 @@
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from academics.models import Attendance
+from ml_models.models import PredictionLog
+from ml_models.risk_model import CLASSES, RiskModel, feature_matrix, load_latest
+from wellness.models import RiskAssessment
+
+
+class Command(BaseCommand):
+    help = 'Train the local risk model on past Gemini predictions and risk assessments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-rows', type=int, default=50, help='Refuse to train on fewer rows (default 50)')
+        parser.add_argument('--no-assessments', action='store_true', help='Only learn from Gemini predictions, not rule-engine assessments')
+        parser.add_argument('--confidence', type=float, default=None, help='Threshold to report coverage at (default RISK_MODEL_CONFIDENCE)')
+        parser.add_argument('--dry-run', action='store_true', help='Train and report but do not save the model')
+        parser.add_argument('--report', action='store_true', help='Only report how many predictions were settled locally')
+        parser.add_argument('--days', type=int, default=30, help='Window of the --report (default 30)')
+
+    def training_rows(self, include_assessments):
+        """(feature dicts, risk levels) from every usable historical row"""
+        rows, labels = [], []
+        # Gemini predictions that stored their inputs; never learn from the model's own answers
+        for value in PredictionLog.objects.filter(
+            prediction_type='risk', prediction_value__has_key='features'
+        ).exclude(prediction_value__source='local').values_list('prediction_value', flat=True).iterator():
+            if value.get('risk_level') in CLASSES:
+                rows.append(value['features'])
+                labels.append(value['risk_level'])
+
+        if include_assessments:
+            # Attendance over the 30 days up to each assessment, the window get_prediction_features uses
+            # (attendance_rate on the assessment covers the student's whole history)
+            window = Attendance.objects.filter(
+                student=OuterRef('student'), date__lte=OuterRef('date'), date__gt=OuterRef('date') - timedelta(days=30)
+            ).order_by().values('student')
+            assessments = RiskAssessment.objects.annotate(
+                total=Subquery(window.annotate(n=Count('id')).values('n')),
+                present=Subquery(window.filter(status='present').annotate(n=Count('id')).values('n')),
+            )
+            # Assessments do not record wellness levels, so they get the neutral midpoint
+            for gpa, total, present, missing, level in assessments.values_list(
+                'gpa', 'total', 'present', 'missing_assignments', 'risk_level'
+            ).iterator():
+                rows.append({
+                    'gpa': 0 if gpa is None else gpa, 'attendance': round((present or 0) / total * 100, 1) if total else 100,
+                    'missing': missing, 'stress': 3, 'motivation': 3,
+                })
+                labels.append(level)
+        return rows, labels
+
+    def handle(self, *args, **options):
+        if options['report']:
+            return self.report(options['days'])
+
+        rows, labels = self.training_rows(not options['no_assessments'])
+        if len(rows) < options['min_rows']:
+            raise CommandError(f"Only {len(rows)} training rows, need at least {options['min_rows']}")
+        if len(set(labels)) < 2:
+            raise CommandError('Training rows only cover one risk level')
+
+        X = feature_matrix(rows)
+        y = np.array(labels)
+        # Hold out a fixed fifth of the rows to measure the model
+        order = np.random.default_rng(0).permutation(len(rows))
+        test, train = order[:len(rows) // 5], order[len(rows) // 5:]
+        model = RiskModel.fit(X[train], y[train])
+
+        threshold = settings.RISK_MODEL_CONFIDENCE if options['confidence'] is None else options['confidence']
+        predicted, confidence = model.predict(X[test])
+        correct = np.array(predicted) == y[test]
+        confident = confidence >= threshold
+        model.metrics = {
+            'rows': len(rows),
+            'accuracy': round(float(correct.mean()), 3),
+            'coverage': round(float(confident.mean()), 3),
+            'confident_accuracy': round(float(correct[confident].mean()), 3) if confident.any() else None,
+            'threshold': threshold,
+        }
+
+        self.stdout.write(f"Trained on {len(train)} rows, tested on {len(test)}")
+        self.stdout.write(f"Accuracy: {model.metrics['accuracy']:.1%}")
+        self.stdout.write(
+            f"At confidence {threshold}: {model.metrics['coverage']:.1%} of students settled locally"
+            + (f", {model.metrics['confident_accuracy']:.1%} of them correctly" if confident.any() else '')
+        )
+        if options['dry_run']:
+            return
+        path = model.save()
+        self.stdout.write(self.style.SUCCESS(f"Saved risk model v{model.version} to {path}"))
+
+    def report(self, days):
+        since = timezone.now() - timedelta(days=days)
+        counts = PredictionLog.objects.filter(prediction_type='risk', created_at__gte=since).aggregate(
+            local=Count('id', filter=Q(prediction_value__source='local')),
+            total=Count('id'),
+        )
+        model = load_latest()
+        if model is None:
+            self.stdout.write('No risk model trained yet, every prediction goes to Gemini')
+        else:
+            self.stdout.write(f"Risk model v{model.version} trained {model.trained_at}: {model.metrics}")
+        remote = counts['total'] - counts['local']
+        share = counts['local'] / counts['total'] if counts['total'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Last {days} days: {counts['local']} of {counts['total']} risk predictions settled locally ({share:.0%}), "
+            f"{remote} answered by Gemini"
+        ))
@@ -0,0 +1,23 @@
+# Generated by Django 5.0 on 2026-10-18 06:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ml_models', '0002_cachedresponse'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sentimentanalysis',
+            name='provisional',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='sentimentanalysis',
+            name='source',
+            field=models.CharField(choices=[('local', 'Local classifier'), ('gemini', 'Gemini')], default='gemini', max_length=10),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ml_models', '0003_sentimentanalysis_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sentimentanalysis',
+            name='audit',
+            field=models.BooleanField(default=False),
+        ),
+    ]
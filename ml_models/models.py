@@ -24,7 +24,34 @@ class SentimentAnalysis(models.Model):
     confidence = models.FloatField()
     alert_level = models.CharField(max_length=20)
     concerning_phrases = models.JSONField(default=list)
+    SOURCE_CHOICES = [
+        ('local', 'Local classifier'),
+        ('gemini', 'Gemini'),
+    ]
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, default='gemini')
+    # Local result waiting for Gemini to confirm it
+    provisional = models.BooleanField(default=False)
+    # A confident local result sent to Gemini anyway, so its label is a random sample of all check-ins
+    audit = models.BooleanField(default=False)
     analyzed_at = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
         return f"{self.wellness_checkin.student.username} - {self.sentiment}"
+
+
+class CachedResponse(models.Model):
+    """A Gemini response stored by ml_models.response_cache so it survives restarts"""
+    key = models.CharField(max_length=64, unique=True)
+    task = models.CharField(max_length=30)
+    version = models.IntegerField()
+    features = models.JSONField()
+    response = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['task', 'version'])]
+
+    def __str__(self):
+        return f"{self.task} v{self.version} - {self.key[:12]}"
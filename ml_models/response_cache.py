@@ -0,0 +1,199 @@
+"""Cache of Gemini responses keyed on what the prompt is about, not its text.
+
+Each task (risk, sentiment, intervention, academic pattern) reduces its input
+to a canonical feature dict: numbers are rounded to buckets the model cannot
+tell apart (attendance to 5%, stress to half a point, ...), lists are sorted
+and text is normalised. The prompt is then built from those features, so two
+students in the same buckets share one answer and the answer matches exactly
+what was asked.
+
+The key also holds the task's version: bump it in TASKS whenever its prompt
+template changes so old answers stop matching (purge them with
+`manage.py gemini_cache --purge --stale`).
+
+Entries sit in the Django cache, and with GEMINI_CACHE_STORE = 'db' (the
+default) also in the CachedResponse table so they survive restarts and cache
+evictions. Hit and miss counters are kept per task in the Django cache.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+ENTRY_KEY = 'gemini:{}'
+STATS_KEY = 'gemini_cache:stats:{}:{}'
+
+
+def quantize(value, step):
+    """Round value to the nearest multiple of step"""
+    return round(float(round(float(value or 0) / step) * step), 2)
+
+
+def canonical_risk(data):
+    return {
+        'gpa': quantize(data.get('gpa', 0), 0.1),
+        'attendance': quantize(data.get('attendance', 0), 5),
+        'missing': min(int(data.get('missing', 0)), 10),
+        'stress': quantize(data.get('stress', 0), 0.5),
+        'motivation': quantize(data.get('motivation', 0), 0.5),
+    }
+
+
+def canonical_sentiment(text):
+    return {'text': ' '.join(text.lower().split())}
+
+
+def canonical_intervention(profile):
+    issues = profile.get('issues', '')
+    if isinstance(issues, str):
+        issues = issues.split(',')
+    return {
+        'risk_level': profile.get('risk_level', 'medium'),
+        'issues': sorted({issue.strip() for issue in issues if issue.strip()}),
+        'year_level': int(profile.get('year_level') or 9),
+    }
+
+
+def canonical_academic_pattern(data):
+    recent = data.get('recent_performance', {})
+    return {
+        'attendance': [record['status'] for record in data.get('attendance_records', [])],
+        'scores': [quantize(score['percentage'], 5) for score in data.get('assignment_scores', [])],
+        'grade_trend': data.get('grade_trend', 'stable'),
+        'avg_score': quantize(recent.get('avg_score', 0), 5),
+        'attendance_rate': quantize(recent.get('attendance_rate', 0), 5),
+    }
+
+
+# task: (version, hours an answer is kept, canonicaliser)
+TASKS = {
+    'risk': (1, 24, canonical_risk),
+    'sentiment': (1, 7 * 24, canonical_sentiment),
+    'intervention': (1, 24, canonical_intervention),
+    'academic_pattern': (1, 24, canonical_academic_pattern),
+}
+
+
+def canonical(task, data):
+    return TASKS[task][2](data)
+
+
+def entry_key(task, features):
+    version = TASKS[task][0]
+    return hashlib.sha256(json.dumps([task, version, features], sort_keys=True).encode()).hexdigest()
+
+
+def use_db():
+    return settings.GEMINI_CACHE_STORE == 'db'
+
+
+def _count(task, outcome, amount):
+    if amount:
+        key = STATS_KEY.format(task, outcome)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            cache.set(key, amount, None)  # Evicted between add and incr
+
+
+def get_many(task, features_list):
+    """Cached responses for each features dict in features_list, None where missing"""
+    from .models import CachedResponse
+
+    keys = [entry_key(task, features) for features in features_list]
+    found = cache.get_many([ENTRY_KEY.format(key) for key in keys])
+    results = {key: found[ENTRY_KEY.format(key)] for key in keys if ENTRY_KEY.format(key) in found}
+
+    missing = set(keys) - set(results)
+    if missing and use_db():
+        now = timezone.now()
+        refill = {}
+        for key, response, expires_at in CachedResponse.objects.filter(
+            key__in=missing, expires_at__gt=now
+        ).values_list('key', 'response', 'expires_at'):
+            results[key] = response
+            refill[key] = (response, int((expires_at - now).total_seconds()))
+        for key, (response, timeout) in refill.items():
+            cache.set(ENTRY_KEY.format(key), response, timeout)
+
+    hits = sum(1 for key in keys if key in results)
+    _count(task, 'hits', hits)
+    _count(task, 'misses', len(keys) - hits)
+    return [results.get(key) for key in keys]
+
+
+def get(task, features):
+    return get_many(task, [features])[0]
+
+
+def put(task, features, response):
+    from .models import CachedResponse
+
+    version, hours, _ = TASKS[task]
+    key = entry_key(task, features)
+    cache.set(ENTRY_KEY.format(key), response, hours * 3600)
+    if use_db():
+        CachedResponse.objects.update_or_create(key=key, defaults={
+            'task': task, 'version': version, 'features': features, 'response': response,
+            'expires_at': timezone.now() + timedelta(hours=hours),
+        })
+
+
+def stats():
+    """{task: {'hits', 'misses', 'entries', 'stale', 'expired'}}, stored counts only with the DB store"""
+    from .models import CachedResponse
+
+    counters = cache.get_many([STATS_KEY.format(task, outcome) for task in TASKS for outcome in ('hits', 'misses')])
+    data = {
+        task: {
+            'hits': counters.get(STATS_KEY.format(task, 'hits'), 0),
+            'misses': counters.get(STATS_KEY.format(task, 'misses'), 0),
+            'entries': 0, 'stale': 0, 'expired': 0,
+        }
+        for task in TASKS
+    }
+    if use_db():
+        now = timezone.now()
+        for row in CachedResponse.objects.values('task', 'version').annotate(
+            total=Count('id'), expired=Count('id', filter=Q(expires_at__lte=now))
+        ):
+            if row['task'] not in data:
+                continue
+            if row['version'] == TASKS[row['task']][0]:
+                data[row['task']]['entries'] += row['total'] - row['expired']
+                data[row['task']]['expired'] += row['expired']
+            else:
+                data[row['task']]['stale'] += row['total']
+    return data
+
+
+def reset_stats():
+    cache.delete_many([STATS_KEY.format(task, outcome) for task in TASKS for outcome in ('hits', 'misses')])
+
+
+def purge(task=None, expired=False, stale=False):
+    """Delete stored entries (all, or only expired / old-version ones) and return how many went"""
+    from .models import CachedResponse
+
+    entries = CachedResponse.objects.all()
+    if task:
+        entries = entries.filter(task=task)
+    if expired or stale:
+        condition = Q()
+        if expired:
+            condition |= Q(expires_at__lte=timezone.now())
+        if stale:
+            for name, (version, _, _) in TASKS.items():
+                if not task or name == task:
+                    condition |= Q(task=name) & ~Q(version=version)
+        entries = entries.filter(condition)
+
+    keys = list(entries.values_list('key', flat=True))
+    cache.delete_many([ENTRY_KEY.format(key) for key in keys])
+    entries.delete()
+    return len(keys)
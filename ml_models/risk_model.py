@@ -0,0 +1,164 @@
+"""Local risk scorer used before asking Gemini.
+
+A multinomial logistic regression over the same five features predict_risk
+sends to Gemini, trained by `manage.py train_risk_model` on earlier Gemini
+predictions (PredictionLog rows that stored their inputs) and on the rule
+engine's RiskAssessment rows. Scoring a whole cohort is one matrix product.
+
+Predictions the model is confident about (top class probability of at least
+settings.RISK_MODEL_CONFIDENCE) are settled locally, the uncertain band still
+goes to Gemini. Trained models are saved as risk_model_v<N>.npz in
+settings.ML_ARTIFACTS_DIR and the highest version is loaded.
+"""
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+FEATURES = ['gpa', 'attendance', 'missing', 'stress', 'motivation']
+CLASSES = ['low', 'medium', 'high']
+ARTIFACT_NAME = 'risk_model_v{}.npz'
+
+
+def feature_matrix(rows):
+    """Stack feature dicts (as built by get_student_data_for_prediction) into an array"""
+    return np.array([[float(row.get(name) or 0) for name in FEATURES] for row in rows], dtype=float).reshape(-1, len(FEATURES))
+
+
+def softmax(z):
+    z = z - z.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+class RiskModel:
+    def __init__(self, weights, bias, mean, scale, version=0, trained_at='', metrics=None):
+        self.weights = weights
+        self.bias = bias
+        self.mean = mean
+        self.scale = scale
+        self.version = version
+        self.trained_at = trained_at
+        self.metrics = metrics or {}
+
+    @classmethod
+    def fit(cls, X, labels, iterations=2000, learning_rate=0.5, l2=1e-3):
+        """Fit by full-batch gradient descent; labels are risk level names"""
+        y = np.array([CLASSES.index(label) for label in labels])
+        mean = X.mean(axis=0)
+        scale = X.std(axis=0)
+        scale[scale == 0] = 1
+        Xs = (X - mean) / scale
+        target = np.eye(len(CLASSES))[y]
+
+        weights = np.zeros((X.shape[1], len(CLASSES)))
+        bias = np.zeros(len(CLASSES))
+        for _ in range(iterations):
+            error = softmax(Xs @ weights + bias) - target
+            weights -= learning_rate * (Xs.T @ error / len(y) + l2 * weights)
+            bias -= learning_rate * error.mean(axis=0)
+        return cls(weights, bias, mean, scale)
+
+    def predict_proba(self, X):
+        return softmax(((X - self.mean) / self.scale) @ self.weights + self.bias)
+
+    def predict(self, X):
+        """(risk levels, confidences) for every row of X"""
+        proba = self.predict_proba(X)
+        return [CLASSES[i] for i in proba.argmax(axis=1)], proba.max(axis=1)
+
+    def save(self, directory=None):
+        directory = Path(directory or settings.ML_ARTIFACTS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.version = latest_version(directory) + 1
+        self.trained_at = timezone.now().isoformat()
+        path = directory / ARTIFACT_NAME.format(self.version)
+        np.savez(
+            path, weights=self.weights, bias=self.bias, mean=self.mean, scale=self.scale,
+            features=np.array(FEATURES), classes=np.array(CLASSES), version=self.version,
+            trained_at=self.trained_at, metrics=json.dumps(self.metrics),
+        )
+        return path
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        if list(data['features']) != FEATURES or list(data['classes']) != CLASSES:
+            raise ValueError(f'{path} was trained on different features or classes')
+        return cls(
+            data['weights'], data['bias'], data['mean'], data['scale'], version=int(data['version']),
+            trained_at=str(data['trained_at']), metrics=json.loads(str(data['metrics'])),
+        )
+
+
+def latest_version(directory=None):
+    directory = Path(directory or settings.ML_ARTIFACTS_DIR)
+    versions = [
+        int(match.group(1))
+        for match in (re.fullmatch(r'risk_model_v(\d+)\.npz', path.name) for path in directory.glob('risk_model_v*.npz'))
+        if match
+    ]
+    return max(versions, default=0)
+
+
+_loaded = {}
+
+
+def load_latest():
+    """The newest saved model, or None if none has been trained yet"""
+    version = latest_version()
+    if not version:
+        return None
+    if version not in _loaded:
+        _loaded.clear()
+        _loaded[version] = RiskModel.load(Path(settings.ML_ARTIFACTS_DIR) / ARTIFACT_NAME.format(version))
+    return _loaded[version]
+
+
+def local_result(features, proba, version):
+    """A prediction shaped like predict_risk's Gemini answer from one row of class probabilities"""
+    risk_level = CLASSES[int(proba.argmax())]
+    factors = []
+    recommendations = []
+    if features.get('attendance', 100) < 80:
+        factors.append('Low attendance')
+        recommendations.append('Follow up on absences')
+    if features.get('missing', 0) >= 3:
+        factors.append(f"{features['missing']} missing assignments")
+        recommendations.append('Set a plan to catch up on missing work')
+    if features.get('stress', 0) >= 4:
+        factors.append('High stress')
+        recommendations.append('Offer a counseling check-in')
+    if features.get('motivation', 5) <= 2:
+        factors.append('Low motivation')
+        recommendations.append('Discuss goals with the student')
+    return {
+        'risk_probability': round(float(proba[1] * 0.5 + proba[2]), 3),
+        'risk_level': risk_level,
+        'risk_factors': factors,
+        'recommendations': recommendations or ['Keep up the regular check-ins'],
+        'confidence': round(float(proba.max()), 3),
+        'source': 'local',
+        'model_version': version,
+    }
+
+
+def settle(students, threshold=None):
+    """Split {key: features} into ({key: local result}, {key: features} still for Gemini)"""
+    model = load_latest()
+    if model is None or not students:
+        return {}, dict(students)
+
+    threshold = settings.RISK_MODEL_CONFIDENCE if threshold is None else threshold
+    keys = list(students)
+    proba = model.predict_proba(feature_matrix([students[key] for key in keys]))
+    settled, uncertain = {}, {}
+    for key, row in zip(keys, proba):
+        if row.max() >= threshold:
+            settled[key] = local_result(students[key], row, model.version)
+        else:
+            uncertain[key] = students[key]
+    return settled, uncertain
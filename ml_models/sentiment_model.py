@@ -0,0 +1,206 @@
+"""Local pre-screen of wellness check-in text before Gemini sees it.
+
+A distress lexicon sets the alert level and the concerning phrases. Sentiment
+comes from a linear model over hashed word and word-pair counts plus the
+lexicon scores, trained by `manage.py benchmark_sentiment --train` on the
+Gemini labels already stored in SentimentAnalysis. Until a model is trained,
+the lexicon's positive/negative counts decide.
+
+classify() returns a result shaped like GeminiClient.analyze_sentiment plus an
+`escalate` flag: text with high or critical distress, or whose sentiment the
+model is not sure of, still goes to Gemini. Labels of escalated text alone
+would only cover the hard cases, so audited() also sends a random share of the
+confident results to Gemini.
+"""
+import random
+import re
+import zlib
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .risk_model import softmax
+
+SENTIMENTS = ['positive', 'neutral', 'negative']
+ALERT_LEVELS = ['none', 'low', 'medium', 'high', 'critical']
+ARTIFACT_NAME = 'sentiment_model_v{}.npz'
+HASH_BUCKETS = 2 ** 12
+
+DISTRESS_PHRASES = {
+    'critical': [
+        'kill myself', 'killing myself', 'suicide', 'suicidal', 'end my life', 'end it all', 'hurt myself',
+        'hurting myself', 'harm myself', 'self harm', 'want to die', 'better off dead', 'no reason to live',
+        "don't want to live", "don't want to be here", "don't want to continue",
+    ],
+    'high': [
+        'hopeless', 'worthless', "can't take", "can't handle", "can't cope", 'breaking down', 'falling apart',
+        'unbearable', 'give up', 'giving up', 'drowning', 'nobody cares', 'no one cares', 'depressed',
+        'panic attack', 'need help', 'meaningless', 'a failure',
+    ],
+    'medium': [
+        'overwhelmed', 'anxious', 'anxiety', 'exhausted', "can't sleep", 'alone', 'lonely', 'crying', 'scared',
+    ],
+}
+NEGATIVE_WORDS = {
+    'stressed', 'stress', 'tired', 'sad', 'bad', 'worried', 'worry', 'behind', 'hard', 'difficult', 'angry',
+    'upset', 'frustrated', 'sick', 'struggling', 'terrible', 'awful', 'bored', 'nervous', 'pressure',
+}
+POSITIVE_WORDS = {
+    'good', 'great', 'fine', 'ok', 'okay', 'happy', 'excited', 'better', 'well', 'awesome', 'calm', 'relaxed',
+    'love', 'enjoy', 'enjoying', 'fun', 'proud', 'motivated', 'confident', 'grateful', 'nice',
+}
+NEGATIONS = {'not', 'no', 'never', "don't", "isn't", "wasn't", "can't", 'hardly'}
+
+
+def tokenize(text):
+    return re.findall(r"[a-z']+", text.lower().replace('’', "'"))
+
+
+def lexicon(text):
+    """(alert level, concerning phrases, positive count, negative count)"""
+    normalized = ' '.join(tokenize(text))
+    level, phrases = 'none', []
+    for name in ('critical', 'high', 'medium'):
+        found = [phrase for phrase in DISTRESS_PHRASES[name] if re.search(rf'\b{re.escape(phrase)}\b', normalized)]
+        if found and level == 'none':
+            level = name
+        phrases.extend(found)
+
+    positive = negative = 0
+    tokens = tokenize(text)
+    for i, token in enumerate(tokens):
+        negated = any(previous in NEGATIONS for previous in tokens[max(0, i - 2):i])
+        if token in POSITIVE_WORDS:
+            negative, positive = (negative + 1, positive) if negated else (negative, positive + 1)
+        elif token in NEGATIVE_WORDS:
+            positive, negative = (positive + 1, negative) if negated else (positive, negative + 1)
+    negative += len(phrases)
+    if level == 'none' and negative >= 2:
+        level = 'low'
+    return level, phrases, positive, negative
+
+
+def features(texts):
+    """Hashed unigram and bigram counts (L2 normalised) followed by the lexicon scores"""
+    X = np.zeros((len(texts), HASH_BUCKETS + 3))
+    for row, text in enumerate(texts):
+        tokens = tokenize(text)
+        for gram in tokens + [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]:
+            X[row, zlib.crc32(gram.encode()) % HASH_BUCKETS] += 1
+        norm = np.linalg.norm(X[row, :HASH_BUCKETS])
+        if norm:
+            X[row, :HASH_BUCKETS] /= norm
+        level, _, positive, negative = lexicon(text)
+        X[row, HASH_BUCKETS:] = [positive, negative, ALERT_LEVELS.index(level)]
+    return X
+
+
+class SentimentModel:
+    def __init__(self, weights, bias, version=0, trained_at=''):
+        self.weights = weights
+        self.bias = bias
+        self.version = version
+        self.trained_at = trained_at
+
+    @classmethod
+    def fit(cls, texts, labels, iterations=300, learning_rate=1.0, l2=1e-4):
+        X = features(texts)
+        target = np.eye(len(SENTIMENTS))[[SENTIMENTS.index(label) for label in labels]]
+        weights = np.zeros((X.shape[1], len(SENTIMENTS)))
+        bias = np.zeros(len(SENTIMENTS))
+        for _ in range(iterations):
+            error = softmax(X @ weights + bias) - target
+            weights -= learning_rate * (X.T @ error / len(texts) + l2 * weights)
+            bias -= learning_rate * error.mean(axis=0)
+        return cls(weights, bias)
+
+    def predict_proba(self, texts):
+        return softmax(features(texts) @ self.weights + self.bias)
+
+    def save(self, directory=None):
+        directory = Path(directory or settings.ML_ARTIFACTS_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.version = latest_version(directory) + 1
+        self.trained_at = timezone.now().isoformat()
+        path = directory / ARTIFACT_NAME.format(self.version)
+        np.savez(
+            path, weights=self.weights, bias=self.bias, classes=np.array(SENTIMENTS),
+            buckets=HASH_BUCKETS, version=self.version, trained_at=self.trained_at,
+        )
+        return path
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        if list(data['classes']) != SENTIMENTS or int(data['buckets']) != HASH_BUCKETS:
+            raise ValueError(f'{path} was trained on different features or classes')
+        return cls(data['weights'], data['bias'], version=int(data['version']), trained_at=str(data['trained_at']))
+
+
+def latest_version(directory=None):
+    directory = Path(directory or settings.ML_ARTIFACTS_DIR)
+    versions = [
+        int(match.group(1))
+        for match in (re.fullmatch(r'sentiment_model_v(\d+)\.npz', path.name) for path in directory.glob('sentiment_model_v*.npz'))
+        if match
+    ]
+    return max(versions, default=0)
+
+
+_loaded = {}
+
+
+def load_latest():
+    """The newest saved model, or None if none has been trained yet"""
+    version = latest_version()
+    if not version:
+        return None
+    if version not in _loaded:
+        _loaded.clear()
+        _loaded[version] = SentimentModel.load(Path(settings.ML_ARTIFACTS_DIR) / ARTIFACT_NAME.format(version))
+    return _loaded[version]
+
+
+def lexicon_proba(positive, negative):
+    """Sentiment probabilities from the lexicon counts alone"""
+    if positive and negative:
+        return np.array([0.3, 0.3, 0.4]) if negative >= positive else np.array([0.4, 0.3, 0.3])
+    if not positive and not negative:
+        return np.array([0.3, 0.5, 0.2])
+    sure = min(0.95, 0.65 + 0.15 * max(positive, negative))
+    rest = (1 - sure) / 2
+    return np.array([sure, rest, rest]) if positive else np.array([rest, rest, sure])
+
+
+def classify_many(texts, model=None, threshold=None):
+    """classify() for many texts with one matrix product"""
+    model = model or load_latest()
+    threshold = settings.SENTIMENT_MODEL_CONFIDENCE if threshold is None else threshold
+    scores = [lexicon(text) for text in texts]
+    proba = model.predict_proba(texts) if model is not None and texts else [lexicon_proba(p, n) for _, _, p, n in scores]
+
+    results = []
+    for (level, phrases, _, _), row in zip(scores, proba):
+        sentiment = SENTIMENTS[int(np.argmax(row))]
+        if level in ('high', 'critical'):
+            sentiment = 'negative'
+        confidence = float(np.max(row))
+        results.append({
+            'sentiment': sentiment,
+            'confidence': round(confidence, 3),
+            'alert_level': level,
+            'concerning_phrases': phrases,
+            'escalate': level in ('high', 'critical') or confidence < threshold,
+        })
+    return results
+
+
+def classify(text, model=None, threshold=None):
+    return classify_many([text], model, threshold)[0]
+
+
+def audited(result):
+    """Whether to send a result that was not escalated to Gemini anyway (SENTIMENT_AUDIT_RATE of them)"""
+    return not result['escalate'] and random.random() < settings.SENTIMENT_AUDIT_RATE
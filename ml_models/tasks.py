@@ -0,0 +1,108 @@
+from django.core.management import call_command
+from jobs.queue import task
+
+
+@task('predict_risks', lease=6 * 60 * 60, max_attempts=2)
+def predict_risks(job):
+    call_command('predict_risks')
+
+
+@task('analyze_existing_checkins', lease=2 * 60 * 60, max_attempts=2)
+def analyze_existing_checkins(job):
+    call_command('analyze_existing_checkins')
+
+
+@task('analyze_checkin_sentiment', lease=5 * 60, max_attempts=5)
+def analyze_checkin_sentiment(job):
+    """Gemini sentiment analysis of a check-in the local classifier escalated"""
+    from ml_models.gemini_client import shared_client
+    from ml_models.models import SentimentAnalysis
+    from ml_models.utils import record_sentiment
+    from wellness.models import WellnessCheckIn
+
+    checkin = WellnessCheckIn.objects.select_related('student').filter(id=job.payload['checkin_id']).first()
+    if checkin is None or SentimentAnalysis.objects.filter(wellness_checkin=checkin, provisional=False).exists():
+        return
+
+    text = checkin.text_response or checkin.comments
+    if text:
+        # Errors propagate so the queue retries transient API failures
+        record_sentiment(checkin, shared_client().analyze_sentiment(text))
+
+
+# Profiles per batched recommendation prompt
+INTERVENTION_BATCH_SIZE = 25
+
+
+@task('auto_create_interventions', lease=60 * 60, max_attempts=2)
+def auto_create_interventions(job):
+    """AI-recommended interventions for every high-risk student without a scheduled one"""
+    from datetime import timedelta
+    from django.db import transaction
+    from django.utils import timezone
+    from accounts.models import User
+    from accounts.notifications import alerts_raised
+    from jobs.queue import report_progress
+    from ml_models.gemini_client import shared_client
+    from ml_models.utils import get_intervention_profiles
+    from wellness.models import Alert, Intervention
+
+    students = User.objects.filter(
+        current_risk__risk_level='high',
+        role='student'
+    ).exclude(
+        interventions__status='scheduled'
+    )
+    profiles = get_intervention_profiles(students)
+    ids = list(profiles)
+    batches = [
+        {student_id: profiles[student_id] for student_id in ids[i:i + INTERVENTION_BATCH_SIZE]}
+        for i in range(0, len(ids), INTERVENTION_BATCH_SIZE)
+    ]
+    report_progress(job, done=0, total=len(ids))
+
+    client = shared_client()
+    recommendations, failed = {}, 0
+    for batch, results, error in client.map_concurrent(client.recommend_intervention_batch, batches):
+        if error is not None:
+            failed += len(batch)
+        else:
+            recommendations.update(results)
+            failed += len(batch) - len(results)
+        report_progress(job, done=len(recommendations) + failed)
+
+    names = {student.pk: student.get_full_name() for student in User.objects.filter(pk__in=recommendations)}
+    scheduled_date = timezone.now() + timedelta(days=3)
+    with transaction.atomic():
+        # Skip anyone a counselor scheduled an intervention for while the recommendations came in
+        scheduled = set(Intervention.objects.filter(
+            student__in=list(recommendations), status='scheduled'
+        ).values_list('student', flat=True))
+        student_ids = [student_id for student_id in recommendations if student_id not in scheduled]
+        Intervention.objects.bulk_create([
+            Intervention(
+                student_id=student_id,
+                counselor_id=job.payload['counselor_id'],
+                intervention_type='counseling',
+                description="AI Auto-Generated: Intervention needed for high-risk student. Recommended: " + ', '.join(
+                    item['type'] for item in recommendations[student_id].get('recommendations', [])
+                    if isinstance(item, dict) and item.get('type')
+                ),
+                scheduled_date=scheduled_date,
+                status='scheduled'
+            )
+            for student_id in student_ids
+        ])
+        Alert.objects.bulk_create([
+            Alert(
+                student_id=student_id,
+                alert_type='ai_intervention',
+                severity='high',
+                message=f"🤖 BT Assistant auto-created intervention for {names[student_id]}. High-risk student requires immediate attention.",
+                resolved=False
+            )
+            for student_id in student_ids
+        ])
+    if student_ids:
+        alerts_raised(len(student_ids))
+    return {'created': len(student_ids), 'failed': failed}
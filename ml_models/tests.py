@@ -0,0 +1,834 @@
+import json
+import tempfile
+from datetime import date, timedelta
+import threading
+import time
+from io import StringIO
+from types import SimpleNamespace
+
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import response_cache
+from .gemini_client import GeminiClient, RateLimiter, RateLimitExceeded
+from .models import CachedResponse, PredictionLog, SentimentAnalysis
+from .risk_model import load_latest, settle
+from .utils import (
+    get_academic_patterns, get_intervention_profiles, get_prediction_features, get_student_academic_pattern_data, get_student_data_for_prediction,
+)
+from .sentiment_model import classify_many
+from accounts.models import User
+from jobs.models import Checkpoint, Job
+from jobs.queue import claim, enqueue, execute
+from academics.models import Assignment, Attendance, Class, Submission
+from wellness.models import Alert, CurrentRisk, Intervention, RiskAssessment, WellnessCheckIn
+
+
+class FakeClock:
+    """A clock that only moves when sleep() is called"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class APIError(Exception):
+    def __init__(self, code):
+        super().__init__(f'{code} error')
+        self.code = code
+
+
+class StubModels:
+    """Stands in for genai's client.models, recording calls and in-flight concurrency"""
+
+    def __init__(self, failures=0, delay=0):
+        self.failures = failures
+        self.delay = delay
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def generate_content(self, model, contents, **kwargs):
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            fail = self.failures > 0
+            self.failures -= 1
+        try:
+            time.sleep(self.delay)
+            if fail:
+                raise APIError(429)
+            return SimpleNamespace(text='{"ok": true}', usage_metadata=SimpleNamespace(total_token_count=50))
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+class StubStream:
+    """Stands in for genai's client.aio.models, streaming chunks and recording whether the stream was closed"""
+
+    def __init__(self, chunks, failures=0):
+        self.chunks = chunks
+        self.failures = failures
+        self.calls = 0
+        self.closed = False
+
+    async def generate_content_stream(self, model, contents, **kwargs):
+        self.calls += 1
+        fail = self.failures > 0
+        self.failures -= 1
+
+        async def stream():
+            try:
+                if fail:
+                    raise APIError(429)
+                for i, text in enumerate(self.chunks):
+                    last = i == len(self.chunks) - 1
+                    yield SimpleNamespace(text=text, usage_metadata=SimpleNamespace(total_token_count=80) if last else None)
+            finally:
+                self.closed = True
+        return stream()
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'ratelimit-tests'}},
+    GEMINI_RPM=60, GEMINI_TPM=10000, GEMINI_MAX_CONCURRENCY=3,
+)
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.clock = FakeClock()
+
+    def limiter(self, **kwargs):
+        return RateLimiter(clock=self.clock.time, sleep=self.clock.sleep, **kwargs)
+
+    def gemini(self, models, limiter=None):
+        client = GeminiClient(limiter=limiter or self.limiter())
+        client.client = SimpleNamespace(models=models)
+        return client
+
+    def test_requests_per_minute(self):
+        limiter = self.limiter(rpm=6)
+        start = self.clock.now
+        for _ in range(12):
+            limiter.acquire()
+        # The first 6 use the full bucket, the next 6 come one every 10 seconds
+        self.assertAlmostEqual(self.clock.now - start, 60)
+
+    def test_tokens_per_minute(self):
+        limiter = self.limiter(rpm=1000, tpm=1000)
+        start = self.clock.now
+        for _ in range(4):
+            limiter.acquire(500)
+        self.assertAlmostEqual(self.clock.now - start, 60)
+
+    @override_settings(GEMINI_API_KEY='')
+    def test_sdk_client_is_created_on_first_use(self):
+        with mock.patch('ml_models.gemini_client.genai.Client') as sdk:
+            client = GeminiClient(limiter=self.limiter())
+            sdk.assert_not_called()
+            self.assertIs(client.client, sdk.return_value)
+        sdk.assert_called_once_with(api_key='')
+
+    def test_limiters_share_one_budget(self):
+        first, second = self.limiter(rpm=2), self.limiter(rpm=2)
+        self.assertEqual(first.try_acquire(), 0)
+        self.assertEqual(second.try_acquire(), 0)
+        self.assertAlmostEqual(first.try_acquire(), 30)
+        self.assertAlmostEqual(second.try_acquire(), 30)
+
+    def test_settle_returns_unused_tokens(self):
+        limiter = self.limiter(rpm=1000, tpm=1000)
+        limiter.acquire(800)
+        limiter.settle(800, 100)
+        self.assertEqual(limiter.try_acquire(800), 0)
+
+    def test_backs_off_on_429_then_succeeds(self):
+        models = StubModels(failures=3)
+        client = self.gemini(models)
+        self.assertEqual(client._call('prompt'), {'ok': True})
+        self.assertEqual(models.calls, 4)
+        # Each consecutive 429 doubles the pause
+        self.assertEqual([s for s in self.clock.sleeps if s >= 1], [1, 2, 4])
+
+    def test_gives_up_after_max_retries(self):
+        client = self.gemini(StubModels(failures=100))
+        with self.assertRaises(RateLimitExceeded):
+            client._call('prompt')
+
+    def test_other_errors_are_not_retried(self):
+        models = StubModels()
+        models.generate_content = lambda **kwargs: (_ for _ in ()).throw(APIError(500))
+        with self.assertRaises(APIError):
+            self.gemini(models)._call('prompt')
+
+    def test_concurrency_is_bounded(self):
+        models = StubModels(delay=0.02)
+        client = self.gemini(models, limiter=RateLimiter(rpm=10000, tpm=10 ** 9))
+        results = list(client.map_concurrent(lambda n: client._call(f'prompt {n}'), range(12), max_workers=3))
+        self.assertEqual(len(results), 12)
+        self.assertTrue(all(error is None for _, _, error in results))
+        self.assertEqual(models.max_in_flight, 3)
+
+    def test_stream_text(self):
+        stream = StubStream(['Hello', '', ' there'], failures=1)
+        client = self.gemini(None)
+        client.client = SimpleNamespace(aio=SimpleNamespace(models=stream))
+
+        async def read():
+            return [text async for text in client.stream_text('hi')]
+
+        self.assertEqual(async_to_sync(read)(), ['Hello', ' there'])
+        self.assertEqual(stream.calls, 2)
+        self.assertTrue(stream.closed)
+        self.assertEqual(len(self.clock.sleeps), 1)
+
+    def test_closing_stream_text_closes_the_gemini_stream(self):
+        stream = StubStream(['a', 'b', 'c'])
+        client = self.gemini(None)
+        client.client = SimpleNamespace(aio=SimpleNamespace(models=stream))
+
+        async def read_one():
+            chunks = client.stream_text('hi')
+            first = await anext(chunks)
+            await chunks.aclose()
+            return first
+
+        self.assertEqual(async_to_sync(read_one)(), 'a')
+        self.assertTrue(stream.closed)
+
+
+class RiskStub(StubModels):
+    """Answers every prompt with a valid risk prediction; batch prompts get one item per student"""
+
+    def generate_content(self, model, contents, **kwargs):
+        self.calls += 1
+        self.prompts = getattr(self, 'prompts', []) + [contents]
+        item = {'risk_probability': 0.2, 'risk_level': 'low', 'risk_factors': [], 'recommendations': []}
+        if 'Students:' in contents:
+            batch = json.loads(contents.split('Students:\n')[1].split('\n\n')[0])
+            item = [{'id': student['id'], **item} for student in batch]
+        return SimpleNamespace(text=json.dumps(item), usage_metadata=None)
+
+
+class InterventionStub(StubModels):
+    """Answers every prompt with a valid recommendation; batch prompts get one item per student"""
+
+    def generate_content(self, model, contents, **kwargs):
+        self.calls += 1
+        item = {'recommendations': [{'type': 'Academic Tutoring', 'success_probability': 0.7, 'reasoning': ''}]}
+        if 'Students:' in contents:
+            batch = json.loads(contents.split('Students:\n')[1].split('\n\n')[0])
+            item = [{'id': student['id'], **item} for student in batch]
+        return SimpleNamespace(text=json.dumps(item), usage_metadata=None)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'response-cache-tests'}},
+    GEMINI_CACHE_STORE='db', GEMINI_RPM=10000, GEMINI_TPM=10 ** 9,
+)
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.models = RiskStub()
+        self.gemini = GeminiClient()
+        self.gemini.client = SimpleNamespace(models=self.models)
+
+    def student(self, **overrides):
+        return {'gpa': 0, 'attendance': 91.2, 'missing': 2, 'stress': 3.3, 'motivation': 3.0, **overrides}
+
+    def test_nearby_features_share_an_answer(self):
+        first = self.gemini.predict_risk(self.student())
+        second = self.gemini.predict_risk(self.student(attendance=91.3, stress=3.4))
+        self.assertEqual(first, second)
+        self.assertEqual(self.models.calls, 1)
+        self.gemini.predict_risk(self.student(attendance=80))
+        self.assertEqual(self.models.calls, 2)
+        self.assertEqual(response_cache.stats()['risk'], {'hits': 1, 'misses': 2, 'entries': 2, 'expired': 0, 'stale': 0})
+
+    def test_prompt_is_built_from_the_buckets(self):
+        self.gemini.predict_risk(self.student())
+        self.assertIn('Attendance Rate: 90.0%', self.models.prompts[0])
+        self.assertIn('Stress Level: 3.5/5', self.models.prompts[0])
+
+    def test_entries_survive_a_cache_flush(self):
+        self.gemini.predict_risk(self.student())
+        cache.clear()
+        self.gemini.predict_risk(self.student())
+        self.assertEqual(self.models.calls, 1)
+
+    def test_batch_asks_each_bucket_once(self):
+        self.gemini.predict_risk(self.student(attendance=50))
+        results = self.gemini.predict_risk_batch({
+            1: self.student(), 2: self.student(attendance=91.4), 3: self.student(attendance=60), 4: self.student(attendance=50),
+        })
+        self.assertEqual(set(results), {1, 2, 3, 4})
+        self.assertEqual(self.models.calls, 2)
+        batch = json.loads(self.models.prompts[1].split('Students:\n')[1].split('\n\n')[0])
+        self.assertEqual(len(batch), 2)
+
+    def test_batch_keeps_answers_when_a_retry_fails(self):
+        class DroppingStub(RiskStub):
+            """Leaves the 60% student out of the batch answer and fails their single call"""
+
+            def generate_content(self, model, contents, **kwargs):
+                if 'Students:' not in contents and 'Attendance Rate: 60.0%' in contents:
+                    self.calls += 1
+                    raise APIError(500)
+                response = super().generate_content(model, contents, **kwargs)
+                if 'Students:' in contents:
+                    answers = [item for item in json.loads(response.text) if item['id'] != self.dropped]
+                    response.text = json.dumps(answers)
+                return response
+
+        self.models = DroppingStub()
+        self.gemini.client = SimpleNamespace(models=self.models)
+        self.models.dropped = response_cache.entry_key('risk', response_cache.canonical('risk', self.student(attendance=60)))[:12]
+
+        results = self.gemini.predict_risk_batch({1: self.student(), 2: self.student(attendance=60), 3: self.student(attendance=50)})
+        self.assertEqual(set(results), {1, 3})
+        self.assertEqual(self.models.calls, 2)
+        self.assertEqual(response_cache.stats()['risk']['entries'], 2)
+
+    def test_batch_drops_malformed_retries(self):
+        class MalformedStub(RiskStub):
+            """Leaves the 60% student out of the batch answer and answers their single call with junk"""
+
+            def generate_content(self, model, contents, **kwargs):
+                response = super().generate_content(model, contents, **kwargs)
+                if 'Students:' in contents:
+                    answers = [item for item in json.loads(response.text) if item['id'] != self.dropped]
+                    response.text = json.dumps(answers)
+                elif 'Attendance Rate: 60.0%' in contents:
+                    response.text = json.dumps({'risk_level': 'dire', 'risk_probability': 3})
+                return response
+
+        self.models = MalformedStub()
+        self.gemini.client = SimpleNamespace(models=self.models)
+        self.models.dropped = response_cache.entry_key('risk', response_cache.canonical('risk', self.student(attendance=60)))[:12]
+
+        results = self.gemini.predict_risk_batch({1: self.student(), 2: self.student(attendance=60), 3: self.student(attendance=50)})
+        self.assertEqual(set(results), {1, 3})
+        self.assertEqual(self.models.calls, 2)
+        self.assertEqual(response_cache.stats()['risk']['entries'], 2)
+        self.assertIsNone(response_cache.get('risk', response_cache.canonical('risk', self.student(attendance=60))))
+
+    def test_version_bump_retires_old_answers(self):
+        self.gemini.predict_risk(self.student())
+        with mock.patch.dict(response_cache.TASKS, {'risk': (2, 24, response_cache.canonical_risk)}):
+            self.gemini.predict_risk(self.student())
+            self.assertEqual(self.models.calls, 2)
+            self.assertEqual(response_cache.stats()['risk']['stale'], 1)
+            call_command('gemini_cache', '--purge', '--stale', stdout=StringIO())
+            self.assertEqual(list(CachedResponse.objects.values_list('version', flat=True)), [2])
+
+
+class RiskModelTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(ML_ARTIFACTS_DIR=directory.name, RISK_MODEL_CONFIDENCE=0.9))
+        student = User.objects.create_user(username='student', password='pw', role='student')
+        rows = []
+        for attendance in range(40, 101, 2):
+            for missing in range(0, 8):
+                score = (100 - attendance) + missing * 6
+                level = 'high' if score >= 45 else 'medium' if score >= 20 else 'low'
+                features = {'gpa': 0, 'attendance': attendance, 'missing': missing, 'stress': 3, 'motivation': 3}
+                rows.append(PredictionLog(student=student, prediction_type='risk', confidence=0.8, prediction_value={
+                    'risk_level': level, 'risk_probability': 0.5, 'source': 'gemini', 'features': features,
+                }))
+        PredictionLog.objects.bulk_create(rows)
+
+    def train(self, *args):
+        call_command('train_risk_model', '--no-assessments', *args, stdout=StringIO())
+
+    def test_training_saves_a_new_version(self):
+        self.assertIsNone(load_latest())
+        self.train()
+        self.train()
+        model = load_latest()
+        self.assertEqual(model.version, 2)
+        self.assertGreater(model.metrics['accuracy'], 0.8)
+
+    def test_assessment_rows_use_the_prediction_attendance_window(self):
+        from ml_models.management.commands.train_risk_model import Command
+        student = User.objects.get(username='student')
+        cls = Class.objects.create(name='Class', code='ZZTRAIN', semester='1')
+        Attendance.objects.bulk_create([
+            Attendance(class_obj=cls, student=student, date=date.today() - timedelta(days=days), status=status)
+            for days, status in [(0, 'absent'), (10, 'absent'), (40, 'present'), (50, 'present')]
+        ])
+        RiskAssessment.objects.filter(student=student).delete()
+        RiskAssessment.objects.create(student=student, risk_level='high', risk_score=90, gpa=0, attendance_rate=50, missing_assignments=4)
+        rows, labels = Command().training_rows(include_assessments=True)
+        # Only the two absences fall in the 30 days before the assessment
+        self.assertEqual((rows[-1]['attendance'], rows[-1]['gpa'], labels[-1]), (0, 0, 'high'))
+
+    def test_settles_only_confident_students(self):
+        self.train()
+        settled, uncertain = settle({
+            'clear': {'gpa': 0, 'attendance': 100, 'missing': 0, 'stress': 3, 'motivation': 3},
+            'severe': {'gpa': 0, 'attendance': 40, 'missing': 7, 'stress': 3, 'motivation': 3},
+            'borderline': {'gpa': 0, 'attendance': 80, 'missing': 0, 'stress': 3, 'motivation': 3},
+        })
+        self.assertEqual(settled['clear']['risk_level'], 'low')
+        self.assertEqual(settled['severe']['risk_level'], 'high')
+        self.assertEqual(settled['clear']['source'], 'local')
+        self.assertEqual(list(uncertain), ['borderline'])
+
+    def test_local_predictions_are_not_training_data(self):
+        PredictionLog.objects.update(prediction_value={'risk_level': 'low', 'source': 'local', 'features': {}})
+        with self.assertRaises(CommandError):
+            self.train()
+
+
+class SentimentPrescreenTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(ML_ARTIFACTS_DIR=directory.name, SENTIMENT_MODEL_CONFIDENCE=0.75, SENTIMENT_AUDIT_RATE=0))
+        self.student = User.objects.create_user(username='student', password='pw', role='student')
+        self.client.force_login(self.student)
+
+    def check_in(self, comments):
+        self.client.post(reverse('wellness:wellness_checkin'), {
+            'stress_level': 3, 'motivation_level': 3, 'workload_level': 3, 'sleep_quality': 3, 'comments': comments,
+        })
+        return SentimentAnalysis.objects.get(wellness_checkin=WellnessCheckIn.objects.latest('id'))
+
+    def test_clear_text_is_settled_locally(self):
+        analysis = self.check_in('Feeling fine today')
+        self.assertEqual((analysis.source, analysis.provisional, analysis.sentiment), ('local', False, 'positive'))
+        self.assertFalse(Job.objects.exists())
+
+    def test_distress_alerts_at_once_and_escalates_to_gemini(self):
+        analysis = self.check_in("I feel hopeless and I can't take this anymore")
+        self.assertEqual((analysis.source, analysis.provisional, analysis.alert_level), ('local', True, 'high'))
+        self.assertEqual(Alert.objects.filter(alert_type='emotional_distress').count(), 1)
+
+        gemini = {'sentiment': 'negative', 'confidence': 0.9, 'alert_level': 'critical', 'concerning_phrases': ['hopeless']}
+        with mock.patch('ml_models.gemini_client.GeminiClient.analyze_sentiment', return_value=gemini):
+            execute(claim('test'))
+        analysis.refresh_from_db()
+        self.assertEqual((analysis.source, analysis.provisional, analysis.alert_level), ('gemini', False, 'critical'))
+        self.assertEqual(Alert.objects.filter(alert_type='emotional_distress').count(), 1)
+
+    @override_settings(SENTIMENT_AUDIT_RATE=1)
+    def test_audit_sample_of_clear_text_goes_to_gemini(self):
+        analysis = self.check_in('Feeling fine today')
+        self.assertEqual((analysis.source, analysis.provisional, analysis.audit), ('local', True, True))
+
+        gemini = {'sentiment': 'positive', 'confidence': 0.9, 'alert_level': 'none', 'concerning_phrases': []}
+        with mock.patch('ml_models.gemini_client.GeminiClient.analyze_sentiment', return_value=gemini):
+            execute(claim('test'))
+        analysis.refresh_from_db()
+        self.assertEqual((analysis.source, analysis.provisional, analysis.audit), ('gemini', False, True))
+
+    def test_benchmark_leaves_out_escalated_labels(self):
+        def label(text, **fields):
+            checkin = WellnessCheckIn.objects.create(
+                student=self.student, stress_level=3, motivation_level=3, workload_level=3, sleep_quality=3, text_response=text,
+            )
+            return SentimentAnalysis.objects.create(wellness_checkin=checkin, sentiment='neutral', confidence=0.9, alert_level='none', **fields)
+
+        before = label('had a quiz')
+        SentimentAnalysis.objects.filter(pk=before.pk).update(analyzed_at=timezone.now() - timedelta(days=30))
+        label('nothing new', source='local')
+        label('same as usual', audit=True)
+        label('studying for exams', audit=True)
+        label('I feel a bit lost')
+        label('not sure about anything')
+        label('unsure', source='local', provisional=True)
+
+        out = StringIO()
+        call_command('benchmark_sentiment', stdout=out)
+        self.assertIn(
+            'Population: 2 audit-sampled labels and 1 from before local screening (a sample of all check-ins); '
+            '2 labels of escalated check-ins left out',
+            out.getvalue(),
+        )
+
+    def test_benchmark_cutoff_survives_escalation(self):
+        checkin = WellnessCheckIn.objects.create(
+            student=self.student, stress_level=3, motivation_level=3, workload_level=3, sleep_quality=3, text_response='had a quiz',
+        )
+        older = SentimentAnalysis.objects.create(wellness_checkin=checkin, sentiment='neutral', confidence=0.9, alert_level='none')
+        SentimentAnalysis.objects.filter(pk=older.pk).update(analyzed_at=timezone.now() - timedelta(days=30))
+
+        # Screening starts with an escalated check-in, which Gemini's label then replaces
+        self.check_in("I feel hopeless and I can't take this anymore")
+        gemini = {'sentiment': 'negative', 'confidence': 0.9, 'alert_level': 'critical', 'concerning_phrases': []}
+        with mock.patch('ml_models.gemini_client.GeminiClient.analyze_sentiment', return_value=gemini):
+            execute(claim('test'))
+        self.assertFalse(SentimentAnalysis.objects.filter(source='local').exists())
+
+        out = StringIO()
+        call_command('benchmark_sentiment', stdout=out)
+        self.assertIn(
+            'Population: 0 audit-sampled labels and 1 from before local screening (a sample of all check-ins); '
+            '1 labels of escalated check-ins left out',
+            out.getvalue(),
+        )
+
+    def test_benchmark_trains_on_gemini_labels(self):
+        texts = {
+            'positive': ['great week', 'really enjoying class', 'happy with my grades', 'feeling good'],
+            'negative': ['so stressed about exams', 'tired and behind', 'bad week', 'worried about tests'],
+            'neutral': ['studying for exams', 'nothing new', 'same as usual', 'had a quiz'],
+        }
+        for sentiment, examples in texts.items():
+            for i in range(5):
+                for text in examples:
+                    checkin = WellnessCheckIn.objects.create(
+                        student=self.student, stress_level=3, motivation_level=3, workload_level=3, sleep_quality=3, text_response=text,
+                    )
+                    SentimentAnalysis.objects.create(wellness_checkin=checkin, sentiment=sentiment, confidence=0.9, alert_level='none')
+        out = StringIO()
+        call_command('benchmark_sentiment', '--train', stdout=out)
+        self.assertIn('Saved sentiment model v1', out.getvalue())
+        self.assertIn('precision', out.getvalue())
+        self.assertEqual(classify_many(['studying for exams'])[0]['sentiment'], 'neutral')
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'backfill-tests'}},
+)
+class CheckinBackfillTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(ML_ARTIFACTS_DIR=directory.name, SENTIMENT_AUDIT_RATE=0))
+        student = User.objects.create_user(username='student', password='pw', role='student')
+        texts = ['feeling fine', 'I feel hopeless', 'studying for exams']
+        self.checkins = [
+            WellnessCheckIn.objects.create(
+                student=student, stress_level=3, motivation_level=3, workload_level=3, sleep_quality=3, comments=texts[i % 3],
+            )
+            for i in range(30)
+        ]
+
+    def gemini(self, text):
+        if self.fail_on and text == 'studying for exams':
+            self.fail_on -= 1
+            if not self.fail_on:
+                raise RuntimeError('API down')
+        level = 'high' if 'hopeless' in text else 'none'
+        return {'sentiment': 'neutral', 'confidence': 0.9, 'alert_level': level, 'concerning_phrases': []}
+
+    def run_backfill(self, *args):
+        out = StringIO()
+        with mock.patch('ml_models.gemini_client.GeminiClient.analyze_sentiment', side_effect=self.gemini):
+            call_command('analyze_existing_checkins', '--chunk-size', '10', '--concurrency', '1', *args, stdout=out)
+        return out.getvalue()
+
+    def test_resumes_from_checkpoint_after_a_failure(self):
+        self.fail_on = 5  # The 5th Gemini call fails, in the second chunk
+        with self.assertRaisesMessage(CommandError, f'1 Gemini calls failed, stopping. Run the command again to resume from check-in {self.checkins[13].id + 1}.'):
+            self.run_backfill()
+        checkpoint = Checkpoint.objects.get(name='analyze_existing_checkins:all')
+        self.assertEqual(checkpoint.position, self.checkins[13].id)
+        self.assertEqual(SentimentAnalysis.objects.filter(provisional=False).count(), 19)
+
+        self.fail_on = 0
+        self.run_backfill()
+        # Drained, so the next run rescans from the start
+        self.assertEqual(Checkpoint.objects.get(name='analyze_existing_checkins:all').position, 0)
+        self.assertEqual(SentimentAnalysis.objects.filter(provisional=False).count(), 30)
+        self.assertEqual(SentimentAnalysis.objects.filter(source='local').count(), 10)
+        # One alert per distressed check-in, although local and Gemini results both flagged it
+        self.assertEqual(Alert.objects.filter(alert_type='emotional_distress').count(), 10)
+
+    def test_failed_calls_fail_the_job(self):
+        self.fail_on = 2
+        job = enqueue('analyze_existing_checkins')
+        with mock.patch('ml_models.gemini_client.GeminiClient.analyze_sentiment', side_effect=self.gemini), \
+                mock.patch('sys.stdout', new_callable=StringIO):
+            execute(claim('test'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn('CommandError: 1 Gemini calls failed', job.last_error)
+
+    def test_drained_run_rescans_provisional_checkins(self):
+        self.fail_on = 0
+        self.run_backfill()
+        self.assertEqual(Checkpoint.objects.get(name='analyze_existing_checkins:all').position, 0)
+        # An escalation whose job gave up leaves a local result below the old checkpoint
+        SentimentAnalysis.objects.filter(wellness_checkin=self.checkins[4]).update(source='local', provisional=True)
+
+        self.run_backfill()
+        analysis = SentimentAnalysis.objects.get(wellness_checkin=self.checkins[4])
+        self.assertEqual((analysis.source, analysis.provisional), ('gemini', False))
+        self.assertEqual(Checkpoint.objects.get(name='analyze_existing_checkins:all').position, 0)
+
+    @override_settings(SENTIMENT_AUDIT_RATE=1)
+    def test_audit_sample_is_sent_to_gemini(self):
+        self.fail_on = 0
+        self.run_backfill('--limit', '10')
+        self.assertEqual(SentimentAnalysis.objects.filter(source='gemini', provisional=False).count(), 10)
+        # Distress and unsure text was escalated anyway, so only the clear text counts as audited
+        self.assertEqual(
+            list(SentimentAnalysis.objects.filter(audit=True).order_by('wellness_checkin').values_list('wellness_checkin', flat=True)),
+            [checkin.id for checkin in self.checkins[:10:3]],
+        )
+
+    def test_limit_and_dry_run(self):
+        self.fail_on = 0
+        self.assertIn('Would analyze: 30', self.run_backfill('--dry-run'))
+        self.assertFalse(SentimentAnalysis.objects.exists())
+        self.assertFalse(Checkpoint.objects.exists())
+
+        self.run_backfill('--limit', '15')
+        self.assertEqual(SentimentAnalysis.objects.count(), 15)
+        self.assertEqual(Checkpoint.objects.get(name='analyze_existing_checkins:all').position, self.checkins[14].id)
+
+
+class PredictionFeatureTests(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='teacher', password='pw', role='teacher')
+        self.classes = [
+            Class.objects.create(name=f'Class {i}', code=f'ZZFEAT{i}', teacher=self.teacher, semester='1') for i in range(2)
+        ]
+        self.assignments = [
+            Assignment.objects.create(class_obj=cls, title=f'A{i}', description='', due_date=timezone.now(), total_points=10)
+            for cls in self.classes for i in range(3)
+        ]
+
+    def add_students(self, count):
+        start = User.objects.count()
+        students = User.objects.bulk_create([
+            User(username=f'featstudent{start + i}', password='!', role='student') for i in range(count)
+        ])
+        for cls in self.classes:
+            cls.students.add(*students)
+        Submission.objects.bulk_create([Submission(assignment=self.assignments[0], student=s) for s in students[::2]])
+        Attendance.objects.bulk_create([
+            Attendance(class_obj=self.classes[0], student=s, date=date.today() - timedelta(days=d), status='present' if d else 'absent')
+            for s in students[:50:2] for d in range(4)
+        ])
+        WellnessCheckIn.objects.bulk_create([
+            WellnessCheckIn(student=s, stress_level=level, motivation_level=2, workload_level=3, sleep_quality=3)
+            for s in students[:50:2] for level in (1, 2, 4, 5)
+        ])
+        for level in (1, 2, 4, 5):
+            WellnessCheckIn.objects.filter(stress_level=level).update(date=timezone.now() - timedelta(days=5 - level))
+        return students
+
+    def test_query_count_is_flat(self):
+        self.add_students(10)
+        with CaptureQueriesContext(connection) as few:
+            get_prediction_features(User.objects.filter(role='student'))
+        self.add_students(9990)
+        with CaptureQueriesContext(connection) as many:
+            features = get_prediction_features(User.objects.filter(role='student'))
+        self.assertEqual(len(features), 10000)
+        self.assertEqual(len(few), len(many))
+
+    def test_features(self):
+        with_data, without = self.add_students(2)
+        RiskAssessment.objects.create(student=with_data, risk_level='medium', risk_score=40, gpa=2.5, attendance_rate=75)
+        self.assertEqual(get_student_data_for_prediction(with_data), {
+            'gpa': 2.5, 'attendance': 75.0, 'missing': 5, 'stress': 3.7, 'motivation': 2.0,
+        })
+        self.assertEqual(get_student_data_for_prediction(without), {
+            'gpa': 0, 'attendance': 100, 'missing': 6, 'stress': 3, 'motivation': 3,
+        })
+
+
+class AcademicPatternTests(TestCase):
+    def setUp(self):
+        self.teacher = User.objects.create_user(username='teacher', password='pw', role='teacher')
+        self.cls = Class.objects.create(name='Class', code='ZZPAT', teacher=self.teacher, semester='1')
+        self.assignments = [
+            Assignment.objects.create(class_obj=self.cls, title=f'A{i}', description='', due_date=timezone.now(), total_points=20)
+            for i in range(6)
+        ]
+
+    def add_student(self, username, scores):
+        """A student whose graded scores are given oldest first, with three days of attendance"""
+        student = User.objects.create_user(username=username, password='pw', role='student')
+        Submission.objects.bulk_create([
+            Submission(assignment=assignment, student=student, score=score, graded_at=timezone.now() - timedelta(days=len(scores) - i))
+            for i, (assignment, score) in enumerate(zip(self.assignments, scores))
+        ])
+        Attendance.objects.bulk_create([
+            Attendance(class_obj=self.cls, student=student, date=date.today() - timedelta(days=d), status='late' if d else 'present')
+            for d in range(3)
+        ])
+        return student
+
+    def test_pattern(self):
+        student = self.add_student('declining', [20, 18, 19, 15, 12, 10])
+        pattern = get_student_academic_pattern_data(student)
+        self.assertEqual(pattern['grade_trend'], 'declining')
+        self.assertEqual([s['percentage'] for s in pattern['assignment_scores']], [50.0, 60.0, 75.0, 95.0, 90.0, 100.0])
+        self.assertEqual(pattern['assignment_scores'][0]['max_points'], 20.0)
+        self.assertEqual(pattern['attendance_records'][0], {'date': str(date.today()), 'status': 'present'})
+        self.assertEqual(pattern['recent_performance'], {'avg_score': 74.0, 'attendance_rate': 33.3})
+
+    def test_trends(self):
+        students = {
+            'improving': self.add_student('improving', [10, 10, 12, 16, 18]),
+            'stable': self.add_student('stable', [15, 16, 15]),
+            'insufficient_data': self.add_student('few', [10, 20]),
+            'none': User.objects.create_user(username='nothing', password='pw', role='student'),
+        }
+        patterns = get_academic_patterns(User.objects.filter(role='student'), score_limit=4)
+        self.assertEqual(patterns[students['improving'].pk]['grade_trend'], 'improving')
+        self.assertEqual(len(patterns[students['improving'].pk]['assignment_scores']), 4)
+        self.assertEqual(patterns[students['stable'].pk]['grade_trend'], 'stable')
+        self.assertEqual(patterns[students['insufficient_data'].pk]['grade_trend'], 'insufficient_data')
+        self.assertEqual(patterns[students['none'].pk], {
+            'attendance_records': [], 'assignment_scores': [], 'grade_trend': 'insufficient_data',
+            'recent_performance': {'avg_score': 0, 'attendance_rate': 0},
+        })
+
+    def test_query_count_is_flat(self):
+        self.add_student('first', [10, 12, 14])
+        with CaptureQueriesContext(connection) as few:
+            get_academic_patterns(User.objects.filter(role='student'))
+        for i in range(20):
+            self.add_student(f'student{i}', [10, 12, 14, 16])
+        with CaptureQueriesContext(connection) as many:
+            patterns = get_academic_patterns(User.objects.filter(role='student'))
+        self.assertEqual(len(patterns), 21)
+        self.assertEqual(len(few), len(many))
+
+    def test_counselor_pattern_report(self):
+        declining = self.add_student('declining', [20, 18, 19, 15, 12, 10])
+        declining.first_name, declining.last_name = 'Dee', 'Klein'
+        declining.save()
+        self.add_student('stable', [15, 16, 15])
+        User.objects.create_user(username='counselor', password='pw', role='counselor')
+        self.client.login(username='counselor', password='pw')
+        with mock.patch('ml_models.gemini_client.GeminiClient.generate_text', return_value='report') as generate:
+            response = self.client.post(
+                reverse('ai_assistant:counselor_chat'), json.dumps({'action': 'pattern_report'}), content_type='application/json'
+            )
+        data = response.json()['data']
+        self.assertEqual(data['trends'], {'improving': 0, 'stable': 1, 'declining': 1, 'insufficient_data': 0})
+        self.assertEqual(data['declining_students'][0]['name'], 'Dee Klein')
+        self.assertIn('Dee Klein (74.0% average', generate.call_args.args[0])
+        with mock.patch('ml_models.gemini_client.GeminiClient.generate_text', return_value='analysis') as generate:
+            response = self.client.post(
+                reverse('ai_assistant:counselor_chat'),
+                json.dumps({'action': 'analyze_behavior', 'student_id': declining.pk}), content_type='application/json'
+            )
+        self.assertEqual(response.json()['response'], 'analysis')
+        self.assertIn('"grade_trend": "declining"', generate.call_args.args[0])
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'intervention-tests'}},
+    # The job calls Gemini from worker threads, which cannot see this test's transaction
+    GEMINI_CACHE_STORE='cache', GEMINI_RPM=10000, GEMINI_TPM=10 ** 9, GEMINI_MAX_CONCURRENCY=1,
+)
+class AutoInterventionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.counselor = User.objects.create_user(username='counselor', password='pw', role='counselor')
+        self.client.login(username='counselor', password='pw')
+        self.models = InterventionStub()
+        self.gemini = GeminiClient()
+        self.gemini.client = SimpleNamespace(models=self.models)
+
+    def add_high_risk(self, count, stress=1):
+        start = User.objects.count()
+        students = User.objects.bulk_create([
+            User(username=f'riskstudent{start + i}', first_name='Student', last_name=str(start + i), password='!', role='student')
+            for i in range(count)
+        ])
+        assessments = RiskAssessment.objects.bulk_create([
+            RiskAssessment(student=s, risk_level='high', risk_score=80, gpa=2.0) for s in students
+        ])
+        CurrentRisk.objects.bulk_create([
+            CurrentRisk(student=a.student, assessment=a, date=date.today(), risk_level='high', risk_score=80, gpa=2.0)
+            for a in assessments
+        ])
+        WellnessCheckIn.objects.bulk_create([
+            WellnessCheckIn(student=s, stress_level=stress, motivation_level=3, workload_level=3, sleep_quality=3)
+            for s in students
+        ])
+        return students
+
+    def test_profiles(self):
+        student, = self.add_high_risk(1, stress=5)
+        self.assertEqual(get_intervention_profiles(User.objects.filter(pk=student.pk)), {student.pk: {
+            'risk_level': 'high', 'issues': 'academic decline, high stress', 'year_level': 9,
+        }})
+
+    def test_profile_query_count_is_flat(self):
+        self.add_high_risk(2)
+        with CaptureQueriesContext(connection) as few:
+            get_intervention_profiles(User.objects.filter(role='student'))
+        self.add_high_risk(50)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(len(get_intervention_profiles(User.objects.filter(role='student'))), 52)
+        self.assertEqual(len(few), len(many))
+
+    def test_batch_recommendations(self):
+        results = self.gemini.recommend_intervention_batch({
+            1: {'risk_level': 'high', 'issues': 'high stress', 'year_level': 9},
+            2: {'risk_level': 'high', 'issues': 'high stress', 'year_level': 9},
+            3: {'risk_level': 'high', 'issues': 'low attendance', 'year_level': 10},
+        })
+        self.assertEqual(self.models.calls, 1)
+        self.assertEqual(results[3]['recommendations'][0]['type'], 'Academic Tutoring')
+
+    def test_job_creates_interventions_in_bulk(self):
+        students = self.add_high_risk(60)
+        Intervention.objects.create(
+            student=students[0], counselor=self.counselor, intervention_type='counseling',
+            description='', scheduled_date=timezone.now(), status='scheduled'
+        )
+        response = self.client.post(
+            reverse('ai_assistant:counselor_chat'), json.dumps({'action': 'auto_create_interventions'}),
+            content_type='application/json'
+        )
+        job_id = response.json()['job_id']
+        # A second click while the job is pending reuses it
+        response = self.client.post(
+            reverse('ai_assistant:counselor_chat'), json.dumps({'action': 'auto_create_interventions'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.json()['job_id'], job_id)
+        self.assertTrue(response.json()['started_by_me'])
+        # Another counselor joins the same job and is told whose it is
+        other = User.objects.create_user(username='other', password='pw', role='counselor')
+        self.client.force_login(other)
+        response = self.client.post(
+            reverse('ai_assistant:counselor_chat'), json.dumps({'action': 'auto_create_interventions'}),
+            content_type='application/json'
+        )
+        self.assertEqual((response.json()['job_id'], response.json()['started_by_me']), (job_id, False))
+        self.assertIn(f'they will be assigned to {self.counselor.username}', response.json()['message'])
+
+        with mock.patch('ml_models.gemini_client._shared', self.gemini):
+            job = execute(claim('test'))
+        self.assertEqual(job.status, 'succeeded', job.last_error)
+        self.assertEqual(Intervention.objects.filter(description__contains='Academic Tutoring', counselor=self.counselor).count(), 59)
+        self.assertEqual(Alert.objects.filter(alert_type='ai_intervention').count(), 59)
+        # Everyone shares one profile bucket, so three batches need a single Gemini call
+        self.assertEqual(self.models.calls, 1)
+
+        status = self.client.get(reverse('ai_assistant:auto_interventions_status', args=[job_id])).json()
+        self.assertEqual(status, {
+            'status': 'succeeded', 'done': 59, 'total': 59, 'created_count': 59, 'failed_count': 0, 'retrying': False,
+        })
@@ -1,126 +1,278 @@
-from django.db.models import Avg, Count, Q
+from django.db.models import Count, Q
 from django.utils import timezone
 from datetime import timedelta
 
 
-def get_student_data_for_prediction(student):
-    """Extract student data for AI risk prediction"""
-    from academics.models import Attendance, Submission, Assignment
+def get_prediction_features(students):
+    """Extract AI risk prediction features for a queryset of students.
+
+    Returns {student_id: features} in a fixed number of queries however many
+    students are in the queryset.
+    """
+    from academics.models import Attendance, Class, Submission
     from wellness.models import WellnessCheckIn
-    
-    # Calculate attendance rate (last 30 days)
+    from django.db.models import F, Window
+    from django.db.models.functions import RowNumber
+
+    student_ids = students.values('pk')
+
+    # Attendance rate (last 30 days)
     thirty_days_ago = timezone.now() - timedelta(days=30)
-    attendance_records = Attendance.objects.filter(
-        student=student,
-        date__gte=thirty_days_ago
-    )
-    total_days = attendance_records.count()
-    present_days = attendance_records.filter(status='present').count()
-    attendance_rate = (present_days / total_days * 100) if total_days > 0 else 100
-    
-    # Count missing assignments
-    student_classes = student.enrolled_classes.all()
-    assignments = Assignment.objects.filter(class_obj__in=student_classes)
-    submitted = Submission.objects.filter(student=student).values_list('assignment_id', flat=True)
-    missing_count = assignments.exclude(id__in=submitted).count()
-    
-    # Get average stress and motivation from recent wellness check-ins
-    recent_checkins = WellnessCheckIn.objects.filter(
-        student=student
-    ).order_by('-date')[:3]
-    
-    avg_stress = recent_checkins.aggregate(Avg('stress_level'))['stress_level__avg'] or 3
-    avg_motivation = recent_checkins.aggregate(Avg('motivation_level'))['motivation_level__avg'] or 3
-    
-    return {
-        'gpa': 0,
-        'attendance': round(attendance_rate, 1),
-        'missing': missing_count,
-        'stress': round(avg_stress, 1),
-        'motivation': round(avg_motivation, 1)
+    attendance = {
+        row['student']: row
+        for row in Attendance.objects.filter(student__in=student_ids, date__gte=thirty_days_ago)
+        .values('student').annotate(total=Count('id'), present=Count('id', filter=Q(status='present')))
     }
 
+    # Missing = assignments in the student's classes minus the student's submissions to them
+    assigned = dict(
+        Class.students.through.objects.filter(user__in=student_ids)
+        .values('user').annotate(n=Count('class__assignments')).values_list('user', 'n')
+    )
+    submitted = dict(
+        Submission.objects.filter(student__in=student_ids, assignment__class_obj__students=F('student'))
+        .values('student').annotate(n=Count('id')).values_list('student', 'n')
+    )
+
+    # Stress and motivation of the three most recent check-ins
+    checkins = {}
+    for student_id, stress, motivation in WellnessCheckIn.objects.filter(student__in=student_ids).annotate(
+        rank=Window(RowNumber(), partition_by=F('student'), order_by=F('date').desc())
+    ).filter(rank__lte=3).values_list('student', 'stress_level', 'motivation_level'):
+        checkins.setdefault(student_id, []).append((stress, motivation))
+
+    features = {}
+    # GPA as the risk engine last computed it, the same figure RiskAssessment rows are trained on
+    for student_id, gpa in students.values_list('pk', 'current_risk__gpa'):
+        counts = attendance.get(student_id)
+        attendance_rate = (counts['present'] / counts['total'] * 100) if counts else 100
+        recent = checkins.get(student_id)
+        avg_stress = sum(stress for stress, _ in recent) / len(recent) if recent else 3
+        avg_motivation = sum(motivation for _, motivation in recent) / len(recent) if recent else 3
+        features[student_id] = {
+            'gpa': float(gpa or 0),
+            'attendance': round(attendance_rate, 1),
+            'missing': assigned.get(student_id, 0) - submitted.get(student_id, 0),
+            'stress': round(avg_stress, 1),
+            'motivation': round(avg_motivation, 1)
+        }
+    return features
+
+
+def get_student_data_for_prediction(student):
+    """Extract student data for AI risk prediction"""
+    from accounts.models import User
+
+    return get_prediction_features(User.objects.filter(pk=student.pk))[student.pk]
+
+
+def get_intervention_profiles(students):
+    """Intervention recommendation profiles for a queryset of students.
+
+    Returns {student_id: profile} in a fixed number of queries however many
+    students are in the queryset.
+    """
+    features = get_prediction_features(students)
+    profiles = {}
+    for student in students.select_related('current_risk'):
+        issues = []
+
+        # Latest risk assessment for GPA
+        latest_risk = getattr(student, 'current_risk', None)
+        gpa = latest_risk.gpa if latest_risk and latest_risk.gpa else None
+        risk_level = latest_risk.risk_level if latest_risk else 'medium'
+
+        if gpa and gpa < 2.5:
+            issues.append('academic decline')
+
+        data = features[student.pk]
+        if data['attendance'] < 80:
+            issues.append('low attendance')
+        if data['missing'] >= 3:
+            issues.append('missing assignments')
+        if data['stress'] >= 4:
+            issues.append('high stress')
+
+        profiles[student.pk] = {
+            'risk_level': risk_level,
+            'issues': ', '.join(issues) if issues else 'general support needed',
+            'year_level': student.year_level or 9
+        }
+    return profiles
+
 
 def get_student_profile_for_intervention(student):
     """Get student profile for intervention recommendations"""
-    from wellness.models import RiskAssessment
-    
-    issues = []
-    
-    # Get latest risk assessment for GPA
-    latest_risk = RiskAssessment.objects.filter(student=student).order_by('-date').first()
-    gpa = latest_risk.gpa if latest_risk and latest_risk.gpa else None
-    risk_level = latest_risk.risk_level if latest_risk else 'medium'
-    
-    if gpa and gpa < 2.5:
-        issues.append('academic decline')
-    
-    data = get_student_data_for_prediction(student)
-    if data['attendance'] < 80:
-        issues.append('low attendance')
-    if data['missing'] >= 3:
-        issues.append('missing assignments')
-    if data['stress'] >= 4:
-        issues.append('high stress')
-    
-    return {
-        'risk_level': risk_level,
-        'issues': ', '.join(issues) if issues else 'general support needed',
-        'year_level': student.year_level or 9
-    }
+    from accounts.models import User
+
+    return get_intervention_profiles(User.objects.filter(pk=student.pk))[student.pk]
+
+
+def get_academic_patterns(students, attendance_limit=10, score_limit=10):
+    """Extract academic pattern data for a queryset of students.
+
+    Returns {student_id: pattern} from the last `attendance_limit` attendance
+    records and the last `score_limit` graded submissions of every student, in
+    a fixed number of queries however many students are in the queryset.
+    """
+    import numpy as np
+    from academics.models import Attendance, Submission
+    from django.db.models import F, Window
+    from django.db.models.functions import RowNumber
+
+    student_ids = students.values('pk')
+
+    attendance = {}
+    for student_id, date, status in Attendance.objects.filter(student__in=student_ids).annotate(
+        rank=Window(RowNumber(), partition_by=F('student'), order_by=[F('date').desc(), F('id').desc()])
+    ).filter(rank__lte=attendance_limit).order_by('student', 'rank').values_list('student', 'date', 'status'):
+        attendance.setdefault(student_id, []).append({'date': str(date), 'status': status})
+
+    scores = {}
+    for student_id, title, score, total_points, graded_at in Submission.objects.filter(
+        student__in=student_ids, score__isnull=False
+    ).annotate(
+        rank=Window(RowNumber(), partition_by=F('student'), order_by=[F('graded_at').desc(nulls_last=True), F('id').desc()])
+    ).filter(rank__lte=score_limit).order_by('student', 'rank').values_list(
+        'student', 'assignment__title', 'score', 'assignment__total_points', 'graded_at'
+    ):
+        scores.setdefault(student_id, []).append({
+            'title': title,
+            'score': float(score),
+            'max_points': float(total_points),
+            'percentage': round(score / total_points * 100, 1) if total_points else 0.0,
+            'date': str(graded_at.date()) if graded_at else None
+        })
+
+    ids = list(students.values_list('pk', flat=True))
+
+    # Percentages newest first, one row per student padded with NaN
+    matrix = np.full((len(ids), max(score_limit, 1)), np.nan)
+    for row, student_id in enumerate(ids):
+        percentages = [s['percentage'] for s in scores.get(student_id, [])]
+        matrix[row, :len(percentages)] = percentages
+    counts = (~np.isnan(matrix)).sum(axis=1)
+
+    # Grade trend: the three most recent scores against the three oldest
+    recent_avg = np.nansum(matrix[:, :3], axis=1) / np.maximum(np.minimum(counts, 3), 1)
+    oldest = np.clip(counts[:, None] - 3 + np.arange(3), 0, None)
+    older_avg = np.take_along_axis(matrix, oldest, axis=1).mean(axis=1)
+    trend = np.select(
+        [counts < 3, recent_avg > older_avg + 5, recent_avg < older_avg - 5],
+        ['insufficient_data', 'improving', 'declining'],
+        default='stable'
+    )
+    avg_score = np.nansum(matrix[:, :5], axis=1) / np.maximum(np.minimum(counts, 5), 1)
+
+    patterns = {}
+    for row, student_id in enumerate(ids):
+        records = attendance.get(student_id, [])
+        present = sum(1 for record in records if record['status'] == 'present')
+        patterns[student_id] = {
+            'attendance_records': records,
+            'assignment_scores': scores.get(student_id, []),
+            'grade_trend': str(trend[row]),
+            'recent_performance': {
+                'avg_score': round(float(avg_score[row]), 1),
+                'attendance_rate': round(present / len(records) * 100, 1) if records else 0
+            }
+        }
+    return patterns
 
 
 def get_student_academic_pattern_data(student):
     """Extract student academic pattern data for AI analysis"""
-    from academics.models import Attendance, Submission, Assignment
-    from django.db.models import Avg
-    
-    # Get last 10 attendance records
-    attendance_records = Attendance.objects.filter(
-        student=student
-    ).order_by('-date')[:10]
-    
-    attendance_list = [{
-        'date': str(record.date),
-        'status': record.status
-    } for record in attendance_records]
-    
-    # Get last 10 graded assignments
-    submissions = Submission.objects.filter(
-        student=student,
-        score__isnull=False
-    ).select_related('assignment').order_by('-graded_at')[:10]
-    
-    assignment_scores = [{
-        'title': sub.assignment.title,
-        'score': float(sub.score),
-        'max_points': float(sub.assignment.points),
-        'percentage': round((float(sub.score) / float(sub.assignment.points)) * 100, 1),
-        'date': str(sub.graded_at.date())
-    } for sub in submissions]
-    
-    # Calculate grade trend
-    if len(assignment_scores) >= 3:
-        recent_avg = sum([s['percentage'] for s in assignment_scores[:3]]) / 3
-        older_avg = sum([s['percentage'] for s in assignment_scores[-3:]]) / 3
-        if recent_avg > older_avg + 5:
-            grade_trend = 'improving'
-        elif recent_avg < older_avg - 5:
-            grade_trend = 'declining'
-        else:
-            grade_trend = 'stable'
-    else:
-        grade_trend = 'insufficient_data'
-    
-    # Recent performance summary
-    recent_performance = {
-        'avg_score': round(sum([s['percentage'] for s in assignment_scores[:5]]) / len(assignment_scores[:5]), 1) if assignment_scores else 0,
-        'attendance_rate': round((attendance_records.filter(status='present').count() / attendance_records.count() * 100), 1) if attendance_records.count() > 0 else 0
-    }
-    
-    return {
-        'attendance_records': attendance_list,
-        'assignment_scores': assignment_scores,
-        'grade_trend': grade_trend,
-        'recent_performance': recent_performance
+    from accounts.models import User
+
+    return get_academic_patterns(User.objects.filter(pk=student.pk))[student.pk]
+
+
+def record_sentiment(checkin, result, source='gemini', provisional=False, audit=False):
+    """Store a sentiment result for a check-in and raise an emotional distress
+    alert for high or critical distress. Returns the alert, if one was raised.
+
+    A provisional local result is replaced when Gemini's result is recorded;
+    the alert is only raised once per check-in. The audit flag is kept when
+    Gemini's result replaces the local one.
+    """
+    from ml_models.models import SentimentAnalysis
+
+    previous = SentimentAnalysis.objects.filter(wellness_checkin=checkin).values_list('alert_level', flat=True).first()
+    defaults = {
+        'sentiment': result['sentiment'],
+        'confidence': result['confidence'],
+        'alert_level': result['alert_level'],
+        'concerning_phrases': result.get('concerning_phrases', []),
+        'source': source,
+        'provisional': provisional,
     }
+    if audit:
+        defaults['audit'] = True
+    SentimentAnalysis.objects.update_or_create(wellness_checkin=checkin, defaults=defaults)
+
+    if result['alert_level'] in ['high', 'critical'] and previous not in ['high', 'critical']:
+        alert = distress_alert(checkin)
+        alert.save()
+        return alert
+    return None
+
+
+def distress_alert(checkin):
+    """Unsaved emotional distress alert for a check-in"""
+    from wellness.models import Alert
+
+    return Alert(
+        student=checkin.student,
+        alert_type='emotional_distress',
+        severity='high',
+        message=f"Emotional distress detected in wellness check-in"
+    )
+
+
+SCREENING_STARTED = 'sentiment_screening_started'
+
+
+def mark_screening_started():
+    """Record, once, when the local classifier first screened a check-in.
+
+    benchmark_sentiment splits Gemini's labels on this time; it is kept as a
+    Checkpoint (position in epoch seconds) because the local rows themselves
+    turn into Gemini ones when they are escalated.
+    """
+    from jobs.models import Checkpoint
+
+    Checkpoint.objects.get_or_create(name=SCREENING_STARTED, defaults={'position': int(timezone.now().timestamp())})
+
+
+def screening_started():
+    """When local screening started, or None if it has not yet"""
+    from datetime import datetime, timezone as dt_timezone
+    from django.db.models import Min
+    from jobs.models import Checkpoint
+    from ml_models.models import SentimentAnalysis
+
+    starts = [
+        datetime.fromtimestamp(position, tz=dt_timezone.utc)
+        for position in Checkpoint.objects.filter(name=SCREENING_STARTED).values_list('position', flat=True)
+    ]
+    # Rows screened before the marker existed: settled, audited or still provisional ones keep a trace
+    starts.append(SentimentAnalysis.objects.filter(
+        Q(source='local') | Q(audit=True) | Q(provisional=True)
+    ).aggregate(start=Min('analyzed_at'))['start'])
+    return min((start for start in starts if start), default=None)
+
+
+def prescreen_sentiment(checkin, text):
+    """Record the local classifier's result for a check-in straight away.
+
+    Returns True when the text still needs Gemini (high distress, an unsure
+    result, or picked for the audit sample); the stored result is then
+    provisional until Gemini's replaces it.
+    """
+    from ml_models.sentiment_model import audited, classify
+
+    result = classify(text)
+    audit = audited(result)
+    mark_screening_started()
+    record_sentiment(checkin, result, source='local', provisional=result['escalate'] or audit, audit=audit)
+    return result['escalate'] or audit
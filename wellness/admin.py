@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import WellnessCheckIn, RiskAssessment, TeacherConcern, Intervention, Alert
+from .models import WellnessCheckIn, RiskAssessment, CurrentRisk, TeacherConcern, Intervention, Alert
 
 @admin.register(WellnessCheckIn)
 class WellnessCheckInAdmin(admin.ModelAdmin):
@@ -11,6 +11,11 @@ class RiskAssessmentAdmin(admin.ModelAdmin):
     list_display = ['student', 'risk_level', 'risk_score', 'date']
     list_filter = ['risk_level', 'date']
 
+@admin.register(CurrentRisk)
+class CurrentRiskAdmin(admin.ModelAdmin):
+    list_display = ['student', 'risk_level', 'risk_score', 'date', 'updated_at']
+    list_filter = ['risk_level']
+
 @admin.register(TeacherConcern)
 class TeacherConcernAdmin(admin.ModelAdmin):
     list_display = ['student', 'teacher', 'concern_type', 'severity', 'date_observed', 'resolved']
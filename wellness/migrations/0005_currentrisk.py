@@ -0,0 +1,58 @@
+# Generated by Django 5.0 on 2026-10-18 06:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_current_risk(apps, schema_editor):
+    RiskAssessment = apps.get_model('wellness', 'RiskAssessment')
+    CurrentRisk = apps.get_model('wellness', 'CurrentRisk')
+
+    newest = RiskAssessment.objects.filter(
+        student=models.OuterRef('student')
+    ).order_by('-date', '-id').values('id')[:1]
+    latest = RiskAssessment.objects.filter(id=models.Subquery(newest))
+
+    CurrentRisk.objects.bulk_create([
+        CurrentRisk(
+            student_id=assessment.student_id,
+            assessment_id=assessment.id,
+            date=assessment.date,
+            risk_level=assessment.risk_level,
+            risk_score=assessment.risk_score,
+            gpa=assessment.gpa,
+            attendance_rate=assessment.attendance_rate,
+            missing_assignments=assessment.missing_assignments,
+        )
+        for assessment in latest.iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_user_subject'),
+        ('wellness', '0004_alter_alert_alert_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrentRisk',
+            fields=[
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='current_risk', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('date', models.DateField()),
+                ('risk_level', models.CharField(choices=[('low', 'Low'), ('medium', 'Medium'), ('high', 'High')], max_length=10)),
+                ('risk_score', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('gpa', models.DecimalField(blank=True, decimal_places=2, max_digits=3, null=True)),
+                ('attendance_rate', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('missing_assignments', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('assessment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wellness.riskassessment')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['risk_level', '-risk_score'], name='wellness_cu_risk_le_d4c7fb_idx'), models.Index(fields=['-risk_score'], name='wellness_cu_risk_sc_1d42ff_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_current_risk, migrations.RunPython.noop),
+    ]
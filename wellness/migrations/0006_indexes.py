@@ -0,0 +1,39 @@
+# Generated by Django 5.0 on 2026-10-18 06:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wellness', '0005_currentrisk'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(fields=['resolved', 'severity', 'is_read'], name='alert_resolved_sev_read_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(condition=models.Q(('resolved', False)), fields=['-created_at'], name='alert_open_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alert',
+            index=models.Index(condition=models.Q(('resolved', False)), fields=['student', 'alert_type'], name='alert_open_student_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='intervention',
+            index=models.Index(fields=['status', 'scheduled_date'], name='intervention_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='riskassessment',
+            index=models.Index(fields=['student', '-date'], name='risk_student_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='wellnesscheckin',
+            index=models.Index(fields=['student', '-date'], name='checkin_student_date_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0 on 2026-10-18 07:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wellness', '0006_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='currentrisk',
+            name='assessment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='wellness.riskassessment'),
+        ),
+    ]
@@ -12,6 +12,11 @@ class WellnessCheckIn(models.Model):
     comments = models.TextField(blank=True)
     text_response = models.TextField(blank=True, null=True, help_text="Optional: How are you feeling today?")
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['student', '-date'], name='checkin_student_date_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.student.username} - {self.date.strftime('%Y-%m-%d')}"
 
@@ -32,6 +37,31 @@ class RiskAssessment(models.Model):
     
     class Meta:
         ordering = ['-date']
+        indexes = [
+            models.Index(fields=['student', '-date'], name='risk_student_date_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.student.username} - {self.risk_level} ({self.date})"
+
+class CurrentRisk(models.Model):
+    """Newest RiskAssessment per student, kept up to date by the risk engine"""
+    student = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='current_risk')
+    # Deleting the assessment clears it, then a post_delete signal moves the row to the newest one left
+    assessment = models.ForeignKey(RiskAssessment, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    date = models.DateField()
+    risk_level = models.CharField(max_length=10, choices=RiskAssessment.RISK_LEVELS)
+    risk_score = models.DecimalField(max_digits=5, decimal_places=2)
+    gpa = models.DecimalField(max_digits=3, decimal_places=2, null=True, blank=True)
+    attendance_rate = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    missing_assignments = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['risk_level', '-risk_score']),
+            models.Index(fields=['-risk_score']),
+        ]
     
     def __str__(self):
         return f"{self.student.username} - {self.risk_level} ({self.date})"
@@ -84,6 +114,11 @@ class Intervention(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'scheduled_date'], name='intervention_status_date_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.intervention_type} for {self.student.username} - {self.status}"
 
@@ -113,6 +148,12 @@ class Alert(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['resolved', 'severity', 'is_read'], name='alert_resolved_sev_read_idx'),
+            # Partial indexes: open alerts are a small, hot slice of the table
+            models.Index(fields=['-created_at'], name='alert_open_created_idx', condition=models.Q(resolved=False)),
+            models.Index(fields=['student', 'alert_type'], name='alert_open_student_type_idx', condition=models.Q(resolved=False)),
+        ]
     
     def __str__(self):
         return f"{self.alert_type} - {self.student.username}"
@@ -0,0 +1,270 @@
+"""Set-based risk engine.
+
+Works out every input the risk score needs (GPA, attendance, missing
+assignments, latest wellness flags) for a whole cohort of students in a fixed
+number of aggregate queries, scores them in memory and writes the results with
+bulk_create.
+"""
+import time
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import Avg, BooleanField, Count, ExpressionWrapper, OuterRef, Q, Subquery
+
+RISK_ALERT_TYPES = ['high_risk', 'missing_assignments', 'low_attendance']
+
+
+def score_risk(gpa, attendance_rate, missing_assignments, wellness_flag):
+    """Return (risk_score, risk_level) for one student's metrics"""
+    risk_score = 0
+
+    # GPA factor (0-40 points)
+    if gpa < 1.5:
+        risk_score += 40
+    elif gpa < 2.0:
+        risk_score += 30
+    elif gpa < 2.5:
+        risk_score += 20
+    elif gpa < 3.0:
+        risk_score += 10
+
+    # Attendance factor (0-30 points)
+    if attendance_rate < 60:
+        risk_score += 30
+    elif attendance_rate < 70:
+        risk_score += 25
+    elif attendance_rate < 80:
+        risk_score += 15
+    elif attendance_rate < 90:
+        risk_score += 5
+
+    # Missing assignments factor (0-20 points)
+    if missing_assignments >= 5:
+        risk_score += 20
+    elif missing_assignments >= 3:
+        risk_score += 15
+    elif missing_assignments >= 1:
+        risk_score += 5
+
+    # Wellness factor (0-10 points)
+    if wellness_flag:
+        risk_score += 10
+
+    if risk_score >= 50:
+        risk_level = 'high'
+    elif risk_score >= 30:
+        risk_level = 'medium'
+    else:
+        risk_level = 'low'
+
+    return risk_score, risk_level
+
+
+def build_risk_alerts(assessment, open_alert_types):
+    """Return unsaved Alerts a new assessment should raise.
+
+    open_alert_types is the set of alert types the student already has
+    unresolved, so an alert is never duplicated.
+    """
+    from .models import Alert
+
+    student = assessment.student
+    alerts = []
+
+    if assessment.risk_level == 'high' and 'high_risk' not in open_alert_types:
+        alerts.append(Alert(
+            student=student,
+            alert_type='high_risk',
+            severity='critical',
+            message=f'{student.get_full_name()} has been identified as high risk. Risk score: {assessment.risk_score}. GPA: {assessment.gpa}, Attendance: {assessment.attendance_rate}%, Missing assignments: {assessment.missing_assignments}.'
+        ))
+
+    if assessment.missing_assignments >= 3 and 'missing_assignments' not in open_alert_types:
+        alerts.append(Alert(
+            student=student,
+            alert_type='missing_assignments',
+            severity='high' if assessment.missing_assignments >= 5 else 'medium',
+            message=f'{student.get_full_name()} has {assessment.missing_assignments} missing assignments. Immediate follow-up recommended.'
+        ))
+
+    if assessment.attendance_rate and assessment.attendance_rate < 75 and 'low_attendance' not in open_alert_types:
+        alerts.append(Alert(
+            student=student,
+            alert_type='low_attendance',
+            severity='high' if assessment.attendance_rate < 60 else 'medium',
+            message=f'{student.get_full_name()} has low attendance rate of {assessment.attendance_rate}%. Intervention may be needed.'
+        ))
+
+    return alerts
+
+
+def refresh_current_risk(assessments):
+    """Upsert the CurrentRisk row of every student in assessments"""
+    from .models import CurrentRisk
+
+    rows = {
+        assessment.student_id: CurrentRisk(
+            student_id=assessment.student_id,
+            assessment=assessment,
+            date=assessment.date,
+            risk_level=assessment.risk_level,
+            risk_score=assessment.risk_score,
+            gpa=assessment.gpa,
+            attendance_rate=assessment.attendance_rate,
+            missing_assignments=assessment.missing_assignments,
+        )
+        for assessment in assessments
+    }
+    CurrentRisk.objects.bulk_create(
+        rows.values(),
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['student'],
+        update_fields=['assessment', 'date', 'risk_level', 'risk_score', 'gpa', 'attendance_rate', 'missing_assignments', 'updated_at'],
+    )
+
+
+
+def recompute_current_risk(student_ids):
+    """Move the CurrentRisk rows whose assessment was deleted to the newest assessment left.
+
+    Students without any assessment left lose their CurrentRisk row.
+    """
+    from .models import CurrentRisk, RiskAssessment
+
+    orphaned = CurrentRisk.objects.filter(student__in=student_ids, assessment__isnull=True)
+    newest = RiskAssessment.objects.filter(student=OuterRef('student')).order_by('-date', '-id').values('id')[:1]
+    refresh_current_risk(RiskAssessment.objects.filter(student__in=orphaned.values('student'), id=Subquery(newest)))
+    orphaned.delete()
+
+class RiskEngine:
+    """Calculate risk assessments for a queryset of students in bulk.
+
+    The number of queries is fixed regardless of how many students are in
+    scope. Wall-clock time per stage is recorded in ``timings``.
+    """
+
+    def __init__(self, students):
+        self.students = students
+        self.timings = {}
+        self.alerts_created = 0
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.perf_counter() - start
+
+    def collect(self):
+        """Return {student_id: metrics} for every student in scope"""
+        from academics.models import Class, Grade, Attendance, Submission
+        from .models import WellnessCheckIn
+
+        student_ids = self.students.values('pk')
+
+        with self.stage('students'):
+            latest_checkin = WellnessCheckIn.objects.filter(
+                student=OuterRef('pk')
+            ).order_by('-date').annotate(
+                flag=ExpressionWrapper(
+                    Q(stress_level__gte=4) | Q(motivation_level__lte=2) | Q(need_help=True),
+                    output_field=BooleanField()
+                )
+            ).values('flag')[:1]
+            students = list(self.students.annotate(wellness_flag=Subquery(latest_checkin)))
+
+        with self.stage('grades'):
+            grade_avgs = dict(
+                Grade.objects.filter(student__in=student_ids)
+                .values('student').annotate(avg=Avg('score')).values_list('student', 'avg')
+            )
+
+        with self.stage('attendance'):
+            attendance = {
+                row['student']: row
+                for row in Attendance.objects.filter(student__in=student_ids)
+                .values('student').annotate(total=Count('id'), present=Count('id', filter=Q(status='present')))
+            }
+
+        with self.stage('assignments'):
+            assignment_counts = dict(
+                Class.students.through.objects.filter(user__in=student_ids)
+                .values('user').annotate(n=Count('class__assignments')).values_list('user', 'n')
+            )
+
+        with self.stage('submissions'):
+            submission_counts = dict(
+                Submission.objects.filter(student__in=student_ids)
+                .values('student').annotate(n=Count('id')).values_list('student', 'n')
+            )
+
+        metrics = {}
+        for student in students:
+            avg = grade_avgs.get(student.id)
+            gpa = round(avg / 25, 2) if avg else 0  # Convert to 4.0 scale
+
+            counts = attendance.get(student.id)
+            if counts and counts['total']:
+                attendance_rate = round(counts['present'] / counts['total'] * 100, 2)
+            else:
+                attendance_rate = 100
+
+            missing = assignment_counts.get(student.id, 0) - submission_counts.get(student.id, 0)
+
+            metrics[student.id] = {
+                'student': student,
+                'gpa': gpa,
+                'attendance_rate': attendance_rate,
+                'missing_assignments': max(missing, 0),
+                'wellness_flag': bool(student.wellness_flag),
+            }
+        return metrics
+
+    def run(self):
+        """Score every student in scope and persist the assessments and alerts"""
+        from accounts.notifications import alerts_raised
+        from .models import Alert, RiskAssessment
+
+        metrics = self.collect()
+
+        with self.stage('score'):
+            assessments = []
+            for row in metrics.values():
+                risk_score, risk_level = score_risk(
+                    row['gpa'], row['attendance_rate'], row['missing_assignments'], row['wellness_flag']
+                )
+                assessments.append(RiskAssessment(
+                    student=row['student'],
+                    risk_level=risk_level,
+                    risk_score=risk_score,
+                    gpa=row['gpa'],
+                    attendance_rate=row['attendance_rate'],
+                    missing_assignments=row['missing_assignments'],
+                ))
+
+        with transaction.atomic():
+            with self.stage('write'):
+                RiskAssessment.objects.bulk_create(assessments, batch_size=500)
+                refresh_current_risk(assessments)
+
+            # bulk_create skips post_save, so raise the risk alerts here in one pass
+            with self.stage('alerts'):
+                open_alerts = {}
+                for student_id, alert_type in Alert.objects.filter(
+                    student__in=self.students.values('pk'),
+                    alert_type__in=RISK_ALERT_TYPES,
+                    resolved=False
+                ).values_list('student_id', 'alert_type'):
+                    open_alerts.setdefault(student_id, set()).add(alert_type)
+
+                alerts = []
+                for assessment in assessments:
+                    alerts.extend(build_risk_alerts(assessment, open_alerts.get(assessment.student_id, set())))
+                Alert.objects.bulk_create(alerts, batch_size=500)
+                if alerts:
+                    alerts_raised(len(alerts))
+
+        self.alerts_created = len(alerts)
+        return assessments
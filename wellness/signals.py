@@ -1,65 +1,30 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from .models import RiskAssessment, TeacherConcern, WellnessCheckIn, Alert
+from .risk import RISK_ALERT_TYPES, build_risk_alerts, recompute_current_risk, refresh_current_risk
 
 @receiver(post_save, sender=RiskAssessment)
-def create_risk_alert(sender, instance, created, **kwargs):
-    """Create alert when student moves to high risk"""
-    if instance.risk_level == 'high':
-        # Check if alert already exists for this student
-        existing_alert = Alert.objects.filter(
-            student=instance.student,
-            alert_type='high_risk',
-            resolved=False
-        ).exists()
-        
-        if not existing_alert:
-            Alert.objects.create(
-                student=instance.student,
-                alert_type='high_risk',
-                severity='critical',
-                message=f'{instance.student.get_full_name()} has been identified as high risk. Risk score: {instance.risk_score}. GPA: {instance.gpa}, Attendance: {instance.attendance_rate}%, Missing assignments: {instance.missing_assignments}.'
-            )
+def create_risk_alerts(sender, instance, created, **kwargs):
+    """Create high risk, missing assignment and low attendance alerts for a new assessment"""
+    open_alert_types = set(Alert.objects.filter(
+        student=instance.student,
+        alert_type__in=RISK_ALERT_TYPES,
+        resolved=False
+    ).values_list('alert_type', flat=True))
 
-@receiver(post_save, sender=RiskAssessment)
-def create_missing_assignments_alert(sender, instance, created, **kwargs):
-    """Create alert when student has multiple missing assignments"""
-    if instance.missing_assignments >= 3:
-        # Check if alert already exists
-        existing_alert = Alert.objects.filter(
-            student=instance.student,
-            alert_type='missing_assignments',
-            resolved=False
-        ).exists()
-        
-        if not existing_alert:
-            severity = 'high' if instance.missing_assignments >= 5 else 'medium'
-            Alert.objects.create(
-                student=instance.student,
-                alert_type='missing_assignments',
-                severity=severity,
-                message=f'{instance.student.get_full_name()} has {instance.missing_assignments} missing assignments. Immediate follow-up recommended.'
-            )
+    for alert in build_risk_alerts(instance, open_alert_types):
+        alert.save()
 
 @receiver(post_save, sender=RiskAssessment)
-def create_low_attendance_alert(sender, instance, created, **kwargs):
-    """Create alert when student attendance drops below threshold"""
-    if instance.attendance_rate and instance.attendance_rate < 75:
-        # Check if alert already exists
-        existing_alert = Alert.objects.filter(
-            student=instance.student,
-            alert_type='low_attendance',
-            resolved=False
-        ).exists()
-        
-        if not existing_alert:
-            severity = 'high' if instance.attendance_rate < 60 else 'medium'
-            Alert.objects.create(
-                student=instance.student,
-                alert_type='low_attendance',
-                severity=severity,
-                message=f'{instance.student.get_full_name()} has low attendance rate of {instance.attendance_rate}%. Intervention may be needed.'
-            )
+def update_current_risk(sender, instance, created, **kwargs):
+    """Keep the student's CurrentRisk row pointing at their newest assessment"""
+    if created:
+        refresh_current_risk([instance])
+
+@receiver(post_delete, sender=RiskAssessment)
+def recompute_current_risk_on_delete(sender, instance, **kwargs):
+    """Fall back to the student's newest remaining assessment when their current one is deleted"""
+    recompute_current_risk([instance.student_id])
 
 @receiver(post_save, sender=TeacherConcern)
 def create_teacher_concern_alert(sender, instance, created, **kwargs):
@@ -0,0 +1,7 @@
+from django.core.management import call_command
+from jobs.queue import task
+
+
+@task('calculate_risk', lease=30 * 60)
+def calculate_risk(job):
+    call_command('calculate_risk', **job.payload)
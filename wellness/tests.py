@@ -1,3 +1,224 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from importlib import import_module
+from unittest import mock
+
+from django.apps import apps
+from django.db.models import Avg
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from academics.models import Assignment, Attendance, Class, Grade, Submission
+from jobs.models import Job
+from jobs.queue import claim, execute
+from ml_models.models import SentimentAnalysis
+from .models import Alert, CurrentRisk, RiskAssessment, WellnessCheckIn
+from .risk import RiskEngine, build_risk_alerts, score_risk
+
+
+def per_student_assessment(student):
+    """(risk_level, risk_score, gpa, attendance_rate, missing) the way calculate_risk scored one student before RiskEngine"""
+    grades = Grade.objects.filter(student=student)
+    if grades.exists():
+        gpa = grades.aggregate(Avg('score'))['score__avg']
+        gpa = round(gpa / 25, 2) if gpa else 0
+    else:
+        gpa = 0
+
+    records = Attendance.objects.filter(student=student)
+    if records.exists():
+        attendance_rate = records.filter(status='present').count() / records.count() * 100
+    else:
+        attendance_rate = 100
+
+    total_assignments = Assignment.objects.filter(class_obj__in=student.enrolled_classes.all()).count()
+    missing = max(total_assignments - Submission.objects.filter(student=student).count(), 0)
+
+    checkin = WellnessCheckIn.objects.filter(student=student).order_by('-date').first()
+    flag = bool(checkin and (checkin.stress_level >= 4 or checkin.motivation_level <= 2 or checkin.need_help))
+
+    risk_score, risk_level = score_risk(gpa, attendance_rate, missing, flag)
+    return risk_level, risk_score, gpa, round(attendance_rate, 2), missing
+
+
+class RiskEngineTests(TestCase):
+    def setUp(self):
+        teacher = User.objects.create_user(username='teacher', password='pw', role='teacher')
+        self.classes = [Class.objects.create(name=f'Class {i}', code=f'RISK{i}', teacher=teacher, semester='1') for i in range(2)]
+        self.assignments = [
+            Assignment.objects.create(
+                class_obj=self.classes[i % 2], title=f'A{i}', description='', due_date=timezone.now(), total_points=100
+            )
+            for i in range(6)
+        ]
+
+    def add_students(self, count):
+        """Students spread over grades, attendance, submissions and check-ins"""
+        start = User.objects.filter(role='student').count()
+        students = []
+        for n in range(start, start + count):
+            student = User.objects.create_user(username=f'riskstudent{n}', password='pw', role='student')
+            self.classes[0].students.add(student)
+            if n % 2:
+                self.classes[1].students.add(student)
+            for k in range(n % 4):
+                Grade.objects.create(student=student, class_obj=self.classes[0], score=Decimal(40 + n * 7 % 60 + k), max_score=100)
+            for day in range(n % 5 * 2):
+                Attendance.objects.create(
+                    class_obj=self.classes[0], student=student, date=date.today() - timedelta(days=day),
+                    status='present' if (day + n) % 3 else 'absent',
+                )
+            for assignment in self.assignments[:n % 3]:
+                Submission.objects.create(assignment=assignment, student=student)
+            if n % 3 == 1:
+                WellnessCheckIn.objects.create(
+                    student=student, stress_level=2 + n % 4, motivation_level=3, workload_level=3, sleep_quality=3
+                )
+            students.append(student)
+        return students
+
+    def run_engine(self):
+        return RiskEngine(User.objects.filter(role='student')).run()
+
+    def test_matches_per_student_scoring(self):
+        students = self.add_students(12)
+        expected = {student.id: per_student_assessment(student) for student in students}
+
+        assessments = self.run_engine()
+        self.assertEqual(len(assessments), 12)
+        # More than one level, so the fixture actually exercises the scoring
+        self.assertGreater(len({assessment.risk_level for assessment in assessments}), 1)
+        for assessment in assessments:
+            self.assertEqual(
+                (assessment.risk_level, assessment.risk_score, assessment.gpa, assessment.attendance_rate, assessment.missing_assignments),
+                expected[assessment.student_id],
+            )
+
+    def test_query_count_is_fixed(self):
+        self.add_students(3)
+        # 5 reads, then assessments, CurrentRisk, open alerts and new alerts inside a savepoint
+        with self.assertNumQueries(11):
+            self.run_engine()
+
+        self.add_students(20)
+        with self.assertNumQueries(11):
+            self.run_engine()
+        # Besides each student's initial assessment from registration
+        self.assertEqual(RiskAssessment.objects.exclude(notes__startswith='Initial').count(), 26)
+
+    def test_alerts_are_not_duplicated(self):
+        student, = self.add_students(1)
+        assessment = RiskAssessment(student=student, risk_level='high', risk_score=80, gpa=1, attendance_rate=50, missing_assignments=6)
+        self.assertEqual(
+            [alert.alert_type for alert in build_risk_alerts(assessment, set())],
+            ['high_risk', 'missing_assignments', 'low_attendance'],
+        )
+        self.assertEqual([alert.alert_type for alert in build_risk_alerts(assessment, {'high_risk', 'low_attendance'})], ['missing_assignments'])
+
+        Alert.objects.create(student=student, alert_type='high_risk', severity='critical', message='')
+        Assignment.objects.bulk_create([
+            Assignment(class_obj=self.classes[0], title=f'B{i}', description='', due_date=timezone.now(), total_points=10)
+            for i in range(5)
+        ])
+        self.run_engine()
+        self.run_engine()
+        self.assertEqual(Alert.objects.filter(student=student, alert_type='high_risk').count(), 1)
+        self.assertEqual(Alert.objects.filter(student=student, alert_type='missing_assignments').count(), 1)
+
+
+class CurrentRiskTests(TestCase):
+    def setUp(self):
+        # Registration creates the student's initial assessment
+        self.student = User.objects.create_user(username='student', password='pw', role='student')
+        self.initial = RiskAssessment.objects.get(student=self.student)
+
+    def assess(self, risk_level, risk_score):
+        return RiskAssessment.objects.create(
+            student=self.student, risk_level=risk_level, risk_score=risk_score, gpa=2, attendance_rate=80, missing_assignments=1
+        )
+
+    def current(self):
+        return CurrentRisk.objects.filter(student=self.student).values_list('assessment', 'risk_level', 'risk_score').first()
+
+    def test_new_assessment_replaces_current(self):
+        self.assertEqual(self.current(), (self.initial.id, 'low', 0))
+        newest = self.assess('high', 70)
+        self.assertEqual(self.current(), (newest.id, 'high', 70))
+
+    def test_engine_updates_current(self):
+        assessment, = RiskEngine(User.objects.filter(pk=self.student.pk)).run()
+        self.assertEqual(self.current(), (assessment.id, assessment.risk_level, assessment.risk_score))
+        self.assertEqual(CurrentRisk.objects.count(), 1)
+
+    def test_deleting_the_current_assessment_falls_back(self):
+        older = self.assess('medium', 35)
+        newest = self.assess('high', 70)
+        # An older assessment goes without touching the current one
+        self.initial.delete()
+        self.assertEqual(self.current(), (newest.id, 'high', 70))
+
+        newest.delete()
+        self.assertEqual(self.current(), (older.id, 'medium', 35))
+        older.delete()
+        self.assertIsNone(self.current())
+
+    def test_deleting_a_queryset_keeps_the_newest_left(self):
+        older = self.assess('medium', 35)
+        self.assess('high', 70)
+        self.assess('high', 80)
+        RiskAssessment.objects.filter(risk_level='high').delete()
+        self.assertEqual(self.current(), (older.id, 'medium', 35))
+
+    def test_backfill_migration(self):
+        backfill = import_module('wellness.migrations.0005_currentrisk').backfill_current_risk
+        newest = self.assess('high', 70)
+        other = User.objects.create_user(username='other', password='pw', role='student')
+        CurrentRisk.objects.all().delete()
+
+        backfill(apps, None)
+        self.assertEqual(self.current(), (newest.id, 'high', 70))
+        self.assertEqual(CurrentRisk.objects.get(student=other).assessment, RiskAssessment.objects.get(student=other))
+
+
+class CheckinSentimentJobTests(TestCase):
+    def setUp(self):
+        self.student = User.objects.create_user(username='student', password='pw', role='student')
+        self.client.force_login(self.student)
+
+    def check_in(self, comments, escalate=True):
+        with mock.patch('ml_models.utils.prescreen_sentiment', return_value=escalate) as prescreen:
+            response = self.client.post(reverse('wellness:wellness_checkin'), {
+                'stress_level': 3, 'motivation_level': 3, 'workload_level': 3, 'sleep_quality': 3, 'comments': comments,
+            })
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        return prescreen
+
+    def test_escalated_checkin_is_queued(self):
+        self.check_in('I feel overwhelmed')
+        job = Job.objects.get()
+        self.assertEqual((job.name, job.payload), ('analyze_checkin_sentiment', {'checkin_id': WellnessCheckIn.objects.get().id}))
+
+    def test_settled_or_empty_checkins_are_not_queued(self):
+        self.check_in('Feeling fine', escalate=False)
+        self.check_in('').assert_not_called()
+        self.assertFalse(Job.objects.exists())
+
+    def test_job_skips_checkins_gemini_already_analyzed(self):
+        self.check_in('I feel overwhelmed')
+        SentimentAnalysis.objects.create(
+            wellness_checkin=WellnessCheckIn.objects.get(), sentiment='negative', confidence=0.9, alert_level='medium'
+        )
+        with mock.patch('ml_models.gemini_client.GeminiClient.analyze_sentiment') as analyze:
+            job = execute(claim('test'))
+        analyze.assert_not_called()
+        self.assertEqual(job.status, 'succeeded')
+        self.assertEqual(SentimentAnalysis.objects.get().alert_level, 'medium')
 
-# Create your tests here.
+    def test_api_errors_are_retried(self):
+        self.check_in('I feel overwhelmed')
+        with mock.patch('ml_models.gemini_client.GeminiClient.analyze_sentiment', side_effect=RuntimeError('unavailable')):
+            job = execute(claim('test'))
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertFalse(SentimentAnalysis.objects.exists())
@@ -4,9 +4,11 @@ from django.contrib import messages
 from django.db.models import Q, Count, Avg
 from django.utils import timezone
 from datetime import datetime, timedelta
-from .models import TeacherConcern, Intervention, Alert, RiskAssessment, WellnessCheckIn
+from .models import TeacherConcern, Intervention, Alert, CurrentRisk, WellnessCheckIn
 from .forms import TeacherConcernForm, InterventionForm
 from accounts.models import User
+from accounts.notifications import alerts_changed
+from jobs.queue import enqueue
 
 @login_required
 def create_concern(request, student_id=None):
@@ -60,7 +62,7 @@ def at_risk_students_list(request):
         return redirect('dashboard')
     
     # Get all students with risk assessments
-    risk_assessments = RiskAssessment.objects.select_related('student').order_by('-risk_score')
+    risk_assessments = CurrentRisk.objects.select_related('student').order_by('-risk_score')
     
     # Apply filters
     risk_filter = request.GET.get('risk_level', '')
@@ -110,15 +112,15 @@ def create_intervention(request, student_id=None):
     ai_recommendations = None
     selected_student = None
     if student_id:
-        selected_student = get_object_or_404(User, id=student_id, role='student')
-        risk_assessment = RiskAssessment.objects.filter(student=selected_student).order_by('-date').first()
+        selected_student = get_object_or_404(User.objects.select_related('current_risk'), id=student_id, role='student')
+        risk_assessment = getattr(selected_student, 'current_risk', None)
         
         if risk_assessment and risk_assessment.risk_level in ['medium', 'high']:
             try:
-                from ml_models.gemini_client import GeminiClient
+                from ml_models.gemini_client import shared_client
                 from ml_models.utils import get_student_profile_for_intervention
                 
-                client = GeminiClient()
+                client = shared_client()
                 profile = get_student_profile_for_intervention(selected_student)
                 result = client.recommend_intervention(profile)
                 ai_recommendations = result.get('recommendations', [])
@@ -143,7 +145,7 @@ def create_intervention(request, student_id=None):
     
     # Statistics
     total_students = User.objects.filter(role='student').count()
-    high_risk_count = RiskAssessment.objects.filter(risk_level='high').values('student').distinct().count()
+    high_risk_count = CurrentRisk.objects.filter(risk_level='high').count()
     unresolved_alerts = Alert.objects.filter(resolved=False, severity__in=['critical', 'high']).count()
     pending_interventions = Intervention.objects.filter(status='scheduled').count()
     
@@ -259,7 +261,7 @@ def bulk_create_interventions(request):
         resolved=False
     ).select_related('student').values_list('student', flat=True).distinct()
 
-    students = User.objects.filter(id__in=urgent_alerts, role='student')
+    students = User.objects.filter(id__in=urgent_alerts, role='student').select_related('current_risk')
     created_count = 0
 
     for student in students:
@@ -267,7 +269,7 @@ def bulk_create_interventions(request):
         if Intervention.objects.filter(student=student, status='scheduled').exists():
             continue
 
-        risk = RiskAssessment.objects.filter(student=student).order_by('-date').first()
+        risk = getattr(student, 'current_risk', None)
         intervention_type = 'counseling'
         if risk and risk.missing_assignments >= 3:
             intervention_type = 'tutoring'
@@ -288,6 +290,9 @@ def bulk_create_interventions(request):
         ).update(is_read=True)
         created_count += 1
 
+    if created_count > 0:
+        alerts_changed()
+
     if created_count > 0:
         messages.success(request, f'✅ Done! {created_count} intervention(s) created and alerts marked as read.')
     else:
@@ -334,9 +339,15 @@ def reports_view(request):
         return redirect('dashboard')
     
     # Risk level counts
-    high_risk_count = RiskAssessment.objects.filter(risk_level='high').values('student').distinct().count()
-    medium_risk_count = RiskAssessment.objects.filter(risk_level='medium').values('student').distinct().count()
-    low_risk_count = RiskAssessment.objects.filter(risk_level='low').values('student').distinct().count()
+    risk_stats = CurrentRisk.objects.aggregate(
+        high=Count('pk', filter=Q(risk_level='high')),
+        medium=Count('pk', filter=Q(risk_level='medium')),
+        low=Count('pk', filter=Q(risk_level='low')),
+        avg_attendance=Avg('attendance_rate'),
+    )
+    high_risk_count = risk_stats['high']
+    medium_risk_count = risk_stats['medium']
+    low_risk_count = risk_stats['low']
     total_students = User.objects.filter(role='student').count()
     
     # Intervention statistics
@@ -367,19 +378,16 @@ def reports_view(request):
             interventions_by_type.append({'type_display': choice[1], 'count': count})
     
     # Academic statistics (removed avg_gpa)
-    latest_assessments = RiskAssessment.objects.filter(
-        id__in=RiskAssessment.objects.values('student').annotate(latest=Count('id')).values('latest')
-    )
-    avg_attendance = latest_assessments.aggregate(Avg('attendance_rate'))['attendance_rate__avg']
+    avg_attendance = risk_stats['avg_attendance']
     
     total_concerns = TeacherConcern.objects.count()
     total_checkins = WellnessCheckIn.objects.count()
     
     # Age range analysis for high-risk students
     high_risk_students = User.objects.filter(
-        risk_assessments__risk_level='high',
+        current_risk__risk_level='high',
         date_of_birth__isnull=False
-    ).distinct()
+    )
     
     age_ranges = {
         '15-17': 0,
@@ -467,13 +475,18 @@ def generate_report(request):
     from django.template.loader import render_to_string
     
     # Get all data for report
-    high_risk_students = RiskAssessment.objects.filter(risk_level='high').select_related('student')
-    medium_risk_students = RiskAssessment.objects.filter(risk_level='medium').select_related('student')
+    high_risk_students = CurrentRisk.objects.filter(risk_level='high').select_related('student').order_by('-risk_score')
+    medium_risk_students = CurrentRisk.objects.filter(risk_level='medium').select_related('student').order_by('-risk_score')
     
     # Statistics
-    high_risk_count = high_risk_students.count()
-    medium_risk_count = medium_risk_students.count()
-    low_risk_count = RiskAssessment.objects.filter(risk_level='low').count()
+    risk_counts = CurrentRisk.objects.aggregate(
+        high=Count('pk', filter=Q(risk_level='high')),
+        medium=Count('pk', filter=Q(risk_level='medium')),
+        low=Count('pk', filter=Q(risk_level='low')),
+    )
+    high_risk_count = risk_counts['high']
+    medium_risk_count = risk_counts['medium']
+    low_risk_count = risk_counts['low']
     
     scheduled_interventions = Intervention.objects.filter(status='scheduled').count()
     completed_interventions = Intervention.objects.filter(status='completed').count()
@@ -512,17 +525,12 @@ def api_students(request):
     
     from django.http import JsonResponse
     students = User.objects.filter(role='student').values(
-        'id', 'first_name', 'last_name', 'email', 'year_level', 'section', 'gender'
+        'id', 'first_name', 'last_name', 'email', 'year_level', 'section', 'gender', 'current_risk__risk_level'
     )
     
     students_list = []
     for s in students:
-        # Get risk level for student
-        try:
-            risk_assessment = RiskAssessment.objects.filter(student_id=s['id']).latest('date')
-            risk_level = risk_assessment.risk_level
-        except RiskAssessment.DoesNotExist:
-            risk_level = None
+        risk_level = s['current_risk__risk_level']
         
         students_list.append({
             'id': s['id'],
@@ -560,33 +568,11 @@ def wellness_checkin(request):
             text_response=comments
         )
         
-        # AI Sentiment Analysis
-        if comments:
-            try:
-                from ml_models.gemini_client import GeminiClient
-                from ml_models.models import SentimentAnalysis
-                
-                client = GeminiClient()
-                result = client.analyze_sentiment(comments)
-                
-                SentimentAnalysis.objects.create(
-                    wellness_checkin=checkin,
-                    sentiment=result['sentiment'],
-                    confidence=result['confidence'],
-                    alert_level=result['alert_level'],
-                    concerning_phrases=result.get('concerning_phrases', [])
-                )
-                
-                # Create alert if high distress
-                if result['alert_level'] in ['high', 'critical']:
-                    Alert.objects.create(
-                        student=request.user,
-                        alert_type='emotional_distress',
-                        severity='high',
-                        description=f"Emotional distress detected in wellness check-in"
-                    )
-            except Exception as e:
-                pass  # Fail silently if AI analysis fails
+        # The local classifier screens the text now; Gemini only sees what it
+        # escalates, on the job worker so the student doesn't wait on it
+        from ml_models.utils import prescreen_sentiment
+        if comments and prescreen_sentiment(checkin, comments):
+            enqueue('analyze_checkin_sentiment', {'checkin_id': checkin.id})
         
         messages.success(request, 'Wellness check-in submitted successfully! Thank you for sharing.')
         return redirect('dashboard')